@@ -0,0 +1,241 @@
+"""
+告警规则引擎 - 按房间/表计类型的低电量阈值、滞回与快速耗电规则，每轮一次向量化评估
+
+规则来源：
+    [system]
+    low_power_threshold = 15        默认低电量阈值
+    low_power_rearm_kwh = 0         滞回：触发后需充值到该值以上才会再次告警（0 关闭，仅按冷却时间重复提醒）
+    drain_alert_kwh = 0             快速耗电：drain_alert_hours 小时内下降超过该值即告警（0 关闭）
+    drain_alert_hours = 6
+
+    [alerts.types]                  按表计类型覆盖（类型名同 [meters] 分类）
+    ac_a = threshold=20, rearm=30, drop=10/6
+
+    [alerts.rooms]                  按房间覆盖（绑定房间文字，忽略大小写）
+    3-721A空调 = threshold=25
+
+    规则值写法：threshold=阈值, rearm=滞回值, drop=度数/小时；只写一个数字等价于 threshold=数字。
+    优先级：房间 > 类型 > [system] 默认；未写的字段继承下一级。
+
+每个房间在内存中保留最近 alert_history_samples 次读数（环形缓冲），
+快速耗电 = 窗口内最高读数 - 当前读数（窗口内有充值时自然从充值后开始算）。
+规则参数、读数历史、滞回状态都按房间存成 NumPy 数组，评估成本与规则数量无关。
+"""
+import re
+import threading
+import time
+import unicodedata
+
+import numpy as np
+
+DEFAULT_SAMPLES = 96
+
+_FIELDS = ("threshold", "rearm", "drop_kwh", "drop_hours")
+
+
+def _room_key(room):
+    text = unicodedata.normalize("NFKC", str(room or ""))
+    return text.replace("\u200b", "").replace("\ufeff", "").strip().casefold()
+
+
+def parse_spec(text):
+    """'threshold=20, rearm=30, drop=10/6' -> {"threshold": 20.0, ...}（无法解析的字段忽略）"""
+    spec = {}
+    for part in re.split(r"[,，;；]", text or ""):
+        part = part.strip()
+        if not part:
+            continue
+        name, sep, value = part.partition("=")
+        if not sep:
+            name, value = "threshold", part
+        name = name.strip().lower()
+        try:
+            if name == "drop":
+                kwh, _, hours = value.partition("/")
+                spec["drop_kwh"] = float(kwh)
+                if hours.strip():
+                    spec["drop_hours"] = float(hours.strip().rstrip("hH"))
+            elif name in ("threshold", "rearm"):
+                spec[name] = float(value)
+        except ValueError:
+            continue
+    return spec
+
+
+class RuleSet:
+    """解析后的规则：默认值 + 类型覆盖 + 房间覆盖"""
+
+    def __init__(self, cfg):
+        self.default = {
+            "threshold": cfg.get_float("system", "low_power_threshold", 15.0),
+            "rearm": cfg.get_float("system", "low_power_rearm_kwh", 0.0),
+            "drop_kwh": cfg.get_float("system", "drain_alert_kwh", 0.0),
+            "drop_hours": cfg.get_float("system", "drain_alert_hours", 6.0),
+        }
+        self.types = self._section(cfg, "alerts.types", lambda k: k.strip())
+        self.rooms = self._section(cfg, "alerts.rooms", _room_key)
+        self.key = (tuple(sorted(self.default.items())),
+                    tuple(sorted((k, tuple(sorted(v.items()))) for k, v in self.types.items())),
+                    tuple(sorted((k, tuple(sorted(v.items()))) for k, v in self.rooms.items())))
+
+    @staticmethod
+    def _section(cfg, section, norm):
+        if not cfg.cp.has_section(section):
+            return {}
+        defaults = set(cfg.cp.defaults().keys())
+        out = {}
+        for k, v in cfg.cp.items(section, raw=True):
+            if k in defaults:
+                continue
+            spec = parse_spec(v)
+            if spec:
+                out[norm(k)] = spec
+        return out
+
+    def resolve(self, room_key, meter_type):
+        params = dict(self.default)
+        params.update(self.types.get(meter_type or "", {}))
+        params.update(self.rooms.get(room_key, {}))
+        return [params[f] for f in _FIELDS]
+
+
+class AlertRuleEngine:
+    """按房间的列式状态：参数矩阵、读数环形缓冲、滞回"已武装"标记"""
+
+    def __init__(self, samples=DEFAULT_SAMPLES):
+        self._lock = threading.Lock()
+        self._samples = samples
+        self._index = {}        # room_key -> 行号
+        self._types = []        # 行号 -> meter_type（用于规则变化时重新解析参数）
+        self._n = 0
+        self._alloc(0, samples)
+        self._rules_key = None
+
+    def _alloc(self, capacity, samples):
+        self._params = np.zeros((capacity, len(_FIELDS)))
+        self._hist = np.full((capacity, samples), np.nan)
+        self._times = np.full((capacity, samples), -np.inf)
+        self._ptr = np.zeros(capacity, dtype=np.int64)
+        self._armed = np.ones(capacity, dtype=bool)
+
+    def _grow(self, need):
+        cap = len(self._ptr)
+        if need <= cap:
+            return
+        new_cap = max(need, cap * 2, 64)
+        old = (self._params, self._hist, self._times, self._ptr, self._armed)
+        self._alloc(new_cap, self._samples)
+        self._params[:cap], self._hist[:cap], self._times[:cap], self._ptr[:cap], self._armed[:cap] = old
+
+    def _resize_history(self, samples):
+        """调整每个房间保留的历史条数（保留最近的读数）"""
+        if samples == self._samples:
+            return
+        n = self._n
+        order = (self._ptr[:n, None] + np.arange(self._samples)[None, :]) % self._samples  # 旧 -> 新
+        hist = np.take_along_axis(self._hist[:n], order, axis=1)[:, -samples:]
+        times = np.take_along_axis(self._times[:n], order, axis=1)[:, -samples:]
+        keep = hist.shape[1]
+        self._samples = samples
+        cap = len(self._ptr)
+        self._hist = np.full((cap, samples), np.nan)
+        self._times = np.full((cap, samples), -np.inf)
+        self._hist[:n, samples - keep:] = hist
+        self._times[:n, samples - keep:] = times
+        self._ptr[:n] = 0
+
+    def evaluate(self, items, cfg, now=None):
+        """记录本轮读数并评估规则，返回触发的事件列表。
+
+        事件：{"kind": "low_power"|"drain", "item": 触发的 Reading, "kwh": 当前读数,
+               "threshold": 阈值, "drop": 下降度数, "hours": 窗口小时数}
+        """
+        now = time.time() if now is None else now
+        rules = RuleSet(cfg)
+        samples = max(2, cfg.get_int("system", "alert_history_samples", DEFAULT_SAMPLES))
+
+        keyed = []
+        for d in items:
+            key = _room_key(d.room)
+            if key:
+                keyed.append((key, d))
+        if not keyed:
+            return []
+
+        with self._lock:
+            self._resize_history(samples)
+            rows = np.empty(len(keyed), dtype=np.int64)
+            new_rows = []
+            for i, (key, d) in enumerate(keyed):
+                r = self._index.get(key)
+                if r is None:
+                    r = self._index[key] = self._n
+                    self._n += 1
+                    self._types.append(d.meter_type)
+                    new_rows.append((r, key))
+                elif self._types[r] != d.meter_type and d.meter_type not in (None, "unknown"):
+                    self._types[r] = d.meter_type
+                    new_rows.append((r, key))
+                rows[i] = r
+            self._grow(self._n)
+
+            if rules.key != self._rules_key:
+                # 规则变化：重新解析全部房间的参数；否则只解析新房间
+                self._rules_key = rules.key
+                new_rows = [(r, k) for k, r in self._index.items()]
+            for r, key in new_rows:
+                self._params[r] = rules.resolve(key, self._types[r])
+
+            kwh = np.fromiter((np.nan if d.kwh is None else d.kwh for _k, d in keyed), dtype=float, count=len(keyed))
+            valid = ~np.isnan(kwh)
+            rows, kwh, idx = rows[valid], kwh[valid], np.flatnonzero(valid)
+            # 同一房间在一轮里出现多次时只保留最后一次
+            rows_rev = rows[::-1]
+            _u, first = np.unique(rows_rev, return_index=True)
+            pick = len(rows) - 1 - first
+            rows, kwh, idx = rows[pick], kwh[pick], idx[pick]
+            if len(rows) == 0:
+                return []
+
+            # 写入环形缓冲
+            pos = self._ptr[rows]
+            self._hist[rows, pos] = kwh
+            self._times[rows, pos] = now
+            self._ptr[rows] = (pos + 1) % self._samples
+
+            params = self._params[rows]
+            thresh, rearm, drop_kwh, drop_hours = params.T
+
+            # 滞回：rearm > 阈值时启用；读数回到 rearm 以上重新武装
+            hysteresis = rearm > thresh
+            armed = self._armed[rows] | ~hysteresis | (kwh >= rearm)
+            low = kwh < thresh
+            fire_low = low & armed
+            self._armed[rows] = armed & ~(fire_low & hysteresis)
+
+            # 快速耗电：窗口内最高读数 - 当前读数
+            window = self._times[rows] >= (now - drop_hours * 3600.0)[:, None]
+            peak = np.where(window & ~np.isnan(self._hist[rows]), self._hist[rows], -np.inf).max(axis=1)
+            drop = peak - kwh
+            fire_drain = (drop_kwh > 0) & (drop >= drop_kwh)
+
+        events = []
+        for j in np.flatnonzero(fire_low):
+            events.append({"kind": "low_power", "item": keyed[idx[j]][1], "kwh": float(kwh[j]),
+                           "threshold": float(thresh[j])})
+        for j in np.flatnonzero(fire_drain):
+            events.append({"kind": "drain", "item": keyed[idx[j]][1], "kwh": float(kwh[j]),
+                           "threshold": float(thresh[j]), "drop": round(float(drop[j]), 2),
+                           "hours": float(drop_hours[j])})
+        return events
+
+    def reset(self):
+        with self._lock:
+            self._index.clear()
+            self._types = []
+            self._n = 0
+            self._alloc(0, self._samples)
+            self._rules_key = None
+
+
+engine = AlertRuleEngine()
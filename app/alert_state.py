@@ -0,0 +1,90 @@
+"""
+告警冷却持久化 - 把"上次发送时间"写入 SQLite 的 alert_cooldown 表
+
+- 启动时一次性批量加载（只加载保留期内的记录）；
+- 运行中照常按 dict 读写，赋值只标记为脏；
+- 每轮监控结束时把脏记录一次性 INSERT OR REPLACE，并顺带删除过期记录。
+容器重启后冷却期仍然有效，不会把低电量/修复邮件重新发一遍。
+"""
+import threading
+import time
+from config import logger
+from power_db import get_db
+
+# 超过该时长的冷却记录不再有意义（最长的冷却是修复邮件 12 小时，留足余量）
+RETENTION_SECONDS = 7 * 86400
+
+
+class CooldownMap(dict):
+    """key -> 上次发送时间戳；记录修改过的 key，flush 时批量写库"""
+
+    def __init__(self, kind):
+        super().__init__()
+        self.kind = kind
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        with self._lock:
+            self._dirty.add(key)
+
+    def take_dirty(self):
+        with self._lock:
+            keys, self._dirty = self._dirty, set()
+        return [(self.kind, k, self[k]) for k in keys if k in self]
+
+    def mark_dirty(self, keys):
+        with self._lock:
+            self._dirty.update(keys)
+
+
+def load(*kinds, now=None):
+    """批量加载各类冷却记录，返回 {kind: CooldownMap}；读库失败时返回空表（退回进程内冷却）"""
+    maps = {kind: CooldownMap(kind) for kind in kinds}
+    cutoff = (now or time.time()) - RETENTION_SECONDS
+    try:
+        conn = get_db()
+        try:
+            rows = conn.execute(
+                "SELECT kind, key, last_sent FROM alert_cooldown WHERE last_sent >= ?", (cutoff,)
+            ).fetchall()
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.error(f"[冷却] 加载失败，本次运行仅使用内存记录: {e}")
+        return maps
+    for r in rows:
+        m = maps.get(r["kind"])
+        if m is not None:
+            dict.__setitem__(m, r["key"], r["last_sent"])
+    if rows:
+        logger.info(f"⏳ 已恢复 {len(rows)} 条告警冷却记录")
+    return maps
+
+
+def flush(*maps, now=None):
+    """把本轮修改过的冷却记录一次性写库；失败时保留脏标记，下一轮重试"""
+    pending = []
+    for m in maps:
+        pending.extend(m.take_dirty())
+    if not pending:
+        return 0
+    try:
+        conn = get_db()
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO alert_cooldown (kind, key, last_sent) VALUES (?, ?, ?)", pending
+                )
+                conn.execute("DELETE FROM alert_cooldown WHERE last_sent < ?",
+                             ((now or time.time()) - RETENTION_SECONDS,))
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.error(f"[冷却] 写入失败，下一轮重试: {e}")
+        by_kind = {m.kind: m for m in maps}
+        for kind, key, _t in pending:
+            by_kind[kind].mark_dirty([key])
+        return 0
+    return len(pending)
@@ -1,40 +1,25 @@
-from flask import Blueprint, request, jsonify
-from power_db import get_db
-from datetime import datetime, timedelta
-
-api = Blueprint('api', __name__)
-
-# ...existing code...
-
-# 获取指定房间过去7天耗电数据
-@api.route('/api/room_power_trend')
-def room_power_trend():
-    room = request.args.get('room')
-    if not room:
-        return jsonify({'error': 'room参数缺失'}), 400
-    today = datetime.now().date()
-    days = [(today - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(6, -1, -1)]
-    conn = get_db()
-    try:
-        sql = '''
-            SELECT date, consume_power FROM power_daily
-            WHERE room=? AND date BETWEEN ? AND ?
-            ORDER BY date
-        '''
-        rows = conn.execute(sql, (room, days[0], days[-1])).fetchall()
-        data = {r['date']: r['consume_power'] for r in rows}
-        result = [{'date': d, 'consume_power': float(data.get(d, 0))} for d in days]
-        return jsonify({'room': room, 'trend': result})
-    finally:
-        conn.close()
 """
 API路由模块 - 提供RESTful API接口 (已添加权限控制)
 """
 import re
-from flask import Blueprint, jsonify, request
+from datetime import datetime, timedelta
+from flask import Blueprint, Response, jsonify, request, send_file
 from config import Config, logger, CONFIG_FILE
-from monitor import system_status
+from monitor import system_status, endpoint_guard
 from auth import manual_set_cookie
+from power_archive import daily_consumption
+import page_cache
+import power_forecast
+import power_export
+import power_import
+import power_maintenance
+import power_tasks
+import room_history
+import tracing
+import log_pipeline
+import source_registry
+import status_delta
+from power_db import init_db
 
 # 创建蓝图
 api_bp = Blueprint('api', __name__, url_prefix='/api')
@@ -61,12 +46,13 @@ def get_login_state():
         logger.error(f"获取登录状态失败: {e}")
         return jsonify({"success": False, "message": str(e)}), 500
 
-@api_bp.route('/status')
-def get_status():
-    """获取系统状态 (公开)"""
-    cfg = Config()
+# 配置派生字段：增量响应中只在配置变化后才返回
+_STATUS_CONFIG_FIELDS = ("has_cookie", "cookie_preview", "interval", "auth_sources", "auth_labels",
+                         "auth_configured", "notify_sources_configured")
+
+
+def _status_config_fields(cfg, interval):
     sources = cfg.get_auth_sources()
-    labels = cfg.get_auth_labels()
     source_recipient_map = cfg.get_source_recipient_map()
     cookies = {}
     for s in sources:
@@ -76,27 +62,152 @@ def get_status():
 
     # 兼容旧字段：has_cookie / cookie_preview
     cookie = next(iter(cookies.values()), cfg.get("auth", "cookie"))
-    interval = cfg.get_int("system", "interval", 900)
-    next_check_in = system_status.get("next_check_in", interval)
-    
-    return jsonify({
-        "success": True,
+    return {
         "has_cookie": bool(cookie),
-        "cookie_preview": cookie[:20] + "..." if cookie else "",
-        "is_monitoring": system_status["is_monitoring"],
-        "last_check_time": system_status["last_check_time"],
-        "last_error": system_status["last_error"],
-        "consecutive_failures": system_status["consecutive_failures"],
+        "cookie_preview": log_pipeline.redact(cookie) if cookie else "",
         "interval": interval,
-        "next_check_in": next_check_in,
-        "rooms": system_status["last_check_data"] or [],
         "auth_sources": sources,
-        "auth_labels": labels,
+        "auth_labels": cfg.get_auth_labels(),
         "auth_configured": list(cookies.keys()),
         # 公开接口不返回收件人列表，只返回哪些 source 配置了默认收件人
         "notify_sources_configured": list(source_recipient_map.keys()),
-        "source_status": system_status.get("sources", {})
-    })
+    }
+
+
+@api_bp.route('/status')
+def get_status():
+    """获取系统状态 (公开)
+
+    - ?fields=last_error,rooms.kwh,rooms.money：只返回列出的字段；rooms / source_status / forecast
+      可用 .子字段 只取部分子字段（rooms 始终带 room）。
+    - ?since=<version>：只返回该版本之后变化的房间、source 状态、预测与配置字段，删除的 key 见
+      rooms_removed / source_status_removed / forecast.removed；其余状态字段很小，每次都返回。
+    - 响应带 version 供下次请求使用；full=true 表示本次为全量（未带 since 或 since 已失效）。
+    """
+    top, sub = status_delta.parse_fields(request.args.get('fields'))
+
+    def want(name):
+        return top is None or name in top
+
+    try:
+        since = int(request.args['since']) if request.args.get('since') else None
+    except ValueError:
+        return jsonify({"success": False, "message": "since参数错误"}), 400
+    versions = status_delta.versions
+    full = not versions.valid_since(since)
+
+    cfg = Config()
+    interval = cfg.get_int("system", "interval", 900)
+    config_part = None
+    if any(want(f) for f in _STATUS_CONFIG_FIELDS):
+        config_part = _status_config_fields(cfg, interval)
+        versions.update("config", config_part)
+    # 先取版本号再取变化集合：之后发生的变化下次还会再返回，不会漏
+    out = {"success": True, "version": versions.version, "full": full}
+
+    def changes(section):
+        if full:
+            return None, []
+        return versions.changed_since(section, since)
+
+    if config_part is not None:
+        changed, _gone = changes("config")
+        for k, v in config_part.items():
+            if want(k) and (changed is None or k in changed):
+                out[k] = v
+
+    scalars = {
+        "is_monitoring": lambda: system_status["is_monitoring"],
+        "last_check_time": lambda: system_status["last_check_time"],
+        "last_error": lambda: system_status["last_error"],
+        "consecutive_failures": lambda: system_status["consecutive_failures"],
+        "next_check_in": lambda: system_status.get("next_check_in", interval),
+        # 学校接口限流/熔断状态与被短路的请求数
+        "school_endpoint": endpoint_guard.snapshot,
+        # 页面未变化短路：命中/未命中与跳过的写库次数
+        "page_cache": page_cache.snapshot,
+        # 分片监控（monitor_shards >= 2）时各工作进程的状态
+        "shards": lambda: system_status.get("shards"),
+        # 最近一次数据库维护（备份/ANALYZE/增量回收/检查点）的耗时与回收字节数
+        "db_maintenance": power_maintenance.snapshot,
+    }
+    for k, fn in scalars.items():
+        if want(k):
+            out[k] = fn()
+
+    if want("rooms"):
+        changed, gone = changes("rooms")
+        keep = sub.get("rooms")
+        out["rooms"] = [status_delta.project(r.to_dict(), keep, "room") for r in system_status["last_check_data"] or []
+                        if changed is None or r.room in changed]
+        if not full:
+            out["rooms_removed"] = gone
+    if want("source_status"):
+        changed, gone = changes("source_status")
+        keep = sub.get("source_status")
+        out["source_status"] = {s: status_delta.project(st, keep) for s, st in list(system_status.get("sources", {}).items())
+                                if changed is None or s in changed}
+        if not full:
+            out["source_status_removed"] = gone
+    if want("forecast"):
+        # 每个房间的耗尽预测（监控线程每轮更新的缓存）
+        changed, gone = changes("forecast")
+        keep = sub.get("forecast")
+        snap = power_forecast.snapshot()
+        out["forecast"] = {
+            "updated_at": snap["updated_at"],
+            "rooms": {r: status_delta.project(fc, keep) for r, fc in snap["rooms"].items()
+                      if changed is None or r in changed},
+        }
+        if not full:
+            out["forecast"]["removed"] = gone
+    return jsonify(out)
+
+@api_bp.route('/sparklines')
+def sparklines():
+    """所有房间（或 rooms= 逗号分隔的房间）最近 n 个读数点，来自内存环形缓冲 (公开)
+
+    返回 {"rooms": {room: {"t": [Unix秒...], "v": [度...]}}}，按时间从旧到新；不访问数据库。
+    """
+    try:
+        n = int(request.args.get('n', 0)) or None
+    except ValueError:
+        return jsonify({'success': False, 'message': 'n参数错误'}), 400
+    rooms = request.args.get('rooms')
+    rooms = [r for r in (x.strip() for x in rooms.split(',')) if r] if rooms else None
+    ring = room_history.ring
+    return jsonify({"success": True, "points": ring.points, "rooms": ring.last(n, rooms)})
+
+
+TREND_PUBLIC_MAX_DAYS = 90
+TREND_MAX_DAYS = 3660
+
+
+@api_bp.route('/room_power_trend')
+def room_power_trend():
+    """获取指定房间过去 N 天（默认7天）耗电数据 (公开)
+
+    历史数据透明合并：超过保留期的月份从列式归档读取，其余从 SQLite 读取。
+    每次请求都要扫描原始读数，匿名访问最多 TREND_PUBLIC_MAX_DAYS 天，携带管理员 Token 可查至 TREND_MAX_DAYS 天。
+    """
+    room = request.args.get('room')
+    if not room:
+        return jsonify({'error': 'room参数缺失'}), 400
+    source = (request.args.get('source') or '').strip() or None
+    try:
+        max_days = TREND_MAX_DAYS if check_auth() else TREND_PUBLIC_MAX_DAYS
+        n_days = max(1, min(int(request.args.get('days', 7)), max_days))
+    except ValueError:
+        return jsonify({'error': 'days参数错误'}), 400
+    today = datetime.now().date()
+    days = [(today - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(n_days - 1, -1, -1)]
+    try:
+        data = daily_consumption(days[0], days[-1], source=source, room=room, cfg=Config())
+    except Exception as e:
+        logger.error(f"查询耗电趋势失败: {e}")
+        return jsonify({'error': str(e)}), 500
+    result = [{'date': d, 'consume_power': round(float(data.get(d, 0)), 2)} for d in days]
+    return jsonify({'room': room, 'trend': result})
 
 @api_bp.route('/config', methods=['GET', 'POST'])
 def manage_config():
@@ -143,8 +254,7 @@ def manage_config():
                         continue
                     seen.add(k)
                     normalized.append(s)
-                cfg._ensure_section('system')
-                cfg.cp.set('system', 'auth_sources', ','.join(normalized))
+                cfg.set_auth_sources(normalized)
 
             # 房间收件人映射（notify.rooms）
             # 允许两种格式：
@@ -175,17 +285,8 @@ def manage_config():
                 # 过滤保留键
                 room_map = {str(k).strip(): v for k, v in room_map.items() if not is_reserved_room_key(str(k))}
 
-                # 以本次提交为准：移除未提交的旧映射
-                existing = set(cfg.get_room_recipient_map().keys())
-                incoming = set([str(k).strip() for k in room_map.keys() if str(k).strip() and str(k).strip().casefold() != "config_file"])
-                for old_room in existing - incoming:
-                    cfg.set_room_recipients(old_room, [])
-
-                # 写入新映射（允许清空某个房间）
-                for room_key, recipients in room_map.items():
-                    if str(room_key).strip().casefold() == "config_file":
-                        continue
-                    cfg.set_room_recipients(room_key, recipients)
+                # 以本次提交为准：整体替换（未提交的旧映射被移除，收件人为空的房间不保存）
+                cfg.replace_room_recipient_map(room_map)
 
             # source 默认收件人映射（notify.sources）
             # 允许两种格式：
@@ -215,15 +316,7 @@ def manage_config():
 
                 src_map = {str(k).strip(): v for k, v in src_map.items() if not is_reserved_source_key(str(k))}
 
-                existing = set(cfg.get_source_recipient_map().keys())
-                incoming = set([str(k).strip() for k in src_map.keys() if str(k).strip() and str(k).strip().casefold() != "config_file"])
-                for old_src in existing - incoming:
-                    cfg.set_source_recipients(old_src, [])
-
-                for src, recipients in src_map.items():
-                    if str(src).strip().casefold() == "config_file":
-                        continue
-                    cfg.set_source_recipients(src, recipients)
+                cfg.replace_source_recipient_map(src_map)
 
             # source 显示名称（auth.labels）
             # - {"auth_labels": {"X3-721B": "西三721B"}}
@@ -246,30 +339,8 @@ def manage_config():
                 else:
                     return jsonify({"success": False, "message": "auth_labels 类型错误"}), 400
 
-                section = 'auth.labels'
-                cfg._ensure_section(section)
-                defaults = set(cfg.cp.defaults().keys())
-                # 先清理旧值（以本次提交为准）
-                if cfg.cp.has_section(section):
-                    for key, _v in list(cfg.cp.items(section)):
-                        k = str(key or '').strip()
-                        if not k:
-                            continue
-                        if k in defaults or k.casefold() == 'config_file':
-                            continue
-                        if k not in labels_map:
-                            cfg.cp.remove_option(section, k)
-
-                for src, label in labels_map.items():
-                    s = str(src or '').strip()
-                    if not s or s in defaults or s.casefold() == 'config_file':
-                        continue
-                    v = str(label or '').strip()
-                    if v:
-                        cfg.cp.set(section, s, v)
-                    else:
-                        if cfg.cp.has_option(section, s):
-                            cfg.cp.remove_option(section, s)
+                # 以本次提交为准
+                cfg.replace_auth_labels(labels_map)
             
             # 更新配置
             if 'interval' in data:
@@ -470,4 +541,210 @@ def admin_login():
             
     except Exception as e:
         logger.error(f"管理员登录失败: {e}")
-        return jsonify({"success": False, "message": str(e)}), 500
\ No newline at end of file
+        return jsonify({"success": False, "message": str(e)}), 500
+
+
+# ===========================
+# 监控轮次追踪 / 性能剖析（管理员）
+# ===========================
+
+@api_bp.route('/admin/traces')
+def get_cycle_traces():
+    """最近若干轮监控的各阶段耗时（?limit=N&spans=0 只看汇总）"""
+    if not check_auth():
+        return jsonify({"success": False, "message": "权限不足"}), 401
+    limit = request.args.get('limit', default=20, type=int)
+    with_spans = request.args.get('spans', '1') not in ('0', 'false', 'no')
+    return jsonify({"success": True, "cycles": tracing.tracer.recent(limit, with_spans=with_spans)})
+
+
+@api_bp.route('/admin/profile', methods=['GET', 'POST'])
+def cycle_profile():
+    """GET 查看剖析状态；POST {"cycles": K} 对接下来 K 轮监控启用 cProfile"""
+    if not check_auth():
+        return jsonify({"success": False, "message": "权限不足"}), 401
+    if request.method == 'GET':
+        return jsonify({"success": True, "profile": tracing.profiler.status()})
+
+    data = request.get_json(silent=True) or {}
+    try:
+        cycles = max(1, min(int(data.get('cycles', 1)), 100))
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "cycles 必须为整数"}), 400
+    if not tracing.profiler.request(cycles):
+        return jsonify({"success": False, "message": "已有剖析任务在进行中"}), 409
+    logger.info(f"🔬 已请求对接下来 {cycles} 轮监控进行性能剖析")
+    return jsonify({"success": True, "message": f"将对接下来 {cycles} 轮监控进行剖析"})
+
+
+@api_bp.route('/admin/profile/download')
+def download_cycle_profile():
+    """下载最近一次剖析结果（pstats 格式，可用 snakeviz / python -m pstats 打开）"""
+    if not check_auth():
+        return jsonify({"success": False, "message": "权限不足"}), 401
+    path = tracing.profiler.last_file
+    if not path:
+        return jsonify({"success": False, "message": "暂无剖析结果"}), 404
+    return send_file(path, mimetype="application/octet-stream", as_attachment=True,
+                     download_name="monitor_cycles.prof")
+
+
+# ===========================
+# source 注册表（管理员）
+# ===========================
+
+@api_bp.route('/admin/sources/export')
+def export_sources():
+    """导出全部 source（含 Cookie）与房间收件人，需已迁移到注册表"""
+    if not check_auth():
+        return jsonify({"success": False, "message": "权限不足"}), 401
+    if not source_registry.is_active():
+        return jsonify({"success": False, "message": "尚未迁移到 source 注册表"}), 409
+    return jsonify({"success": True, **source_registry.export_all()})
+
+
+@api_bp.route('/admin/sources/import', methods=['POST'])
+def import_sources():
+    """批量导入 {"sources": [...], "rooms": [...], "replace": false}（一次事务）"""
+    if not check_auth():
+        return jsonify({"success": False, "message": "权限不足"}), 401
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"success": False, "message": "请求体必须是 JSON 对象"}), 400
+    for s in data.get("sources") or []:
+        name = str((s or {}).get("source") or "").strip()
+        if name and not re.match(r'^[A-Za-z0-9_-]+$', name):
+            return jsonify({"success": False, "message": f"source 名称不合法: {name}（仅允许 A-Za-z0-9_-）"}), 400
+    try:
+        init_db()
+        if not source_registry.is_active():
+            # 首次导入前先把 config.ini 中已有的内容迁移过来，避免两边各存一半
+            source_registry.migrate_from_config()
+        n_src, n_room = source_registry.import_all(data, replace=bool(data.get("replace")))
+    except Exception as e:
+        logger.error(f"导入 source 失败: {e}")
+        return jsonify({"success": False, "message": str(e)}), 500
+    return jsonify({"success": True, "message": f"已导入 {n_src} 个 source、{n_room} 条房间收件人"})
+
+
+@api_bp.route('/admin/sources/migrate', methods=['POST'])
+def migrate_sources():
+    """把 config.ini 中的 source/Cookie/收件人迁入注册表（会备份 config.ini）"""
+    if not check_auth():
+        return jsonify({"success": False, "message": "权限不足"}), 401
+    try:
+        result = source_registry.migrate_from_config()
+    except Exception as e:
+        logger.error(f"迁移 source 注册表失败: {e}")
+        return jsonify({"success": False, "message": str(e)}), 500
+    if result is None:
+        return jsonify({"success": True, "message": "已迁移，无需重复执行"})
+    return jsonify({"success": True, "message": f"已迁移 {result['sources']} 个 source、{result['rooms']} 条房间收件人", **result})
+
+
+# ===========================
+# 历史数据导出（管理员）
+# ===========================
+
+@api_bp.route('/admin/export')
+def export_history():
+    """流式导出历史数据（CSV / NDJSON，可选 gzip），不把结果集整体读入内存
+
+    ?kind=readings|daily&format=csv|ndjson&source=&room=&start=YYYY-MM-DD&end=YYYY-MM-DD&gzip=1&archive=0
+    """
+    if not check_auth():
+        return jsonify({"success": False, "message": "权限不足"}), 401
+    args = request.args
+    kind = (args.get('kind') or 'readings').strip().lower()
+    fmt = (args.get('format') or 'csv').strip().lower()
+    compress = args.get('gzip', '0') in ('1', 'true', 'yes')
+    cfg = Config()
+    try:
+        stream = power_export.stream_export(
+            kind, fmt,
+            source=(args.get('source') or '').strip() or None,
+            room=(args.get('room') or '').strip() or None,
+            start=(args.get('start') or '').strip() or None,
+            end=(args.get('end') or '').strip() or None,
+            compress=compress,
+            include_archive=args.get('archive', '1') not in ('0', 'false', 'no'),
+            chunk=cfg.get_int("system", "export_chunk_rows", power_export.DEFAULT_CHUNK_ROWS),
+            cfg=cfg,
+        )
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    filename = f"{kind}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}" + (".gz" if compress else "")
+    if compress:
+        mimetype = "application/gzip"
+    elif fmt == "csv":
+        mimetype = "text/csv; charset=utf-8"
+    else:
+        mimetype = "application/x-ndjson; charset=utf-8"
+    logger.info(f"📤 开始导出 {filename}")
+    return Response(stream, mimetype=mimetype, headers={
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        # 反向代理不要缓冲整个响应
+        "X-Accel-Buffering": "no",
+    })
+
+
+@api_bp.route('/admin/import', methods=['POST'])
+def import_history():
+    """批量导入历史读数：请求体为 CSV / NDJSON（可 gzip），或 multipart 上传的 file 字段
+
+    ?format=csv|ndjson（默认自动识别）&source=文件中没有 source 列时使用&dry_run=1 只校验不写入
+    """
+    if not check_auth():
+        return jsonify({"success": False, "message": "权限不足"}), 401
+    args = request.args
+    fmt = (args.get('format') or '').strip().lower() or None
+    default_source = (args.get('source') or '').strip() or None
+    dry_run = args.get('dry_run', '0') in ('1', 'true', 'yes')
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('file')
+        if upload is None:
+            return jsonify({"success": False, "message": "缺少 file 字段"}), 400
+        stream = upload.stream
+    else:
+        stream = request.stream
+    cfg = Config()
+    try:
+        result = power_import.import_readings(
+            stream, fmt=fmt, default_source=default_source, dry_run=dry_run,
+            batch_rows=cfg.get_int("system", "import_batch_rows", power_import.DEFAULT_BATCH_ROWS),
+            archive_after_days=cfg.get_int("system", "archive_after_days", 180),
+        )
+    except power_import.ImportFormatError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except Exception as e:
+        logger.error(f"导入历史读数失败: {e}")
+        return jsonify({"success": False, "message": str(e)}), 500
+    if result.get("error"):
+        return jsonify({"success": False, "message": f"导入中途失败（已提交 {result['inserted']} 行）: {result['error']}",
+                        "result": result}), 500
+    return jsonify({"success": True, "result": result})
+
+
+@api_bp.route('/admin/rebuild-daily', methods=['POST'])
+def rebuild_daily_range():
+    """重算一段日期的每日统计：JSON {"start": "YYYY-MM-DD", "end": 可选, "sources": 可选列表,
+    "missing_only": 可选，true 只补算没有统计的 (source, 日期)}"""
+    if not check_auth():
+        return jsonify({"success": False, "message": "权限不足"}), 401
+    data = request.get_json(silent=True) or {}
+    start = str(data.get('start') or '').strip()
+    end = str(data.get('end') or '').strip() or start
+    sources = data.get('sources')
+    if not start:
+        return jsonify({"success": False, "message": "缺少 start"}), 400
+    if sources is not None and not isinstance(sources, list):
+        return jsonify({"success": False, "message": "sources 必须是列表"}), 400
+    try:
+        result = power_tasks.backfill_daily(start, end, sources=sources, missing_only=bool(data.get('missing_only')))
+    except ValueError as e:
+        return jsonify({"success": False, "message": f"日期参数错误: {e}"}), 400
+    except Exception as e:
+        logger.error(f"重算每日统计失败: {e}")
+        return jsonify({"success": False, "message": str(e)}), 500
+    return jsonify({"success": True, "result": result})
@@ -1,6 +1,7 @@
 """
 登录认证模块 - 负责微信扫码登录
 """
+import hashlib
 import os
 import time
 import threading
@@ -13,7 +14,9 @@ from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
 from webdriver_manager.chrome import ChromeDriverManager
 from config import Config, logger
-from monitor import parse_data, TARGET_URL, request_immediate_check
+import metrics
+from monitor import parse_data, TARGET_URL, request_immediate_check, forget_page_cache
+from reading import fmt
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 LOGIN_URL = "https://ids.lit.edu.cn/authserver/login?service=http%3A%2F%2Fzhyd.sec.lit.edu.cn%2Fzhyd%2Fsydl%2Findex"
@@ -115,19 +118,22 @@ def handle_login_success(driver, source=None):
     cookie_str = f"JSESSIONID={jsessionid}"
     ua = driver.execute_script("return navigator.userAgent;")
     
-    logger.info(f"🔐 保存Cookie: {cookie_str[:50]}...")
+    # 不记录 Cookie 值（哪怕截断/脱敏），只记录长度与短指纹便于核对是否换了新会话
+    fingerprint = hashlib.sha256(cookie_str.encode()).hexdigest()[:8]
+    logger.info("🔐 保存Cookie: 长度 %d, 指纹 %s (source=%s)", len(cookie_str), fingerprint, source or "default")
 
     # 保存到配置
     Config().update_auth(cookie_str, ua, source=source)
 
     # 立刻触发下一轮抓取，避免等待 interval
-    request_immediate_check(reason=f"login_success source={source or 'default'}")
+    forget_page_cache(source)  # 新会话：不再信任旧 Cookie 下缓存的"未变化"页面
+    request_immediate_check(reason=f"login_success source={source or 'default'}", source=source)
 
     # 解析数据并发送邮件
     data = parse_data(driver.page_source)
     msg_content = "监控已恢复。"
     if data:
-        lines = [f"🏠 {d['room']} | ⚡ {d['kwh']}度 | 💰 {d['money']}元" for d in data]
+        lines = [f"🏠 {r.room} | ⚡ {fmt(r.kwh)}度 | 💰 {fmt(r.money)}元" for r in data]
         msg_content += "\n\n" + "\n".join(lines)
 
     Config().send_email("✅ 监控恢复成功", msg_content)
@@ -136,7 +142,19 @@ def handle_login_success(driver, source=None):
 
 
 def selenium_login_task(source=None, run_id=None):
-    """扫码登录任务"""
+    """扫码登录任务（记录尝试次数与耗时指标）"""
+    started = time.time()
+    try:
+        _selenium_login_flow(source, run_id)
+    finally:
+        # 被新一轮登录顶替的旧任务此时 login_status 属于新任务，记为 aborted
+        result = login_status if login_status in ("success", "failed", "timeout") else "aborted"
+        metrics.LOGIN_ATTEMPTS.labels(result).inc()
+        metrics.LOGIN_SECONDS.labels(result).observe(time.time() - started)
+
+
+def _selenium_login_flow(source=None, run_id=None):
+    """扫码登录流程"""
     global driver_instance, login_status, qr_image_b64, qr_image_ts, login_source, login_run_id
 
     # 为本次任务分配 run_id；若传入则表示由 restart_login 强制启动
@@ -280,7 +298,8 @@ def selenium_login_task(source=None, run_id=None):
                         cookie_str = f"JSESSIONID={cookie_dict['JSESSIONID']}"
                         logger.info("🎉 后台验证成功!获取到Cookie")
                         Config().update_auth(cookie_str, ua, source=source)
-                        request_immediate_check(reason=f"ticket_success source={source or 'default'}")
+                        forget_page_cache(source)  # 新会话：不再信任旧 Cookie 下缓存的"未变化"页面
+                        request_immediate_check(reason=f"ticket_success source={source or 'default'}", source=source)
                         Config().send_email(
                             "✅ 监控恢复",
                             f"通过后台截获Ticket成功恢复登录。\nCookie: {cookie_str}"
@@ -392,7 +411,8 @@ def manual_set_cookie(cookie, ua=None, source=None):
             ua = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
         
         Config().update_auth(cookie, ua, source=source)
-        request_immediate_check(reason=f"manual_cookie source={source or 'default'}")
+        forget_page_cache(source)  # 新会话：不再信任旧 Cookie 下缓存的"未变化"页面
+        request_immediate_check(reason=f"manual_cookie source={source or 'default'}", source=source)
         logger.info("✅ 手动Cookie设置成功")
         return True
     except Exception as e:
@@ -4,14 +4,19 @@ import smtplib
 import configparser
 import logging
 import secrets
+import time
 from email.message import EmailMessage
+import metrics
+import tracing
+import log_pipeline
+import source_registry
 
 # === 基础配置 ===
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 CONFIG_FILE = os.path.join(BASE_DIR, "config.ini")
 
-# 初始化日志
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# 初始化日志：队列 + 后台线程输出，调用方不阻塞（见 log_pipeline.py）
+log_pipeline.install(level=logging.INFO)
 logger = logging.getLogger("System")
 
 
@@ -44,6 +49,8 @@ class Config:
         兼容策略：
         - 如果指定 source 的 section 不存在或 cookie 为空，回退到旧 [auth]
         """
+        if source_registry.is_active():
+            return source_registry.get_auth(source if source and source != "legacy" else None)
         section = self.get_auth_section(source)
         cookie = self.get(section, "cookie", "")
         ua = self.get(section, "user_agent", "")
@@ -72,7 +79,14 @@ class Config:
 
         - source=None: 写入旧 [auth]
         - source="ac_a": 写入 [auth.ac_a]
+        已迁移到 source 注册表时只更新注册表中的一行。
         """
+        suffix = f" ({source})" if source else ""
+        if source_registry.is_active():
+            source_registry.set_auth(source if source and source != "legacy" else None, cookie, ua)
+            logger.info(f"💾 Cookie已写入注册表{suffix}")
+            return
+
         section = self.get_auth_section(source)
         self._ensure_section(section)
         self.cp.set(section, "cookie", cookie)
@@ -80,7 +94,6 @@ class Config:
         with open(CONFIG_FILE, "w", encoding="utf-8") as f:
             self.cp.write(f)
 
-        suffix = f" ({source})" if source else ""
         logger.info(f"💾 配置文件已更新{suffix}")
 
     def get_auth_sources(self, fallback=("ac_a", "ac_b", "k")):
@@ -89,6 +102,13 @@ class Config:
         读取 [system].auth_sources（逗号/分号/换行分隔）。
         未配置则返回 fallback。
         """
+        if source_registry.is_active():
+            polled = source_registry.polled_sources()
+            if polled:
+                return polled
+            cookie, _ua = source_registry.get_auth(None)
+            return ["legacy"] if cookie else list(fallback)
+
         raw = self.get("system", "auth_sources", "")
         if not raw:
             # 自动检测：如果用户已经创建了 [auth.xxx] 段，则以实际存在的为准。
@@ -118,6 +138,8 @@ class Config:
 
         返回：dict[str, str]
         """
+        if source_registry.is_active():
+            return source_registry.labels()
         section = "auth.labels"
         if not self.cp.has_section(section):
             return {}
@@ -156,6 +178,8 @@ class Config:
 
         返回：dict[str, list[str]]
         """
+        if source_registry.is_active():
+            return source_registry.source_recipient_map()
         section = "notify.sources"
         if not self.cp.has_section(section):
             return {}
@@ -178,6 +202,9 @@ class Config:
         source_key = str(source or "").strip()
         if not source_key:
             return []
+        if source_registry.is_active():
+            # 主键查询，大小写不敏感
+            return source_registry.source_recipients(source_key)
 
         mapping = self.get_source_recipient_map()
         if source_key in mapping:
@@ -189,13 +216,16 @@ class Config:
         return []
 
     def set_source_recipients(self, source, recipients):
-        """设置单个 source 的收件人（写入 config.ini）。"""
-        section = "notify.sources"
-        self._ensure_section(section)
-
+        """设置单个 source 的收件人（写入 config.ini；已迁移时只更新注册表一行）。"""
         source_key = str(source or "").strip()
         if not source_key:
             raise ValueError("source 不能为空")
+        if source_registry.is_active():
+            source_registry.set_source_recipients(source_key, recipients)
+            return
+
+        section = "notify.sources"
+        self._ensure_section(section)
         if source_key in set(self.cp.defaults().keys()) or source_key.casefold() == "config_file":
             raise ValueError("source 名称不允许使用保留键: config_file")
 
@@ -226,6 +256,8 @@ class Config:
 
         返回：dict[str, list[str]]
         """
+        if source_registry.is_active():
+            return source_registry.room_recipient_map()
         section = "notify.rooms"
         if not self.cp.has_section(section):
             return {}
@@ -254,6 +286,8 @@ class Config:
         room_key = self._normalize_room_key(room)
         if not room_key:
             return []
+        if source_registry.is_active():
+            return source_registry.room_recipients(room_key)
 
         mapping = self.get_room_recipient_map()
         if room_key in mapping:
@@ -269,13 +303,17 @@ class Config:
         """设置单个房间的收件人（写入 config.ini）。
 
         recipients 支持：str(逗号/分号/换行分隔) 或 list/tuple/set。
+        已迁移到注册表时只更新一行。
         """
-        section = "notify.rooms"
-        self._ensure_section(section)
-
         room_key = self._normalize_room_key(room)
         if not room_key:
             raise ValueError("room 不能为空")
+        if source_registry.is_active():
+            source_registry.set_room_recipients(room_key, recipients)
+            return
+
+        section = "notify.rooms"
+        self._ensure_section(section)
         if room_key in set(self.cp.defaults().keys()) or room_key.casefold() == "config_file":
             raise ValueError("room 名称不允许使用保留键: config_file")
 
@@ -295,12 +333,66 @@ class Config:
 
     def clear_room_recipient_map(self):
         """清空所有房间映射（删除 [notify.rooms] 段）。"""
+        if source_registry.is_active():
+            source_registry.replace_room_recipients({})
+            return
         section = "notify.rooms"
         if self.cp.has_section(section):
             self.cp.remove_section(section)
             with open(CONFIG_FILE, "w", encoding="utf-8") as f:
                 self.cp.write(f)
 
+    # ===== 批量替换（管理面板"以本次提交为准"的保存） =====
+    # 已迁移：一次事务写注册表；未迁移：只修改内存中的 self.cp，由调用方统一写回 config.ini
+
+    def set_auth_sources(self, sources):
+        if source_registry.is_active():
+            source_registry.set_polled_sources(sources)
+            return
+        self._ensure_section("system")
+        self.cp.set("system", "auth_sources", ",".join(sources))
+
+    def replace_auth_labels(self, labels_map):
+        labels_map = {str(k or "").strip(): str(v or "").strip() for k, v in labels_map.items()}
+        labels_map = {k: v for k, v in labels_map.items() if k and k.casefold() != "config_file"}
+        if source_registry.is_active():
+            source_registry.replace_labels(labels_map)
+            return
+        section = "auth.labels"
+        if self.cp.has_section(section):
+            self.cp.remove_section(section)
+        self._ensure_section(section)
+        for s, v in labels_map.items():
+            if v:
+                self.cp.set(section, s, v)
+
+    def _replace_recipient_section(self, section, mapping):
+        if self.cp.has_section(section):
+            self.cp.remove_section(section)
+        self._ensure_section(section)
+        for key, recipients in mapping.items():
+            if isinstance(recipients, (list, tuple, set)):
+                rec_list = [str(x).strip() for x in recipients if str(x).strip()]
+            else:
+                rec_list = [x.strip() for x in str(recipients or "").replace(";", ",").replace("\n", ",").split(",") if x.strip()]
+            if rec_list:
+                self.cp.set(section, key, ",".join(rec_list))
+
+    def replace_source_recipient_map(self, mapping):
+        mapping = {str(k).strip(): v for k, v in mapping.items() if str(k).strip() and str(k).strip().casefold() != "config_file"}
+        if source_registry.is_active():
+            source_registry.replace_source_recipients(mapping)
+            return
+        self._replace_recipient_section("notify.sources", mapping)
+
+    def replace_room_recipient_map(self, mapping):
+        mapping = {self._normalize_room_key(k): v for k, v in mapping.items()}
+        mapping = {k: v for k, v in mapping.items() if k and k.casefold() != "config_file"}
+        if source_registry.is_active():
+            source_registry.replace_room_recipients(mapping)
+            return
+        self._replace_recipient_section("notify.rooms", mapping)
+
     def get_admin_token(self):
         """获取管理员Token"""
         if not self.cp.has_section("admin"):
@@ -357,6 +449,7 @@ class Config:
         recipients = normalize_recipients(to_override) if to_override is not None else normalize_recipients(self.get("notify", "to"))
         if not recipients:
             logger.warning("🚫 未配置收件人，跳过邮件")
+            metrics.EMAIL_SKIPPED.inc()
             return
 
         cfg = {
@@ -375,16 +468,27 @@ class Config:
         msg["To"] = ", ".join(cfg["to"])
         msg.set_content(content)
 
-        try:
-            if cfg["tls"] == "ssl":
-                context = ssl.create_default_context()
-                server = smtplib.SMTP_SSL(cfg["server"], cfg["port"], context=context, timeout=20)
-            else:
-                server = smtplib.SMTP(cfg["server"], cfg["port"], timeout=20)
-                server.starttls()
-            server.login(cfg["user"], cfg["pwd"])
-            server.send_message(msg)
-            server.quit()
-            logger.info(f"📧 邮件已发送: {subject}")
-        except Exception as e:
-            logger.error(f"❌ 邮件发送失败: {e}")
\ No newline at end of file
+        started = time.perf_counter()
+        metrics.EMAIL_INFLIGHT_G.inc()
+        with tracing.span("email"):
+            try:
+                if cfg["tls"] == "ssl":
+                    context = ssl.create_default_context()
+                    server = smtplib.SMTP_SSL(cfg["server"], cfg["port"], context=context, timeout=20)
+                else:
+                    server = smtplib.SMTP(cfg["server"], cfg["port"], timeout=20)
+                    server.starttls()
+                server.login(cfg["user"], cfg["pwd"])
+                server.send_message(msg)
+                server.quit()
+                logger.info(f"📧 邮件已发送: {subject}")
+                metrics.EMAIL_OK.observe(time.perf_counter() - started)
+            except Exception as e:
+                logger.error(f"❌ 邮件发送失败: {e}")
+                metrics.EMAIL_ERROR.observe(time.perf_counter() - started)
+            finally:
+                metrics.EMAIL_INFLIGHT_G.dec()
+
+
+# 按配置文件设置日志格式与限频（监控线程每轮会重新应用）
+log_pipeline.configure(Config())
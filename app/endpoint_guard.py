@@ -0,0 +1,166 @@
+"""
+学校接口保护模块 - 主机级令牌桶限流 + 熔断器
+
+所有 source 都请求同一个 TARGET_URL 主机。学校系统故障（502/5xx/超时）时，
+熔断器在连续 N 次服务端失败后打开，冷却期内直接短路请求；冷却结束后只放行一个
+半开探测请求，成功则恢复，失败则重新打开。令牌桶限制对该主机的整体请求速率。
+"""
+import threading
+import time
+
+
+class TokenBucket:
+    """线程安全的令牌桶（rate 个/秒，容量 burst）。"""
+
+    def __init__(self, rate=1.0, burst=5):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def configure(self, rate, burst):
+        with self._lock:
+            self.rate = max(0.0, float(rate))
+            self.burst = max(1.0, float(burst))
+            self._tokens = min(self._tokens, self.burst)
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        if self.rate > 0:
+            self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+
+    def acquire(self, max_wait=10.0):
+        """获取一个令牌，最多等待 max_wait 秒；rate<=0 表示不限流。成功返回 True。"""
+        deadline = time.monotonic() + max_wait
+        while True:
+            with self._lock:
+                if self.rate <= 0:
+                    return True
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return True
+                wait = (1.0 - self._tokens) / self.rate
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """closed -> open -> half_open -> closed 的经典熔断器。"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, cooldown_seconds=300):
+        self.failure_threshold = int(failure_threshold)
+        self.cooldown_seconds = float(cooldown_seconds)
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.open_count = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def configure(self, failure_threshold, cooldown_seconds):
+        with self._lock:
+            self.failure_threshold = max(1, int(failure_threshold))
+            self.cooldown_seconds = max(1.0, float(cooldown_seconds))
+
+    def allow(self):
+        """是否放行本次请求。open 冷却结束后只放行一个半开探测请求。"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.time() - self.opened_at < self.cooldown_seconds:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            # half_open：只允许一个探测请求在途
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.open_count += 1
+                self.state = self.OPEN
+                self.opened_at = time.time()
+            self._probe_in_flight = False
+
+    def release_probe(self):
+        """放弃已占用的半开探测名额（请求实际未发出）。"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def retry_after(self):
+        """距离允许下一次（探测）请求的秒数；closed 时为 0。"""
+        with self._lock:
+            if self.state != self.OPEN or self.opened_at is None:
+                return 0.0
+            return max(0.0, self.cooldown_seconds - (time.time() - self.opened_at))
+
+
+class EndpointGuard:
+    """组合限流与熔断，并统计被丢弃（短路）的请求数。"""
+
+    def __init__(self):
+        self.limiter = TokenBucket()
+        self.breaker = CircuitBreaker()
+        self.shed_circuit_open = 0
+        self.shed_rate_limited = 0
+        self._lock = threading.Lock()
+
+    def configure(self, cfg):
+        """从 config.ini [system] 读取参数（每轮监控调用一次，支持热更新）。"""
+        self.limiter.configure(
+            cfg.get_float("system", "school_rate_limit_per_second", 1.0),
+            cfg.get_float("system", "school_rate_limit_burst", 5),
+        )
+        self.breaker.configure(
+            cfg.get_int("system", "breaker_failure_threshold", 5),
+            cfg.get_int("system", "breaker_cooldown_seconds", 300),
+        )
+
+    def before_request(self, max_wait=10.0):
+        """请求前调用。返回 None 表示放行，否则返回短路原因 reason_code。"""
+        if not self.breaker.allow():
+            with self._lock:
+                self.shed_circuit_open += 1
+            return "circuit_open"
+        if not self.limiter.acquire(max_wait=max_wait):
+            # 半开探测被限流时不能占着探测名额
+            self.breaker.release_probe()
+            with self._lock:
+                self.shed_rate_limited += 1
+            return "rate_limited"
+        return None
+
+    def snapshot(self):
+        """供 /api/status 展示的状态。"""
+        b = self.breaker
+        return {
+            "breaker_state": b.state,
+            "breaker_consecutive_failures": b.consecutive_failures,
+            "breaker_open_count": b.open_count,
+            "breaker_retry_after": round(b.retry_after(), 1),
+            "shed_circuit_open": self.shed_circuit_open,
+            "shed_rate_limited": self.shed_rate_limited,
+            "rate_limit_per_second": self.limiter.rate,
+        }
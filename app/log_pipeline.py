@@ -0,0 +1,191 @@
+"""
+日志管道 - 非阻塞、限频、结构化的日志输出
+
+- 所有线程（监控线程、Flask 请求线程、定时任务）只把 LogRecord 放进有界队列，
+  由后台 QueueListener 线程格式化并写 stderr，日志 I/O 不再阻塞热路径。
+- 消息格式化是惰性的：logger.info("... %s", x) 的参数在后台线程才拼接；
+  被限频丢弃或级别不够的记录完全不做格式化。
+- 限频：同一条消息模板（logger 名 + 未格式化的 msg）每分钟最多输出 N 条，
+  超出部分只计数，下一条放行的记录带上 suppressed=被丢弃条数。
+  逐轮/逐 source 重复的日志请使用 %-格式，使模板保持不变。
+- 输出格式：[system] log_format = text（默认，与旧版相同的纯文本）或 json（每行一个 JSON 对象）。
+- 脱敏：JSESSIONID 等会话 Cookie 的值在输出前统一替换，只保留末 4 位。
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+
+import metrics
+
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_RATE_PER_MINUTE = 60
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+_COOKIE_RE = re.compile(r"(JSESSIONID|CASTGC|MOD_AUTH_CAS|iPlanetDirectoryPro)=([^;\s,'\"]+)", re.IGNORECASE)
+
+# LogRecord 自带属性，其余属性（通过 extra= 传入的）作为结构化字段输出
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+RECORDS_TOTAL = metrics.Counter("dorm_log_records_total", "日志记录数（按处理结果）", ("result",))
+LOG_QUEUED = RECORDS_TOTAL.labels("queued")
+LOG_RATE_LIMITED = RECORDS_TOTAL.labels("rate_limited")
+LOG_DROPPED = RECORDS_TOTAL.labels("queue_full")
+LOG_QUEUE_G = metrics.Gauge("dorm_log_queue_size", "等待写出的日志记录数").labels()
+
+
+def redact(text):
+    """把会话 Cookie 的值替换为 ***<末4位>"""
+    return _COOKIE_RE.sub(lambda m: f"{m.group(1)}=***{m.group(2)[-4:]}", text)
+
+
+class RateLimitFilter(logging.Filter):
+    """按消息模板限频（固定一分钟窗口），CRITICAL 不限频"""
+
+    MAX_KEYS = 4096
+
+    def __init__(self, per_minute=DEFAULT_RATE_PER_MINUTE):
+        super().__init__()
+        self.per_minute = per_minute
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.per_minute <= 0 or record.levelno >= logging.CRITICAL:
+            return True
+        key = (record.name, record.levelno, getattr(record, "rate_key", None) or record.msg)
+        now = time.monotonic()
+        with self._lock:
+            w = self._windows.get(key)
+            if w is None or now - w[0] >= 60.0:
+                suppressed = w[2] if w else 0
+                if w is None and len(self._windows) >= self.MAX_KEYS:
+                    # f-string 消息每条都是新模板，键数超限时整体清空，避免无限增长
+                    self._windows.clear()
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if w[1] < self.per_minute:
+                w[1] += 1
+                return True
+            w[2] += 1
+        LOG_RATE_LIMITED.inc()
+        return False
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """放入有界队列，不在调用线程格式化；队列满时丢弃并计数"""
+
+    def prepare(self, record):
+        # 同进程队列无需 pickle：保留 msg/args，交给后台线程格式化
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            LOG_QUEUED.inc()
+        except queue.Full:
+            LOG_DROPPED.inc()
+
+
+class JsonFormatter(logging.Formatter):
+    """每条记录输出一行 JSON：ts/level/logger/thread/msg + extra 字段"""
+
+    def format(self, record):
+        doc = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": redact(record.getMessage()),
+        }
+        for k, v in record.__dict__.items():
+            if k not in _RESERVED and not k.startswith("_") and k != "rate_key":
+                doc[k] = v if isinstance(v, (int, float, bool, type(None))) else redact(str(v))
+        if record.exc_info:
+            doc["exc"] = redact(self.formatException(record.exc_info))
+        return json.dumps(doc, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """与原先 basicConfig 一致的文本格式，附带脱敏与 suppressed 提示"""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def format(self, record):
+        text = redact(super().format(record))
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            text += f" (前一分钟同类日志已省略 {suppressed} 条)"
+        return text
+
+
+_lock = threading.Lock()
+_queue = None
+_listener = None
+_output = None
+_rate_filter = RateLimitFilter()
+_format = None
+
+
+def install(level=logging.INFO, stream=None, fmt="text", queue_size=DEFAULT_QUEUE_SIZE):
+    """替换根 logger 的处理器为 队列 -> 后台线程 -> stderr（重复调用无副作用）"""
+    global _queue, _listener, _output
+    with _lock:
+        if _listener is not None:
+            return
+        _queue = queue.Queue(maxsize=queue_size)
+        LOG_QUEUE_G.set_function(_queue.qsize)
+        _output = logging.StreamHandler(stream or sys.stderr)
+        _set_format(fmt)
+
+        handler = _NonBlockingQueueHandler(_queue)
+        handler.addFilter(_rate_filter)
+        root = logging.getLogger()
+        for h in list(root.handlers):
+            root.removeHandler(h)
+        root.addHandler(handler)
+        root.setLevel(level)
+
+        _listener = logging.handlers.QueueListener(_queue, _output, respect_handler_level=False)
+        _listener.start()
+        atexit.register(shutdown)
+
+
+def _set_format(fmt):
+    global _format
+    fmt = (fmt or "text").strip().lower()
+    if fmt not in ("json", "text"):
+        fmt = "text"
+    if fmt != _format:
+        _output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+        _format = fmt
+
+
+def configure(cfg):
+    """按配置调整输出格式与限频（每轮监控调用，开销可忽略）"""
+    if _output is None:
+        return
+    _set_format(cfg.get("system", "log_format", "text"))
+    _rate_filter.per_minute = cfg.get_int("system", "log_rate_limit_per_minute", DEFAULT_RATE_PER_MINUTE)
+
+
+def shutdown():
+    """停止后台线程并写出队列中剩余的日志（进程退出时自动调用）"""
+    global _listener
+    with _lock:
+        if _listener is None:
+            return
+        try:
+            _listener.stop()
+        except Exception:
+            pass
+        _listener = None
@@ -29,10 +29,13 @@ os.environ['WDM_SSL_VERIFY'] = '0'
 # Flask应用
 from flask import Flask, render_template, jsonify, send_from_directory, request, redirect
 from api import api_bp
+import metrics
 app = Flask(__name__)
 # 避免浏览器缓存静态页面导致前端更新不生效
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
 app.register_blueprint(api_bp)
+# Prometheus 指标：请求耗时统计 + /metrics
+metrics.init_app(app)
 
 # 静态文件目录
 STATIC_DIR = os.path.join(os.path.dirname(__file__), 'static')
@@ -0,0 +1,126 @@
+"""
+表计分类规则 - 把 [meters] 配置编译成一个多关键字匹配器
+
+配置格式（[meters]）：
+    <分类>_keywords = 关键字1, 关键字2     房间文字包含任一关键字即属于该分类（留空表示禁用）
+    <分类>_priority = 数字                 同时命中多个分类时取数字最小者（默认 50）
+
+内置分类与默认值（可覆盖）：
+    lighting  照明          优先级 10
+    ac_a      3-721A空调    优先级 20
+    ac_b      3-721B空调    优先级 30
+    ac        空调          优先级 90（含“空调”但未匹配 A/B 的兜底）
+都未命中时为 unknown。
+
+同一份 [meters] 内容只编译一次（按内容指纹缓存），所有关键字合成一个正则，
+一次扫描找出全部命中位置；每个编译结果再按房间文字缓存分类结果。
+"""
+import re
+import threading
+
+UNKNOWN = "unknown"
+DEFAULT_PRIORITY = 50
+DEFAULT_RULES = {
+    "lighting": ("照明", 10),
+    "ac_a": ("3-721A空调", 20),
+    "ac_b": ("3-721B空调", 30),
+    "ac": ("空调", 90),
+}
+
+_MEMO_LIMIT = 50000
+_CACHE_LIMIT = 8
+
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+
+def _split_keywords(value):
+    return [k.strip() for k in re.split(r"[,，;；\n]", value or "") if k.strip()]
+
+
+def parse_rules(items):
+    """[(key, value), ...] -> [(category, priority, [keywords]), ...]（按优先级排序）"""
+    keywords = {cat: kw for cat, (kw, _p) in DEFAULT_RULES.items()}
+    priorities = {cat: p for cat, (_kw, p) in DEFAULT_RULES.items()}
+    for key, value in items:
+        if key.endswith("_keywords"):
+            keywords[key[:-len("_keywords")]] = value
+        elif key.endswith("_priority"):
+            try:
+                priorities[key[:-len("_priority")]] = int(value)
+            except (TypeError, ValueError):
+                pass
+    rules = []
+    for cat, value in keywords.items():
+        kws = _split_keywords(value)
+        if kws:
+            rules.append((cat, priorities.get(cat, DEFAULT_PRIORITY), kws))
+    rules.sort(key=lambda r: (r[1], r[0]))
+    return rules
+
+
+class MeterClassifier:
+    """编译后的分类器：classify(room_text) -> 分类名"""
+
+    def __init__(self, rules):
+        self.rules = rules
+        # 关键字 -> (优先级, 分类)；同一关键字出现在多个分类时取优先级高的
+        self._by_keyword = {}
+        for cat, prio, kws in rules:
+            for kw in kws:
+                if kw not in self._by_keyword or prio < self._by_keyword[kw][0]:
+                    self._by_keyword[kw] = (prio, cat)
+        if self._by_keyword:
+            # 零宽前瞻可以找出所有（包括相互重叠的）命中位置；
+            # 同一位置按优先级、再按长度排列备选，保证取到该位置最优先的关键字
+            ordered = sorted(self._by_keyword, key=lambda k: (self._by_keyword[k][0], -len(k)))
+            self._pattern = re.compile("(?=(" + "|".join(re.escape(k) for k in ordered) + "))")
+        else:
+            self._pattern = None
+        self._memo = {}
+
+    def classify(self, room_text):
+        text = str(room_text or "")
+        hit = self._memo.get(text)
+        if hit is not None:
+            return hit
+        best = None
+        if self._pattern is not None:
+            for m in self._pattern.finditer(text):
+                cand = self._by_keyword[m.group(1)]
+                if best is None or cand < best:
+                    best = cand
+        result = best[1] if best else UNKNOWN
+        if len(self._memo) >= _MEMO_LIMIT:
+            self._memo.clear()
+        self._memo[text] = result
+        return result
+
+    def categories(self):
+        return [cat for cat, _p, _kws in self.rules]
+
+
+def _meter_items(cfg):
+    if not cfg.cp.has_section("meters"):
+        return ()
+    # raw=True 且只取规则键，避免 DEFAULT 段（如 config_file）混入指纹
+    return tuple(sorted(
+        (k, v.strip()) for k, v in cfg.cp.items("meters", raw=True)
+        if k.endswith("_keywords") or k.endswith("_priority")
+    ))
+
+
+def classifier_for(cfg):
+    """返回该配置对应的分类器（同一 Config 实例只计算一次指纹，相同内容共用编译结果）"""
+    clf = getattr(cfg, "_meter_classifier", None)
+    if clf is not None:
+        return clf
+    items = _meter_items(cfg)
+    with _compiled_lock:
+        clf = _compiled.get(items)
+        if clf is None:
+            if len(_compiled) >= _CACHE_LIMIT:
+                _compiled.clear()
+            clf = _compiled[items] = MeterClassifier(parse_rules(items))
+    cfg._meter_classifier = clf
+    return clf
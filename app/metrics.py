@@ -0,0 +1,319 @@
+"""
+指标模块 - 以 Prometheus 文本格式导出运行指标（/metrics）
+
+热路径上不加锁：每个带标签的子指标按线程分片计数（threading.local），
+采集（scrape）时再把各线程分片相加。标签组合首次出现时才加锁创建子指标，
+调用方应在模块级预先 labels(...) 绑定常用组合。
+"""
+import bisect
+import threading
+import time
+import weakref
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _fmt_num(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Sharded:
+    """按线程分片的累加器：写只碰本线程的分片，读时求和。
+
+    Flask 开发服务器每个请求一个线程：分片只弱引用所属线程，新建分片时若列表超过
+    上次清理后的两倍（至少 _PRUNE_MIN），先把已退出线程的分片并入 _retired，
+    因此即使从不采集，分片数量也只随并发线程数而不随请求数增长。
+    """
+
+    _PRUNE_MIN = 32
+
+    def __init__(self, width):
+        self._width = width
+        self._local = threading.local()
+        self._shards = []
+        self._retired = [0] * width + [0.0]
+        self._prune_at = self._PRUNE_MIN
+        self._lock = threading.Lock()
+
+    def shard(self):
+        s = getattr(self._local, "s", None)
+        if s is None:
+            s = [0] * self._width + [0.0]  # 最后一位存 sum
+            ref = weakref.ref(threading.current_thread())
+            with self._lock:
+                if len(self._shards) >= self._prune_at:
+                    self._fold_dead()
+                    self._prune_at = max(self._PRUNE_MIN, 2 * len(self._shards))
+                self._shards.append((ref, s))
+            self._local.s = s
+        return s
+
+    def _fold_dead(self):
+        # 调用方持有 self._lock；已退出线程不会再写其分片，可安全并入
+        alive = []
+        for ref, s in self._shards:
+            t = ref()
+            if t is not None and t.is_alive():
+                alive.append((ref, s))
+            else:
+                for i, v in enumerate(s):
+                    self._retired[i] += v
+        self._shards = alive
+
+    def totals(self):
+        with self._lock:
+            self._fold_dead()
+            alive = list(self._shards)
+            out = list(self._retired)
+        for _ref, s in alive:
+            for i, v in enumerate(s):
+                out[i] += v
+        return out
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """返回绑定了标签值的子指标（建议在模块级预先绑定并复用）"""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._children[key] = self._new_child()
+        return child
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in list(self._children.items()):
+            lines.extend(self._render(key, child))
+        return lines
+
+
+class _CounterChild:
+    def __init__(self):
+        self._acc = _Sharded(0)
+
+    def inc(self, amount=1):
+        self._acc.shard()[0] += amount
+
+    @property
+    def value(self):
+        return self._acc.totals()[0]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def _render(self, key, child):
+        return [f"{self.name}{_fmt_labels(self.labelnames, key)} {_fmt_num(child.value)}"]
+
+
+class _GaugeChild:
+    # 与 Counter 不同，gauge 可被 set() 覆盖，无法按线程分片累加，读改写用锁保护
+    def __init__(self):
+        self.value = 0.0
+        self.fn = None
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set_function(self, fn):
+        """采集时调用 fn() 取值（用于队列长度等，热路径零开销）"""
+        self.fn = fn
+
+    def get(self):
+        if self.fn is not None:
+            try:
+                return self.fn()
+            except Exception:
+                return float("nan")
+        return self.value
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def set_function(self, fn):
+        self.labels().set_function(fn)
+
+    def _render(self, key, child):
+        return [f"{self.name}{_fmt_labels(self.labelnames, key)} {_fmt_num(child.get())}"]
+
+
+class _HistogramChild:
+    def __init__(self, bounds):
+        self._bounds = bounds
+        self._acc = _Sharded(len(bounds) + 1)
+
+    def observe(self, value):
+        s = self._acc.shard()
+        s[bisect.bisect_left(self._bounds, value)] += 1
+        s[-1] += value
+
+    def time(self):
+        """with hist.time(): ... 记录代码块耗时"""
+        return _Timer(self)
+
+    def snapshot(self):
+        t = self._acc.totals()
+        return t[:-1], t[-1]
+
+
+class _Timer:
+    __slots__ = ("_child", "_t0")
+
+    def __init__(self, child):
+        self._child = child
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._child.observe(time.perf_counter() - self._t0)
+        return False
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, help_text, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def _render(self, key, child):
+        counts, total = child.snapshot()
+        lines = []
+        cumulative = 0
+        for bound, c in zip(self.bounds + (float("inf"),), counts):
+            cumulative += c
+            le = f'le="{_fmt_num(bound)}"'
+            lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, le)} {cumulative}")
+        lines.append(f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {_fmt_num(total)}")
+        lines.append(f"{self.name}_count{_fmt_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+def render():
+    """导出全部指标（Prometheus text exposition format 0.0.4）"""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for m in metrics:
+        lines.extend(m.collect())
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# ========== 本项目的指标定义 ==========
+
+FETCH_SECONDS = Histogram("dorm_fetch_seconds", "fetch_data 耗时（按 source 与 reason_code）", ("source", "reason"))
+PARSE_SECONDS = Histogram("dorm_parse_seconds", "parse_data 解析页面耗时")
+DB_WRITE_SECONDS = Histogram("dorm_power_log_write_seconds", "读数写入 power_log 耗时", ("mode",))
+EMAIL_SECONDS = Histogram("dorm_email_send_seconds", "send_email 耗时（按结果）", ("result",))
+EMAIL_SKIPPED_TOTAL = Counter("dorm_email_skipped_total", "未配置收件人而跳过的邮件数")
+EMAIL_INFLIGHT = Gauge("dorm_email_inflight", "正在发送中的邮件数")
+EMAIL_QUEUE = Gauge("dorm_email_queue_size", "排队等待投递的邮件数（周报线程池）")
+CYCLE_SECONDS = Histogram("dorm_monitor_cycle_seconds", "一轮监控（抓取到告警）的总耗时")
+ALERTS_TOTAL = Counter("dorm_alerts_total", "已发送的告警数（按类型）", ("kind",))
+ALERT_COOLDOWN_ENTRIES = Gauge("dorm_alert_cooldown_entries", "处于冷却记录中的告警 key 数", ("kind",))
+HTTP_SECONDS = Histogram("dorm_http_request_seconds", "Flask 请求耗时（按路由/方法/状态码）",
+                         ("endpoint", "method", "status"))
+LOGIN_ATTEMPTS = Counter("dorm_login_attempts_total", "扫码登录尝试次数（按结果）", ("result",))
+LOGIN_SECONDS = Histogram("dorm_login_duration_seconds", "扫码登录流程耗时（按结果）", ("result",),
+                          buckets=(1, 5, 10, 20, 30, 60, 90, 120, 180, 300))
+
+# 预绑定的常用子指标
+PARSE = PARSE_SECONDS.labels()
+CYCLE = CYCLE_SECONDS.labels()
+EMAIL_OK = EMAIL_SECONDS.labels("ok")
+EMAIL_ERROR = EMAIL_SECONDS.labels("error")
+EMAIL_SKIPPED = EMAIL_SKIPPED_TOTAL.labels()
+EMAIL_INFLIGHT_G = EMAIL_INFLIGHT.labels()
+EMAIL_QUEUE_G = EMAIL_QUEUE.labels()
+
+
+def init_app(app):
+    """为 Flask app 注册请求耗时统计与 /metrics 路由"""
+    from flask import Response, g, request
+
+    @app.before_request
+    def _metrics_start():
+        g._metrics_t0 = time.perf_counter()
+
+    @app.after_request
+    def _metrics_observe(response):
+        t0 = getattr(g, "_metrics_t0", None)
+        if t0 is not None:
+            # 用路由规则而不是原始路径作标签，避免标签基数随 URL 参数增长
+            rule = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            HTTP_SECONDS.labels(rule, request.method, response.status_code).observe(time.perf_counter() - t0)
+        return response
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        return Response(render(), mimetype=None, content_type=CONTENT_TYPE)
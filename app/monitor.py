@@ -1,18 +1,35 @@
 """
 监控核心模块 - 负责电费数据获取和监控任务
 """
+import os
+import logging
 import time
-import re
-import threading
 import requests
 import unicodedata
 from bs4 import BeautifulSoup
 from datetime import datetime
+from urllib.parse import urlparse
 from config import Config, logger
-from power_db import init_db, get_db
-
-# 目标URL
-TARGET_URL = "http://zhyd.sec.lit.edu.cn/zhyd/sydl/index"
+from power_db import init_db
+import alert_state
+import alert_rules
+import power_forecast
+import room_history
+import status_delta
+from reading import Reading, fmt
+from power_ingest import write_readings, log_mode as power_log_mode
+from source_scheduler import SourceScheduler, backoff_seconds_for_failures
+from endpoint_guard import EndpointGuard
+import meter_rules
+import metrics
+import page_cache
+import tracing
+import log_pipeline
+
+# 目标URL（可通过 configure_target 覆盖，用于指向本地替身服务器压测）
+DEFAULT_TARGET_URL = "http://zhyd.sec.lit.edu.cn/zhyd/sydl/index"
+TARGET_URL = DEFAULT_TARGET_URL
+TARGET_HOST = urlparse(DEFAULT_TARGET_URL).netloc
 
 # 全局状态
 system_status = {
@@ -24,14 +41,22 @@ system_status = {
     "sources": {}
 }
 
-# 用于“立即触发下一轮抓取”的唤醒事件（例如扫码刚更新 cookie 后）
-_monitor_wakeup_event = threading.Event()
+# 所有 source 共享的学校接口限流 + 熔断
+endpoint_guard = EndpointGuard()
+
+# 每个 source 独立排期的调度器（也承担"立即触发抓取"的唤醒）
+_scheduler = SourceScheduler()
+
+# 分片模式（monitor_shards >= 2）下的工作进程池；单线程模式为 None
+_shard_pool = None
 
 
-def request_immediate_check(reason: str = ""):
-    """请求监控线程尽快执行下一轮抓取。
+def request_immediate_check(reason: str = "", source=None):
+    """请求监控线程尽快抓取。
 
-    monitor_task 可能正在 sleep；此函数会唤醒它并尽快进入下一轮循环。
+    monitor_task 可能正在 sleep；此函数会唤醒它。
+    指定 source 时只让该 source 立即到期（例如扫码刚更新了它的 cookie），
+    其余 source 保持原有节奏；不指定则全部立即到期。
     """
     try:
         # 让前端/状态接口显示“即将运行”
@@ -40,73 +65,73 @@ def request_immediate_check(reason: str = ""):
         pass
     if reason:
         logger.info(f"⚡ 请求立即刷新数据: {reason}")
-    _monitor_wakeup_event.set()
+    _scheduler.request_now(source)
+    if _shard_pool is not None:
+        _shard_pool.request_now(source)
+
+
+def forget_page_cache(source=None):
+    """source 的 Cookie 重新绑定后丢弃其页面缓存（None 表示全部），下次抓取按新页面完整解析。
+
+    分片模式下抓取端在工作进程里，一并通知归属分片。
+    """
+    page_cache.forget(source)
+    if _shard_pool is not None:
+        _shard_pool.forget_page_cache(source)
 
 
 def classify_meter(room_text, cfg=None):
     """按绑定房间文字对表计分类。
 
-    默认规则（可在 config.ini 的 [meters] 覆盖）：
+    规则来自 config.ini 的 [meters]（见 meter_rules.py），默认：
     - lighting: 含“照明”
     - ac_a: 含“3-721A空调”
     - ac_b: 含“3-721B空调”
+    - ac: 含“空调”但未匹配 A/B
+    可增加任意分类（<分类>_keywords / <分类>_priority）。
     """
-    text = str(room_text or "")
     if cfg is None:
         cfg = Config()
-
-    lighting_kw = cfg.get("meters", "lighting_keywords", "照明")
-    ac_a_kw = cfg.get("meters", "ac_a_keywords", "3-721A空调")
-    ac_b_kw = cfg.get("meters", "ac_b_keywords", "3-721B空调")
-
-    if lighting_kw and lighting_kw in text:
-        return "lighting"
-    if ac_a_kw and ac_a_kw in text:
-        return "ac_a"
-    if ac_b_kw and ac_b_kw in text:
-        return "ac_b"
-    # 兜底：含“空调”但未匹配 A/B
-    if "空调" in text:
-        return "ac"
-    return "unknown"
+    return meter_rules.classifier_for(cfg).classify(room_text)
 
 
 def merge_room_data(all_lists):
     """合并多个来源的数据，并对相同 room 去重。
 
-    返回 list，每条包含：room/kwh/money/meter_type/sources
+    返回 Reading 列表（含 sources）。只出现在一个 source 的房间直接复用原对象，
+    重复的房间才生成新的合并记录，输入列表中的对象不会被修改。
     """
     merged = {}
+    combined = set()
     for items in all_lists:
-        for d in items or []:
-            room = str(d.get("room") or "")
+        for r in items or []:
+            room = r.room
             if not room:
                 continue
-            if room not in merged:
-                merged[room] = {
-                    "room": room,
-                    "kwh": d.get("kwh", "0"),
-                    "money": d.get("money", "0"),
-                    "meter_type": d.get("meter_type", "unknown"),
-                    "sources": []
-                }
-            src = d.get("source")
-            if src and src not in merged[room]["sources"]:
-                merged[room]["sources"].append(src)
+            m = merged.get(room)
+            if m is None:
+                merged[room] = r
+                continue
+            if room not in combined:
+                m = merged[room] = Reading(room, m.kwh, m.money, m.source, m.meter_type, m.sources)
+                combined.add(room)
+            if r.source and r.source not in m.sources:
+                m.sources = m.sources + (r.source,)
 
             # 优先保留非 unknown 的分类
-            if merged[room]["meter_type"] in ("unknown", "ac") and d.get("meter_type") not in (None, "unknown"):
-                merged[room]["meter_type"] = d.get("meter_type")
+            if m.meter_type in ("unknown", "ac") and r.meter_type not in (None, "unknown"):
+                m.meter_type = r.meter_type
 
             # 如果数值不同，保留最新一次抓到的（通常不会出现）
-            merged[room]["kwh"] = d.get("kwh", merged[room]["kwh"])
-            merged[room]["money"] = d.get("money", merged[room]["money"])
+            m.kwh = r.kwh
+            m.money = r.money
+            m.source = r.source or m.source
 
     return list(merged.values())
 
 
 def parse_data(html):
-    """解析HTML页面，提取房间电量数据"""
+    """解析HTML页面，提取房间电量数据（返回 Reading 列表，读数已转为 float）"""
     soup = BeautifulSoup(html, "html.parser")
     cards = soup.select("div.mui-card")
     if not cards:
@@ -123,39 +148,11 @@ def parse_data(html):
                 kwh = li.find("span").text.strip()
             if "剩余金额" in txt:
                 money = li.find("span").text.strip()
-        data.append({"room": room, "kwh": kwh, "money": money})
+        data.append(Reading.parse(room, kwh, money))
     
     return data
 
 
-def _extract_first_float(value):
-    """从字符串中提取第一个可解析的浮点数。
-
-    兼容类似：
-    - '27.04度'
-    - '15.14元'
-    - '  0 '
-    返回 float 或 None。
-    """
-    if value is None:
-        return None
-    if isinstance(value, (int, float)):
-        try:
-            return float(value)
-        except Exception:
-            return None
-    text = str(value).strip()
-    if not text:
-        return None
-    m = re.search(r"-?\d+(?:\.\d+)?", text)
-    if not m:
-        return None
-    try:
-        return float(m.group(0))
-    except Exception:
-        return None
-
-
 def _normalize_room_key_for_cooldown(room):
     """生成用于告警冷却的稳定 key（不影响房间映射匹配）。"""
     text = str(room or "").strip()
@@ -167,31 +164,59 @@ def _normalize_room_key_for_cooldown(room):
     return text.strip()
 
 
-def fetch_data(cookie, ua):
+def fetch_data(cookie, ua, source=None):
     """
     使用Cookie获取电费数据
     
     Args:
         cookie: JSESSIONID Cookie
         ua: User-Agent字符串
+        source: 仅用于指标标签
         
     Returns:
         (list|None, str): (房间数据列表或None, reason_code)
+        熔断打开/被限流时 reason_code 为 circuit_open / rate_limited，此时未发出请求。
     """
     if not cookie:
         logger.warning("❌ Cookie为空")
         return None, "no_cookie"
-    
-    logger.info(f"🔍 正在使用 Cookie: {cookie[:50]}...")
-    
+
+    # 学校系统故障期间短路请求；正常时按主机级令牌桶限速
+    shed = endpoint_guard.before_request()
+    if shed:
+        logger.info("⛔ 学校接口请求被跳过: %s", shed, extra={"source": source})
+        return None, shed
+
+    t0 = time.perf_counter()
+    data, reason = _fetch_page(cookie, ua, source)
+    metrics.FETCH_SECONDS.labels(source or "", reason).observe(time.perf_counter() - t0)
+    if reason in ("ok", "unchanged"):
+        endpoint_guard.breaker.record_success()
+    elif is_endpoint_failure(reason):
+        endpoint_guard.breaker.record_failure()
+    else:
+        # 跳转登录页、304 但无缓存、其他 4xx 等：接口有响应但不算成功，不改变连续失败计数，
+        # 只释放可能占用的半开探测名额
+        endpoint_guard.breaker.release_probe()
+    return data, reason
+
+
+def _fetch_page(cookie, ua, source=None):
+    """实际发出 HTTP 请求并解析（由 fetch_data 负责限流/熔断）
+
+    逐 source 的日志使用 %-格式 + extra 字段，便于限频与结构化检索；不记录 Cookie 内容。
+    """
+    log_extra = {"source": source}
     headers = {
         "User-Agent": ua,
         "Cookie": cookie,
-        "Host": "zhyd.sec.lit.edu.cn",
+        "Host": TARGET_HOST,
         "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
         "Accept-Language": "zh-CN,zh;q=0.9",
         "Connection": "keep-alive"
     }
+    # 上次页面带 ETag / Last-Modified 时发条件请求，服务器支持则直接返回 304
+    headers.update(page_cache.conditional_headers(source))
     
     try:
         resp = requests.get(
@@ -201,320 +226,559 @@ def fetch_data(cookie, ua):
             verify=False,
             allow_redirects=False
         )
-        resp.encoding = "utf-8"
-        
-        logger.info(f"🔍 响应状态码: {resp.status_code} | 内容长度: {len(resp.text)}")
+        logger.info("🔍 响应状态码: %s | 内容长度: %d", resp.status_code, len(resp.content), extra=log_extra)
+
+        if resp.status_code == 304:
+            data = page_cache.unchanged(source)
+            if data is not None:
+                logger.info("♻️ 页面未变化(304)，复用上次解析结果", extra=log_extra)
+                return data, "unchanged"
+            return None, "http_304"
         
         # 检查重定向(Cookie失效)
         if resp.status_code in [301, 302, 303, 307, 308]:
             redirect_url = resp.headers.get('Location', '')
-            logger.warning(f"❌ Cookie已失效,重定向到: {redirect_url[:60]}...")
+            logger.warning("❌ Cookie已失效,重定向到: %s...", redirect_url[:60], extra=log_extra)
             return None, "redirect"
         
         # 检查服务器错误
         if resp.status_code == 502:
-            logger.warning("⚠️ 服务器502错误(学校系统故障),稍后重试")
+            logger.warning("⚠️ 服务器502错误(学校系统故障),稍后重试", extra=log_extra)
             return None, "server_502"
         
         if resp.status_code >= 500:
-            logger.error(f"❌ 服务器错误: {resp.status_code}")
+            logger.error("❌ 服务器错误: %s", resp.status_code, extra=log_extra)
             return None, "server_5xx"
         
         if resp.status_code != 200:
-            logger.error(f"❌ 异常状态码: {resp.status_code}")
+            logger.error("❌ 异常状态码: %s", resp.status_code, extra=log_extra)
             return None, f"http_{resp.status_code}"
+
+        # 与上次成功页面逐字节相同：跳过解码与解析
+        digest = page_cache.fingerprint(resp.content)
+        data = page_cache.unchanged(source, digest)
+        if data is not None:
+            logger.info("♻️ 页面未变化，复用上次解析结果", extra=log_extra)
+            return data, "unchanged"
+        resp.encoding = "utf-8"
         
         # 检查页面内容
         if "统一身份认证" in resp.text or "authserver" in resp.text:
-            logger.warning("❌ 页面显示需要重新登录")
+            logger.warning("❌ 页面显示需要重新登录", extra=log_extra)
             return None, "auth_required"
         
         # 解析数据
-        data = parse_data(resp.text)
+        with metrics.PARSE.time(), tracing.span("parse"):
+            data = parse_data(resp.text)
         if data:
-            logger.info(f"✅ 成功解析到 {len(data)} 条房间数据")
+            logger.info("✅ 成功解析到 %d 条房间数据", len(data), extra=log_extra)
         else:
-            logger.warning("⚠️ 页面未找到房间数据")
+            logger.warning("⚠️ 页面未找到房间数据", extra=log_extra)
 
         if not data:
             return None, "no_data"
+        page_cache.store(source, digest, resp.headers, data)
         return data, "ok"
         
     except requests.exceptions.Timeout:
-        logger.error("❌ 请求超时")
+        logger.error("❌ 请求超时", extra=log_extra)
         return None, "timeout"
     except requests.exceptions.ConnectionError:
-        logger.error("❌ 网络连接失败")
+        logger.error("❌ 网络连接失败", extra=log_extra)
         return None, "connection_error"
     except Exception as e:
-        logger.error(f"❌ 请求失败: {e}")
+        logger.error("❌ 请求失败: %s", e, extra=log_extra)
         return None, "exception"
 
 
+def is_transient_failure(reason: str) -> bool:
+    """网络/服务器类失败：按退避节奏尽快重试。"""
+    return reason in {"timeout", "connection_error", "server_502", "server_5xx"}
+
+
+def is_endpoint_failure(reason: str) -> bool:
+    """计入熔断的失败：网络/服务器错误，以及返回了无法解析的页面或解析时异常。"""
+    return is_transient_failure(reason) or reason in {"exception", "no_data"}
+
+
+def is_shed(reason: str) -> bool:
+    """请求被本地限流/熔断跳过（不是 source 自身的失败）。"""
+    return reason in {"circuit_open", "rate_limited"}
+
+
+def is_auth_failure(reason: str) -> bool:
+    """明确表示需要重新登录/发生重定向的一类失败。"""
+    return reason in {"redirect", "auth_required"}
+
+
+def _ensure_source_status(s):
+    """初始化 source 状态结构"""
+    if not isinstance(system_status.get("sources"), dict):
+        system_status["sources"] = {}
+    return system_status["sources"].setdefault(s, {
+        "last_error": None,
+        "consecutive_failures": 0,
+        "has_cookie": False,
+        "last_ok_time": None,
+        "last_rooms": [],
+        "next_run_time": None
+    })
+
+
+def _write_power_log(s, data, cfg):
+    """将一次成功抓取的房间读数写入库（默认只在读数变化时新增区间）"""
+    mode = power_log_mode(cfg)
+    try:
+        with metrics.DB_WRITE_SECONDS.labels(mode).time():
+            write_readings(s, data, mode=mode)
+    except Exception as e:
+        logger.error(f"[power_log] 数据写入失败: {e}")
+
+
+def _store_readings(s, enriched, changed, cfg):
+    """写入端：change 模式下页面未变化时按 page_cache 的刷新节奏跳过写库"""
+    if page_cache.write_due(s, changed, cfg, mode=power_log_mode(cfg)):
+        with tracing.span("db_write", source=s):
+            _write_power_log(s, enriched, cfg)
+
+
+def _send_repair_email(s, fails, cfg):
+    """source 凭证连续失效时，通知相关联系人重新扫码"""
+    ip = cfg.get("system", "server_ip", "127.0.0.1")
+    port = cfg.get("system", "web_port", "5000")
+    if s == "legacy":
+        link = f"http://{ip}:{port}/login"
+    else:
+        link = f"http://{ip}:{port}/login?source={s}"
+
+    # 优先发给该 source 对应房间的联系人（来自最近一次成功抓到的 room 列表）
+    target_rooms = system_status.get("sources", {}).get(s, {}).get("last_rooms", []) or []
+    recipients = []
+    for room in target_rooms:
+        for mail in cfg.get_room_recipients(room):
+            if mail not in recipients:
+                recipients.append(mail)
+
+    # 若没有房间映射，回退到 source 默认收件人
+    if not recipients:
+        recipients = cfg.get_source_recipients(s)
+
+    # 若没有房间映射，按 source 分组回退
+    if not recipients:
+        if s == "ac_a":
+            recipients = cfg.get_notify_group_recipients("a")
+        elif s == "ac_b":
+            recipients = cfg.get_notify_group_recipients("b")
+        elif s == "k":
+            recipients = cfg.get_notify_group_recipients("k")
+
+    rooms_text = "\n".join([f"- {r}" for r in target_rooms]) if target_rooms else "(未知：该账号近期无成功数据)"
+    cfg.send_email(
+        f"🚨 Cookie失效需修复 ({s})",
+        f"该宿舍账号凭证可能已失效（source={s}），导致连续获取失败（{fails}次）。\n\n"
+        f"影响房间：\n{rooms_text}\n\n"
+        f"请点击链接重新扫码登录：\n{link}\n",
+        to_override=recipients if recipients else None
+    )
+
+
+def _poll_source(s, cfg, interval, last_repair_email_time):
+    """抓取单个 source 并更新其状态。
+
+    返回 (enriched|None, next_delay, changed)：
+    - enriched: 成功时为补上 source/meter_type 的 Reading 列表（由调用方写入 power_log）
+    - next_delay: 该 source 下一次运行前应等待的秒数（失败时按自身退避）
+    - changed: 页面与上次不同（False 时 enriched 是复用的上次结果，见 page_cache）
+    """
+    st = _ensure_source_status(s)
+    cookie, ua = cfg.get_auth(source=s)
+    st["has_cookie"] = bool(cookie)
+    if not cookie:
+        # 无 cookie 时按正常间隔检查；扫码/手动设置 cookie 后会定向唤醒该 source
+        st["last_error"] = "Cookie未配置"
+        return None, interval, False
+
+    logger.info("🔍 source=%s Cookie长度: %d", s, len(cookie), extra={"source": s})
+    with tracing.span("fetch", source=s):
+        data, reason = fetch_data(cookie, ua, source=s)
+    if is_shed(reason):
+        # 不计入该 source 的连续失败；等熔断冷却结束再排期
+        st["last_error"] = f"学校接口保护中 - {reason}"
+        return None, max(5, endpoint_guard.breaker.retry_after() or 5), False
+    if data:
+        # 成功：标记分类/来源（页面未变化且分类规则未变时直接复用上次结果）
+        changed = reason != "unchanged"
+        classifier = meter_rules.classifier_for(cfg)
+        enriched = None if changed else page_cache.cached_enriched(s, classifier)
+        if enriched is None:
+            if not changed:
+                # 缓存里的对象可能正被状态接口/走势缓存读取，分类规则变化时生成新对象，不原地修改
+                data = [Reading(r.room, r.kwh, r.money) for r in data]
+            with tracing.span("enrich", source=s):
+                for r in data:
+                    r.tag(s, classifier.classify(r.room))
+            enriched = data
+            page_cache.store_enriched(s, classifier, enriched)
+
+        # 记录该 source 最近一次成功抓到的房间，用于后续 cookie 失效时定向通知
+        st["last_rooms"] = [r.room.strip() for r in data if r.room.strip()]
+
+        st["last_error"] = None
+        st["consecutive_failures"] = 0
+        st["last_ok_time"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        return enriched, interval, changed
+
+    # 失败：累计
+    st["consecutive_failures"] += 1
+    fails = st["consecutive_failures"]
+    st["last_error"] = f"获取失败 (连续 {fails} 次){' - ' + reason if reason else ''}"
+
+    # 连续失败3次：判定该 source 需要修复
+    if fails >= 3 and is_auth_failure(reason):
+        # 防止邮件轰炸：每12小时只发一次/每source
+        last_t = last_repair_email_time.get(s, 0)
+        if time.time() - last_t > 43200:
+            _send_repair_email(s, fails, cfg)
+            metrics.ALERTS_TOTAL.labels("repair").inc()
+            last_repair_email_time[s] = time.time()
+
+    # 失败的 source 只退避自己（60 -> 120 -> 300 -> 900 秒，且不超过 interval）
+    return None, max(5, backoff_seconds_for_failures(fails, cap=interval)), False
+
+
+def _send_room_alert(cfg, room, meter_type, subject, content, source=None):
+    """按 房间收件人 -> source 收件人 -> 分组回退 -> 默认收件人 的优先级发送告警"""
+    def send_alert(to_list):
+        if to_list:
+            cfg.send_email(subject, content, to_override=to_list)
+        else:
+            # 回退到默认 notify.to
+            cfg.send_email(subject, content)
+
+    # 1) 优先按房间映射发送
+    room_recipients = cfg.get_room_recipients(room)
+    if room_recipients:
+        cfg.send_email(subject, content, to_override=room_recipients)
+        return
+
+    # 2) 回退到 source 默认收件人（新模式：默认按 source 告警）
+    if source:
+        source_recipients = cfg.get_source_recipients(source)
+        if source_recipients:
+            cfg.send_email(subject, content, to_override=source_recipients)
+            return
+
+    # 3) 无映射：按原有分组回退（兼容旧模式）
+    if meter_type == "lighting":
+        send_alert(cfg.get_notify_group_recipients("a"))
+        send_alert(cfg.get_notify_group_recipients("b"))
+        send_alert(cfg.get_notify_group_recipients("k"))
+    elif meter_type == "ac_a":
+        send_alert(cfg.get_notify_group_recipients("a"))
+    elif meter_type == "ac_b":
+        send_alert(cfg.get_notify_group_recipients("b"))
+    else:
+        cfg.send_email(subject, content)
+
+
+def _evaluate_low_power_alerts(merged, cfg, last_low_power_email_time):
+    """低电量 / 快速耗电检测（优先按房间分发；无映射则按组回退）
+
+    阈值、滞回与耗电速度规则由 alert_rules 对本轮全部读数一次向量化评估，
+    这里只处理触发的房间：检查冷却并发信。快速耗电的冷却 key 加 drain: 前缀。
+    """
+    cooldown = cfg.get_int("system", "low_power_alert_cooldown_seconds", 21600)
+
+    for ev in alert_rules.engine.evaluate(merged, cfg):
+        r = ev["item"]
+        try:
+            room_key = _normalize_room_key_for_cooldown(r.room)
+            cooldown_key = room_key if ev["kind"] == "low_power" else f"drain:{room_key}"
+            if room_key:
+                last_t = last_low_power_email_time.get(cooldown_key, 0)
+                if cooldown > 0 and (time.time() - last_t) < cooldown:
+                    continue
+
+            meter_type = r.meter_type
+            log_extra = {"room": r.room, "source": r.source}
+            if ev["kind"] == "low_power":
+                logger.warning("⚠️ 低电量(%s): %s %s", meter_type, r.room, fmt(r.kwh), extra=log_extra)
+                subject = f"⚠️ 缺电警告: {fmt(r.kwh)}度"
+                content = f"房间/表计: {r.room}\n剩余: {fmt(r.kwh)}度 / {fmt(r.money)}元\n请尽快充值!"
+            else:
+                logger.warning("📉 耗电过快(%s): %s %s 小时内下降 %s 度", meter_type, r.room,
+                               f"{ev['hours']:g}", ev["drop"], extra=log_extra)
+                subject = f"📉 耗电异常: {ev['hours']:g} 小时内下降 {ev['drop']:g} 度"
+                content = (
+                    f"房间/表计: {r.room}\n剩余: {fmt(r.kwh)}度 / {fmt(r.money)}元\n"
+                    f"最近 {ev['hours']:g} 小时内电量下降了 {ev['drop']:g} 度，请检查是否有电器未关闭。"
+                )
+
+            _send_room_alert(cfg, r.room, meter_type, subject, content, source=r.source)
+            metrics.ALERTS_TOTAL.labels(ev["kind"]).inc()
+
+            if room_key:
+                last_low_power_email_time[cooldown_key] = time.time()
+        except Exception:
+            pass
+
+
+def _evaluate_forecast_alerts(merged, cfg, last_low_power_email_time):
+    """提前告警：预测在 N 天内跌破低电量阈值的房间，提醒尽快充值。
+
+    使用 power_forecast 的缓存结果；已低于阈值的房间由低电量告警负责。
+    与低电量告警共用冷却记录（key 加 forecast: 前缀，互不影响）。
+    """
+    alert_days = cfg.get_float("system", "forecast_alert_days", 3)
+    if alert_days <= 0:
+        return
+    thresh = cfg.get_float("system", "low_power_threshold", 15.0)
+    cooldown = cfg.get_int("system", "low_power_alert_cooldown_seconds", 21600)
+
+    for r in merged:
+        try:
+            kwh_num = r.kwh
+            if kwh_num is None or kwh_num < thresh:
+                continue
+            fc = power_forecast.get_forecast(r.room)
+            if not fc or fc.get("days_until_threshold") is None or fc["days_until_threshold"] > alert_days:
+                continue
+            room_key = _normalize_room_key_for_cooldown(r.room)
+            if room_key:
+                cooldown_key = f"forecast:{room_key}"
+                last_t = last_low_power_email_time.get(cooldown_key, 0)
+                if cooldown > 0 and (time.time() - last_t) < cooldown:
+                    continue
+
+            meter_type = r.meter_type
+            logger.warning("⏳ 预计 %s 天后低电量(%s): %s %s", fc['days_until_threshold'], meter_type,
+                           r.room, fmt(r.kwh), extra={"room": r.room, "source": r.source})
+            subject = f"⏳ 充值提醒: 预计 {fc['days_until_threshold']} 天后低于 {thresh:g} 度"
+            content = (
+                f"房间/表计: {r.room}\n剩余: {fmt(r.kwh)}度 / {fmt(r.money)}元\n"
+                f"近期日均耗电: {fc['rate_kwh_per_day']}度\n"
+                f"预计 {fc['threshold_date']} 前后低于 {thresh:g} 度，约 {fc['days_until_empty']} 天后用完。\n"
+                f"请在 {alert_days:g} 天内充值。"
+            )
+            _send_room_alert(cfg, r.room, meter_type, subject, content, source=r.source)
+            metrics.ALERTS_TOTAL.labels("forecast").inc()
+
+            if room_key:
+                last_low_power_email_time[cooldown_key] = time.time()
+        except Exception:
+            pass
+
+
+class MonitorState:
+    """monitor_task 跨轮次保留的进程内状态"""
+
+    def __init__(self):
+        # 记录每个 source 的修复邮件时间、每个房间的低电量告警时间，防止轰炸
+        # 启动时从 alert_cooldown 表批量恢复，每轮结束批量写回（重启后冷却仍有效）
+        cooldowns = alert_state.load("repair", "low_power")
+        self.last_repair_email_time = cooldowns["repair"]
+        self.last_low_power_email_time = cooldowns["low_power"]
+        # 每个 source 最近一次成功抓到的数据（用于合并展示）
+        self.latest_by_source = {}
+        metrics.ALERT_COOLDOWN_ENTRIES.labels("repair").set_function(lambda: len(self.last_repair_email_time))
+        metrics.ALERT_COOLDOWN_ENTRIES.labels("low_power").set_function(lambda: len(self.last_low_power_email_time))
+
+    def flush_cooldowns(self):
+        alert_state.flush(self.last_repair_email_time, self.last_low_power_email_time)
+
+    def merge_cooldowns(self, entries):
+        """合并分片工作进程送回的冷却记录 [(kind, key, last_sent), ...]，保留较新的时间"""
+        maps = {"repair": self.last_repair_email_time, "low_power": self.last_low_power_email_time}
+        for kind, key, last_sent in entries:
+            m = maps.get(kind)
+            if m is not None and last_sent > m.get(key, 0):
+                m[key] = last_sent
+
+
+def run_cycle(cfg, sources, due, state, results=None):
+    """执行一轮：抓取到期的 source，合并、更新全局状态并评估告警。
+
+    monitor_task 每次唤醒调用一次；压测脚本也直接调用它来驱动完整的一轮。
+    分片模式下 results 为工作进程送回的抓取结果，本进程只负责入库、合并与汇总。
+    """
+    tracing.tracer.resize(cfg.get_int("system", "trace_cycles", 50))
+    prof = tracing.profiler.begin()
+    tracing.tracer.begin()
+    merged = None
+    try:
+        with metrics.CYCLE.time():
+            if results is None:
+                merged = _run_cycle(cfg, sources, due, state)
+            else:
+                merged = _apply_shard_results(cfg, sources, due, results, state)
+        return merged
+    finally:
+        with tracing.span("cooldown_flush"):
+            state.flush_cooldowns()
+        # 记录本轮变化的房间 / source / 预测，供 /api/status?since= 增量返回
+        status_delta.publish(system_status, power_forecast.snapshot())
+        tracing.tracer.end(sources_due=len(due), rooms=len(merged or []))
+        tracing.profiler.end(prof)
+
+
+def _run_cycle(cfg, sources, due, state):
+    interval = cfg.get_int("system", "interval", 900)
+    for s in list(state.latest_by_source.keys()):
+        if s not in sources:
+            del state.latest_by_source[s]
+
+    ok_lists = []
+    for s in due:
+        _ensure_source_status(s)
+        enriched, delay, changed = _poll_source(s, cfg, interval, state.last_repair_email_time)
+        if enriched:
+            state.latest_by_source[s] = enriched
+            ok_lists.append(enriched)
+            # === 写入power_log表 ===
+            _store_readings(s, enriched, changed, cfg)
+        _scheduler.schedule(s, delay)
+        next_run = _scheduler.next_run_time(s)
+        if next_run:
+            system_status["sources"][s]["next_run_time"] = datetime.fromtimestamp(next_run).strftime("%Y-%m-%d %H:%M:%S")
+
+    return _finish_cycle(cfg, sources, due, ok_lists, state)
+
+
+def _apply_shard_results(cfg, sources, due, results, state):
+    """分片模式的单一写入方：写库、更新 source 状态，再走与单进程相同的合并/预测流程
+
+    低电量/耗电速度告警已由各工作进程按自己的分片评估，这里只做提前充值提醒。
+    """
+    for s in list(state.latest_by_source.keys()):
+        if s not in sources:
+            del state.latest_by_source[s]
+
+    ok_lists = []
+    for r in results:
+        s = r["source"]
+        st = _ensure_source_status(s)
+        st.update(r["status"])
+        if r.get("next_run"):
+            st["next_run_time"] = datetime.fromtimestamp(r["next_run"]).strftime("%Y-%m-%d %H:%M:%S")
+        enriched = r.get("enriched")
+        if enriched:
+            state.latest_by_source[s] = enriched
+            ok_lists.append(enriched)
+            _store_readings(s, enriched, r.get("changed", True), cfg)
+
+    return _finish_cycle(cfg, sources, due, ok_lists, state, low_power_alerts=False)
+
+
+def _finish_cycle(cfg, sources, due, ok_lists, state, low_power_alerts=True):
+    with tracing.span("merge"):
+        merged = merge_room_data([state.latest_by_source[s] for s in sources if s in state.latest_by_source])
+        fresh = merge_room_data(ok_lists)
+
+    # 本轮新读数追加到各房间的内存环形缓冲（仪表盘走势图不查库）
+    room_history.configure(cfg)
+    room_history.ring.record(fresh)
+
+    # 更新全局状态
+    system_status["last_check_time"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    system_status["last_check_data"] = merged
+
+    # 全局错误展示：有任何 source 异常则提示，但只要有数据就不算全局失败
+    per_source_errors = []
+    for s in sources:
+        st = system_status["sources"].get(s) or {}
+        if st.get("last_error") == "Cookie未配置":
+            per_source_errors.append(f"{s}:Cookie未配置")
+        elif st.get("consecutive_failures") or str(st.get("last_error") or "").startswith("学校接口保护中"):
+            per_source_errors.append(f"{s}:连续失败{st['consecutive_failures']}次")
+    system_status["last_error"] = "; ".join(per_source_errors) if per_source_errors else None
+
+    # 计算一个全局 consecutive_failures：当本轮到期的 source 都拿不到数据时才累计
+    if not fresh:
+        system_status["consecutive_failures"] = system_status.get("consecutive_failures", 0) + 1
+        logger.warning("⚠️ 本轮到期的 %d 个 source 均未获取到数据: %s", len(due), ", ".join(due[:20]))
+        return merged
+
+    system_status["consecutive_failures"] = 0
+    # 只输出汇总；逐房间明细仅在 DEBUG 级别拼接，避免 source 多时每轮生成超长日志
+    logger.info("✅ 合并后数据: 本轮 %d 个房间，共 %d 个房间", len(fresh), len(merged))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("合并后明细: %s", " | ".join(f"{r.room}: ⚡{fmt(r.kwh)}度 💰{fmt(r.money)}元" for r in fresh))
+
+    # 只对本轮新抓到的数据做低电量检测，其余 source 的旧数据不重复评估
+    if low_power_alerts:
+        with tracing.span("alert"):
+            _evaluate_low_power_alerts(fresh, cfg, state.last_low_power_email_time)
+
+    # 刷新全部房间的耗尽预测缓存，并据此发出提前充值提醒
+    with tracing.span("forecast"):
+        power_forecast.safe_update(merged, cfg)
+    with tracing.span("alert"):
+        _evaluate_forecast_alerts(fresh, cfg, state.last_low_power_email_time)
+    return merged
+
+
+def configure_target(cfg):
+    """按配置设置抓取地址（[system] target_url 或环境变量 DORM_TARGET_URL）。
+
+    默认即学校正式地址；压测时可指向本地替身服务器（bench/zhyd_standin.py）。
+    """
+    global TARGET_URL, TARGET_HOST
+    url = os.environ.get("DORM_TARGET_URL") or cfg.get("system", "target_url", "") or DEFAULT_TARGET_URL
+    if url != TARGET_URL:
+        logger.info(f"🎯 抓取地址: {url}")
+    TARGET_URL = url
+    TARGET_HOST = urlparse(url).netloc or TARGET_HOST
+
+
 def monitor_task():
-    """后台监控循环任务"""
-    global system_status
+    """后台监控循环任务
+
+    每个 source 在调度堆中有自己的下次运行时间：
+    成功后按 interval（加抖动）排期，失败后按自身连续失败次数退避。
+    每轮只抓取到期的 source，再与其他 source 最近一次成功的数据合并展示。
+    [system] monitor_shards >= 2 时改为多进程分片抓取（见 monitor_shards.py），本线程只做写入与汇总。
+    """
+    global system_status, _shard_pool
     logger.info("⏱️ 监控线程已启动")
 
     # 初始化数据库（如首次运行自动建表）
     init_db()
+    room_history.warm(Config())
 
-    # 记录每个 source 的告警/修复邮件时间，防止轰炸
-    last_repair_email_time = {}
-
-    # 记录每个房间的低电量告警时间，防止轰炸（进程内）
-    last_low_power_email_time = {}
+    state = MonitorState()
 
     while True:
         # 检查是否暂停
         if not system_status["is_monitoring"]:
             time.sleep(10)
             continue
-        
+
         # 重新读取配置
         cfg = Config()
         interval = cfg.get_int("system", "interval", 900)
-        sources = cfg.get_auth_sources()
-
-        # 初始化 source 状态结构
-        if not isinstance(system_status.get("sources"), dict):
-            system_status["sources"] = {}
-        for s in sources:
-            system_status["sources"].setdefault(s, {
-                "last_error": None,
-                "consecutive_failures": 0,
-                "has_cookie": False,
-                "last_ok_time": None,
-                "last_rooms": []
-            })
-
-        ok_lists = []
-        per_source_errors = []
-
-        # 如果出现网络/服务器类失败，则启用逐步退避，缩短下次重试等待。
-        # 退避节奏：60 -> 120 -> 300 -> 900（秒），并且不会超过 interval。
-        transient_failure_backoffs = []
-
-        def is_transient_failure(reason: str) -> bool:
-            return reason in {"timeout", "connection_error", "server_502", "server_5xx"}
-
-        def is_auth_failure(reason: str) -> bool:
-            # 明确表示需要重新登录/发生重定向的一类失败
-            return reason in {"redirect", "auth_required"}
-
-        def backoff_seconds_for_failures(fails: int, cap: int) -> int:
-            schedule = [60, 120, 300, 900]
-            if fails <= 0:
-                return cap
-            idx = min(fails - 1, len(schedule) - 1)
-            return min(schedule[idx], cap)
-
-        for s in sources:
-            cookie, ua = cfg.get_auth(source=s)
-            system_status["sources"][s]["has_cookie"] = bool(cookie)
-            if not cookie:
-                system_status["sources"][s]["last_error"] = "Cookie未配置"
-                per_source_errors.append(f"{s}:Cookie未配置")
-                continue
-
-            logger.info(f"🔍 source={s} Cookie长度: {len(cookie)}")
-            data, reason = fetch_data(cookie, ua)
-            if data:
-                # 成功：标记分类/来源
-                enriched = []
-                for d in data:
-                    room_text = d.get("room")
-                    d2 = dict(d)
-                    d2["source"] = s
-                    d2["meter_type"] = classify_meter(room_text, cfg=cfg)
-                    enriched.append(d2)
-                ok_lists.append(enriched)
-
-                # === 写入power_log表 ===
-                now = datetime.now()
-                date_str = now.strftime("%Y-%m-%d")
-                time_str = now.strftime("%H:%M:%S")
-                try:
-                    conn = get_db()
-                    for d in data:
-                        room = str(d.get("room") or "")
-                        remain_power = d.get("kwh")
-                        try:
-                            remain_power = float(remain_power)
-                        except Exception:
-                            remain_power = None
-                        if not room or remain_power is None:
-                            continue
-                        conn.execute(
-                            "INSERT INTO power_log (source, date, time, remain_power) VALUES (?, ?, ?, ?)",
-                            (s, date_str, time_str, remain_power)
-                        )
-                    conn.commit()
-                    conn.close()
-                except Exception as e:
-                    logger.error(f"[power_log] 数据写入失败: {e}")
-
-                # 记录该 source 最近一次成功抓到的房间，用于后续 cookie 失效时定向通知
-                try:
-                    system_status["sources"][s]["last_rooms"] = [str(x.get("room") or "").strip() for x in data if str(x.get("room") or "").strip()]
-                except Exception:
-                    system_status["sources"][s]["last_rooms"] = []
-
-                system_status["sources"][s]["last_error"] = None
-                system_status["sources"][s]["consecutive_failures"] = 0
-                system_status["sources"][s]["last_ok_time"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            else:
-                # 失败：累计
-                system_status["sources"][s]["consecutive_failures"] += 1
-                fails = system_status["sources"][s]["consecutive_failures"]
-                system_status["sources"][s]["last_error"] = f"获取失败 (连续 {fails} 次){' - ' + reason if reason else ''}"
-                per_source_errors.append(f"{s}:连续失败{fails}次")
-
-                # 网络/服务器类失败：记录退避时间，用于缩短下次重试
-                if is_transient_failure(reason):
-                    transient_failure_backoffs.append(backoff_seconds_for_failures(fails, cap=interval))
-
-                # 连续失败3次：判定该 source 需要修复
-                if fails >= 3 and is_auth_failure(reason):
-                    # 防止邮件轰炸：每12小时只发一次/每source
-                    last_t = last_repair_email_time.get(s, 0)
-                    if time.time() - last_t > 43200:
-                        ip = cfg.get("system", "server_ip", "127.0.0.1")
-                        port = cfg.get("system", "web_port", "5000")
-                        if s == "legacy":
-                            link = f"http://{ip}:{port}/login"
-                        else:
-                            link = f"http://{ip}:{port}/login?source={s}"
-
-                        # 优先发给该 source 对应房间的联系人（来自最近一次成功抓到的 room 列表）
-                        target_rooms = system_status.get("sources", {}).get(s, {}).get("last_rooms", []) or []
-                        recipients = []
-                        for room in target_rooms:
-                            for mail in cfg.get_room_recipients(room):
-                                if mail not in recipients:
-                                    recipients.append(mail)
-
-                        # 若没有房间映射，回退到 source 默认收件人
-                        if not recipients:
-                            recipients = cfg.get_source_recipients(s)
-
-                        # 若没有房间映射，按 source 分组回退
-                        if not recipients:
-                            if s == "ac_a":
-                                recipients = cfg.get_notify_group_recipients("a")
-                            elif s == "ac_b":
-                                recipients = cfg.get_notify_group_recipients("b")
-                            elif s == "k":
-                                recipients = cfg.get_notify_group_recipients("k")
-
-                        rooms_text = "\n".join([f"- {r}" for r in target_rooms]) if target_rooms else "(未知：该账号近期无成功数据)"
-                        cfg.send_email(
-                            f"🚨 Cookie失效需修复 ({s})",
-                            f"该宿舍账号凭证可能已失效（source={s}），导致连续获取失败（{fails}次）。\n\n"
-                            f"影响房间：\n{rooms_text}\n\n"
-                            f"请点击链接重新扫码登录：\n{link}\n",
-                            to_override=recipients if recipients else None
-                        )
-                        last_repair_email_time[s] = time.time()
-
-        merged = merge_room_data(ok_lists)
-
-        # 更新全局状态
-        system_status["last_check_time"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        system_status["last_check_data"] = merged
-
-        # 全局错误展示：有任何 source 异常则提示，但只要有数据就不算全局失败
-        system_status["last_error"] = "; ".join(per_source_errors) if per_source_errors else None
-
-        # 计算一个全局 consecutive_failures：当所有 source 都拿不到数据时才累计
-        if not merged:
-            system_status["consecutive_failures"] = system_status.get("consecutive_failures", 0) + 1
-        else:
-            system_status["consecutive_failures"] = 0
-
-        if merged:
-            info_str = " | ".join([f"{d['room']}: ⚡{d['kwh']}度 💰{d['money']}元" for d in merged])
-            logger.info(f"✅ 合并后数据: {info_str}")
-
-            # 低电量检测（优先按房间分发；无映射则按组回退）
-            thresh = cfg.get_float("system", "low_power_threshold", 15.0)
-            cooldown = cfg.get_int("system", "low_power_alert_cooldown_seconds", 21600)
-            recipients_a = cfg.get_notify_group_recipients("a")
-            recipients_b = cfg.get_notify_group_recipients("b")
-            recipients_k = cfg.get_notify_group_recipients("k")
-
-            def send_alert(to_list, subject, content):
-                if to_list:
-                    cfg.send_email(subject, content, to_override=to_list)
-                else:
-                    # 回退到默认 notify.to
-                    cfg.send_email(subject, content)
-
-            def send_room_alert(room, meter_type, subject, content, source=None):
-                # 1) 优先按房间映射发送
-                room_recipients = cfg.get_room_recipients(room)
-                if room_recipients:
-                    cfg.send_email(subject, content, to_override=room_recipients)
-                    return
-
-                # 2) 回退到 source 默认收件人（新模式：默认按 source 告警）
-                if source:
-                    source_recipients = cfg.get_source_recipients(source)
-                    if source_recipients:
-                        cfg.send_email(subject, content, to_override=source_recipients)
-                        return
-
-                # 3) 无映射：按原有分组回退（兼容旧模式）
-                if meter_type == "lighting":
-                    send_alert(recipients_a, subject, content)
-                    send_alert(recipients_b, subject, content)
-                    send_alert(recipients_k, subject, content)
-                elif meter_type == "ac_a":
-                    send_alert(recipients_a, subject, content)
-                elif meter_type == "ac_b":
-                    send_alert(recipients_b, subject, content)
-                else:
-                    cfg.send_email(subject, content)
-
-            for d in merged:
-                try:
-                    kwh_num = _extract_first_float(d.get('kwh', '0'))
-                    if kwh_num is None:
-                        continue
-                    if kwh_num < thresh:
-                        room_key = _normalize_room_key_for_cooldown(d.get('room'))
-                        if room_key:
-                            last_t = last_low_power_email_time.get(room_key, 0)
-                            if cooldown > 0 and (time.time() - last_t) < cooldown:
-                                continue
-
-                        meter_type = d.get("meter_type")
-                        logger.warning(f"⚠️ 低电量({meter_type}): {d.get('room')} {d.get('kwh')}")
-                        subject = f"⚠️ 缺电警告: {d.get('kwh')}度"
-                        content = f"房间/表计: {d.get('room')}\n剩余: {d.get('kwh')}度 / {d.get('money')}元\n请尽快充值!"
-
-                        send_room_alert(d.get('room'), meter_type, subject, content, source=d.get('source'))
-
-                        if room_key:
-                            last_low_power_email_time[room_key] = time.time()
-                except Exception:
-                    pass
-
-            sleep_seconds = interval
-            if transient_failure_backoffs:
-                sleep_seconds = max(5, min(sleep_seconds, min(transient_failure_backoffs)))
-            system_status["next_check_in"] = sleep_seconds
-            _monitor_wakeup_event.wait(timeout=sleep_seconds)
-            _monitor_wakeup_event.clear()
-        else:
-            logger.warning("⚠️ 所有 source 均未获取到数据")
-            sleep_seconds = 60
-            # 即使全失败，也遵循退避（通常=60，后续会逐步变长）
-            if transient_failure_backoffs:
-                sleep_seconds = max(5, min(sleep_seconds, min(transient_failure_backoffs)))
-            system_status["next_check_in"] = sleep_seconds
-            _monitor_wakeup_event.wait(timeout=sleep_seconds)
-            _monitor_wakeup_event.clear()
-
+        if cfg.get_int("system", "monitor_shards", 0) >= 2:
+            import monitor_shards
+            _shard_pool = monitor_shards.ShardPool()
+            try:
+                # 分片数被改回 0/1 时返回，回到单线程模式
+                _shard_pool.serve(state)
+            finally:
+                _shard_pool.close()
+                _shard_pool = None
+            continue
 
-            
\ No newline at end of file
+        sources = cfg.get_auth_sources()
+        configure_target(cfg)
+        endpoint_guard.configure(cfg)
+        log_pipeline.configure(cfg)
+        _scheduler.jitter_ratio = cfg.get_float("system", "schedule_jitter_ratio", 0.1)
+        for s in _scheduler.sync_sources(sources):
+            page_cache.forget(s)
+
+        due = _scheduler.pop_due()
+        if due:
+            run_cycle(cfg, sources, due, state)
+
+        sleep_seconds = _scheduler.seconds_until_next(default=interval)
+        system_status["next_check_in"] = max(1, int(round(sleep_seconds)))
+        _scheduler.wait(timeout=sleep_seconds)
@@ -0,0 +1,343 @@
+"""
+分片监控 - 把 source 按一致性哈希分给多个工作进程并行抓取（[system] monitor_shards = N，N >= 2 启用）
+
+- 每个工作进程只负责自己分片内的 source：独立的调度堆/退避、抓取、解析、分类，
+  以及这些房间的低电量/耗电速度告警（alert_rules 的读数历史与告警冷却都归分片所有）。
+  解析在各自进程内进行，不再共用一个 GIL，吞吐随 CPU 核数增长。
+- 工作进程不写 SQLite：抓取结果与冷却记录通过队列送回主进程，由监控线程作为唯一写入方
+  写入 power_log / alert_cooldown，并更新状态快照、合并数据与耗尽预测（见 monitor.run_cycle）。
+- 一致性哈希环（每个分片 64 个虚拟节点）：auth_sources 增删时只通知受影响的分片，
+  其余 source 的归属与调度不变；分片数改变时重启全部工作进程。source 换了归属进程时，
+  主进程把它的状态（连续失败次数、最近房间等）与冷却记录一并交给新的归属进程。
+- 学校接口令牌桶按分片数均分（school_rate_limit_per_second / N），整体速率不变；
+  熔断器在每个工作进程内独立计数。
+- 抓取/解析耗时直方图记录在工作进程内，分片模式下 /metrics 只有主进程侧的指标
+  与 dorm_monitor_shard_* 分片指标。
+"""
+import bisect
+import hashlib
+import multiprocessing
+import os
+import queue
+import time
+
+import log_pipeline
+import metrics
+import monitor
+import page_cache
+from config import Config, logger
+from source_scheduler import SourceScheduler
+
+VIRTUAL_NODES = 64
+# 主进程每次等待结果的最长秒数（也是检查配置/auth_sources 变化与重启异常退出进程的周期）
+COLLECT_SECONDS = 5.0
+
+SHARD_SOURCES = metrics.Gauge("dorm_monitor_shard_sources", "每个分片负责的 source 数", ("shard",))
+SHARD_RESULTS = metrics.Counter("dorm_monitor_shard_results_total", "工作进程送回的抓取结果数（按分片与结果）",
+                                ("shard", "result"))
+SHARD_RESTARTS = metrics.Counter("dorm_monitor_shard_restarts_total", "异常退出后被重启的工作进程数", ("shard",))
+
+
+def _hash(text):
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """分片编号 0..shards-1 的一致性哈希环"""
+
+    def __init__(self, shards, vnodes=VIRTUAL_NODES):
+        points = sorted((_hash(f"shard-{i}#{v}"), i) for i in range(shards) for v in range(vnodes))
+        self.shards = shards
+        self._keys = [p[0] for p in points]
+        self._owners = [p[1] for p in points]
+
+    def owner(self, source):
+        i = bisect.bisect(self._keys, _hash(source)) % len(self._keys)
+        return self._owners[i]
+
+    def assign(self, sources):
+        """返回 {分片编号: [source, ...]}（保持 sources 的原有顺序）"""
+        out = {i: [] for i in range(self.shards)}
+        for s in sources:
+            out[self.owner(s)].append(s)
+        return out
+
+
+def _configure_worker(cfg, shards, scheduler):
+    monitor.configure_target(cfg)
+    monitor.endpoint_guard.configure(cfg)
+    # 令牌桶按分片数均分，整体对学校接口的请求速率与单进程模式相同
+    rate = cfg.get_float("system", "school_rate_limit_per_second", 1.0)
+    burst = cfg.get_float("system", "school_rate_limit_burst", 5)
+    monitor.endpoint_guard.limiter.configure(rate / shards, max(1.0, burst / shards))
+    log_pipeline.configure(cfg)
+    scheduler.jitter_ratio = cfg.get_float("system", "schedule_jitter_ratio", 0.1)
+
+
+def _poll_due(due, cfg, scheduler, cooldowns):
+    """抓取本分片到期的 source，评估其告警；返回送回主进程的结果列表"""
+    interval = cfg.get_int("system", "interval", 900)
+    results = []
+    ok_lists = []
+    for s in due:
+        enriched, delay, changed = monitor._poll_source(s, cfg, interval, cooldowns["repair"])
+        scheduler.schedule(s, delay)
+        if enriched:
+            ok_lists.append(enriched)
+        results.append({
+            "source": s,
+            "enriched": enriched,
+            "changed": changed,
+            "status": {k: v for k, v in monitor.system_status["sources"][s].items() if k != "next_run_time"},
+            "next_run": scheduler.next_run_time(s),
+        })
+    if ok_lists:
+        monitor._evaluate_low_power_alerts(monitor.merge_room_data(ok_lists), cfg, cooldowns["low_power"])
+    return results
+
+
+def _worker_main(shard, shards, inbox, outbox, config_file, db_path, log_level):
+    """工作进程入口（spawn 启动，配置文件/数据库路径与日志级别由主进程传入）"""
+    import alert_state
+    import config
+    import power_db
+    config.CONFIG_FILE = config_file
+    power_db.DB_PATH = db_path
+    logger.setLevel(log_level)
+
+    cooldowns = alert_state.load("repair", "low_power")
+    scheduler = SourceScheduler()
+    sources = []
+    paused = False
+    logger.info(f"🧩 分片工作进程 {shard}/{shards} 已启动 (pid={os.getpid()})")
+
+    while True:
+        cfg = Config()
+        _configure_worker(cfg, shards, scheduler)
+        due = [] if paused else scheduler.pop_due()
+        if due:
+            results = _poll_due(due, cfg, scheduler, cooldowns)
+            dirty = cooldowns["repair"].take_dirty() + cooldowns["low_power"].take_dirty()
+            outbox.put(("cycle", shard, results, dirty))
+
+        timeout = scheduler.seconds_until_next(default=cfg.get_int("system", "interval", 900))
+        try:
+            msg = inbox.get(timeout=max(0.05, timeout))
+        except queue.Empty:
+            continue
+        while msg is not None:
+            kind = msg[0]
+            if kind == "stop":
+                logger.info(f"🧩 分片工作进程 {shard} 退出")
+                return
+            if kind == "assign":
+                _, sources, statuses, entries = msg
+                for s, st in statuses.items():
+                    monitor.system_status["sources"][s] = dict(st)
+                for kind_, key, last_sent in entries:
+                    m = cooldowns[kind_]
+                    if last_sent > m.get(key, 0):
+                        dict.__setitem__(m, key, last_sent)
+                for s in scheduler.sync_sources(sources):
+                    page_cache.forget(s)
+                for s in list(monitor.system_status["sources"]):
+                    if s not in sources:
+                        del monitor.system_status["sources"][s]
+            elif kind == "now":
+                scheduler.request_now(msg[1])
+            elif kind == "forget":
+                page_cache.forget(msg[1])
+            elif kind == "pause":
+                paused = msg[1]
+            try:
+                msg = inbox.get_nowait()
+            except queue.Empty:
+                msg = None
+
+
+class _Worker:
+    def __init__(self, ctx, shard, shards, outbox):
+        import config
+        import power_db
+        self.shard = shard
+        self.inbox = ctx.Queue()
+        self.sources = []
+        self.restarts = 0
+        self.last_result_time = None
+        self.process = ctx.Process(
+            target=_worker_main, name=f"monitor-shard-{shard}", daemon=True,
+            args=(shard, shards, self.inbox, outbox, config.CONFIG_FILE, power_db.DB_PATH, logger.level),
+        )
+        self.process.start()
+
+
+class ShardPool:
+    """主进程侧：管理工作进程、分配 source、收集结果并交给 monitor.run_cycle 写入"""
+
+    def __init__(self):
+        self._ctx = multiprocessing.get_context("spawn")
+        self._outbox = self._ctx.Queue()
+        self._workers = []
+        self._ring = None
+        self._paused = False
+
+    # ---- 进程管理 ----
+    def resize(self, shards):
+        """分片数变化时重建哈希环并重启全部工作进程（各进程的分片总数随之改变）"""
+        if self._ring is not None and self._ring.shards == shards:
+            return False
+        old = self._workers
+        self._stop(old)
+        self._ring = HashRing(shards)
+        self._workers = [_Worker(self._ctx, i, shards, self._outbox) for i in range(shards)]
+        if old:
+            logger.info(f"🧩 分片数调整: {len(old)} -> {shards}")
+        else:
+            logger.info(f"🧩 分片监控已启用: {shards} 个工作进程")
+        return True
+
+    def _stop(self, workers):
+        for w in workers:
+            try:
+                w.inbox.put(("stop",))
+            except Exception:
+                pass
+        for w in workers:
+            w.process.join(timeout=5)
+            if w.process.is_alive():
+                w.process.terminate()
+
+    def close(self):
+        self._stop(self._workers)
+        self._workers = []
+        self._ring = None
+        monitor.system_status.pop("shards", None)
+
+    def _revive(self, state):
+        """重启异常退出的工作进程，并把它的 source 重新交给它"""
+        for i, w in enumerate(self._workers):
+            if w.process.is_alive():
+                continue
+            logger.error(f"🧩 分片工作进程 {i} 异常退出 (exitcode={w.process.exitcode})，正在重启")
+            SHARD_RESTARTS.labels(str(i)).inc()
+            nw = _Worker(self._ctx, i, self._ring.shards, self._outbox)
+            nw.restarts = w.restarts + 1
+            self._workers[i] = nw
+            self._send_assignment(nw, w.sources, w.sources, state)
+
+    # ---- 分配 ----
+    def _send_assignment(self, w, sources, moved, state):
+        statuses = {s: monitor.system_status["sources"][s] for s in moved if s in monitor.system_status["sources"]}
+        entries = [("repair", s, state.last_repair_email_time[s]) for s in moved if s in state.last_repair_email_time]
+        if moved:
+            # 房间不固定属于某个 source，低电量冷却全部交给接手的进程（只在迁移时发送）
+            entries.extend(("low_power", k, t) for k, t in state.last_low_power_email_time.items()
+                           if not k.startswith("forecast:"))
+        w.inbox.put(("assign", list(sources), statuses, entries))
+        w.sources = list(sources)
+        if self._paused:
+            w.inbox.put(("pause", True))
+        SHARD_SOURCES.labels(str(w.shard)).set(len(sources))
+
+    def assign(self, sources, state, force=False):
+        """按哈希环分配 source；只通知归属发生变化的分片"""
+        wanted = set(sources)
+        for w in self._workers:
+            for s in w.sources:
+                if s not in wanted:
+                    page_cache.forget(s)    # 写入端的刷新记录
+        for shard, mine in self._ring.assign(sources).items():
+            w = self._workers[shard]
+            if mine == w.sources and not force:
+                continue
+            moved = [s for s in mine if s not in w.sources]
+            self._send_assignment(w, mine, moved, state)
+            logger.info("🧩 分片 %d 负责 %d 个 source（新接手 %d 个）", shard, len(mine), len(moved))
+
+    def set_paused(self, paused):
+        if paused == self._paused:
+            return
+        self._paused = paused
+        for w in self._workers:
+            w.inbox.put(("pause", paused))
+
+    def request_now(self, source=None):
+        """转发"立即抓取"：指定 source 只通知其归属分片，否则通知全部分片"""
+        ring, workers = self._ring, self._workers
+        if ring is None:
+            return
+        targets = [workers[ring.owner(source)]] if source else workers
+        for w in targets:
+            w.inbox.put(("now", source))
+
+    def forget_page_cache(self, source=None):
+        """转发"丢弃页面缓存"（Cookie 重新绑定后），路由规则同 request_now"""
+        ring, workers = self._ring, self._workers
+        if ring is None:
+            return
+        targets = [workers[ring.owner(source)]] if source else workers
+        for w in targets:
+            w.inbox.put(("forget", source))
+
+    # ---- 结果 ----
+    def collect(self, timeout=COLLECT_SECONDS):
+        """等待工作进程的结果；返回 (results, cooldown_entries)，超时返回两个空列表"""
+        results, entries = [], []
+        try:
+            msg = self._outbox.get(timeout=timeout)
+        except queue.Empty:
+            return results, entries
+        while msg is not None:
+            _, shard, batch, dirty = msg
+            now = time.time()
+            if shard < len(self._workers):
+                self._workers[shard].last_result_time = now
+            for r in batch:
+                SHARD_RESULTS.labels(str(shard), "ok" if r["enriched"] else "fail").inc()
+            results.extend(batch)
+            entries.extend(dirty)
+            try:
+                msg = self._outbox.get_nowait()
+            except queue.Empty:
+                msg = None
+        return results, entries
+
+    def snapshot(self):
+        return [{
+            "shard": w.shard,
+            "pid": w.process.pid,
+            "alive": w.process.is_alive(),
+            "sources": len(w.sources),
+            "restarts": w.restarts,
+            "last_result_time": w.last_result_time and time.strftime("%Y-%m-%d %H:%M:%S",
+                                                                     time.localtime(w.last_result_time)),
+        } for w in self._workers]
+
+    def serve(self, state):
+        """主进程监控循环（单一写入方）；monitor_shards 被改回 0/1 时返回"""
+        next_runs = {}
+        while True:
+            cfg = Config()
+            shards = cfg.get_int("system", "monitor_shards", 0)
+            if shards < 2:
+                logger.info("🧩 monitor_shards < 2，回到单线程监控")
+                return
+            sources = cfg.get_auth_sources()
+            resized = self.resize(shards)
+            self._revive(state)
+            self.assign(sources, state, force=resized)
+            self.set_paused(not monitor.system_status["is_monitoring"])
+            log_pipeline.configure(cfg)
+
+            results, entries = self.collect()
+            if entries:
+                state.merge_cooldowns(entries)
+            if results:
+                due = [r["source"] for r in results]
+                monitor.run_cycle(cfg, sources, due, state, results=results)
+                next_runs.update((r["source"], r["next_run"]) for r in results if r["next_run"])
+            for s in [s for s in next_runs if s not in sources]:
+                del next_runs[s]
+            if next_runs:
+                monitor.system_status["next_check_in"] = max(1, int(round(min(next_runs.values()) - time.time())))
+            monitor.system_status["shards"] = self.snapshot()
@@ -0,0 +1,128 @@
+"""
+页面指纹缓存 - 学校页面与上次相同时跳过解析、分类与入库
+
+- 抓取端：每个 source 记录上次成功页面的 body 指纹（blake2b）与 ETag / Last-Modified，
+  下次请求带上 If-None-Match / If-Modified-Since；服务器返回 304 或 body 指纹相同即视为未变化，
+  直接复用上次的解析结果（分类规则未变时连分类结果一起复用），reason_code 为 unchanged。
+- 写入端：power_log_mode=change 时未变化的读数不再逐轮写库（every 模式照常每轮写入）；但每个 source 至少每 page_cache_refresh_seconds 秒
+  （默认 3600，0 表示照常逐轮写库）以及跨天后的第一轮仍写入一次，保证区间结束时间与每日统计不缺天。
+- 命中/未命中与跳过的写入计数见 /metrics 的 dorm_page_cache_total 与 /api/status 的 page_cache。
+  分片模式下两端分属工作进程与主进程，计数在主进程（写入端）统计。
+"""
+import hashlib
+import threading
+import time
+from datetime import datetime
+
+import metrics
+
+DEFAULT_REFRESH_SECONDS = 3600
+
+PAGE_CACHE_TOTAL = metrics.Counter("dorm_page_cache_total", "成功抓取按页面是否变化计数（hit=未变化复用）", ("result",))
+PAGE_CACHE_HIT = PAGE_CACHE_TOTAL.labels("hit")
+PAGE_CACHE_MISS = PAGE_CACHE_TOTAL.labels("miss")
+SKIPPED_WRITES = metrics.Counter("dorm_page_cache_skipped_writes_total", "页面未变化而跳过的入库次数").labels()
+
+
+class _Entry:
+    __slots__ = ("digest", "etag", "last_modified", "data", "classifier", "enriched")
+
+    def __init__(self, digest, etag, last_modified, data):
+        self.digest = digest
+        self.etag = etag
+        self.last_modified = last_modified
+        self.data = data
+        self.classifier = None
+        self.enriched = None
+
+
+_entries = {}           # source -> _Entry（抓取端）
+_written = {}           # source -> (写入时间戳, 日期)（写入端）
+_lock = threading.Lock()
+
+
+def fingerprint(body):
+    return hashlib.blake2b(body, digest_size=16).digest()
+
+
+def conditional_headers(source):
+    """上次成功页面带有 ETag / Last-Modified 时返回对应的条件请求头"""
+    e = _entries.get(source)
+    headers = {}
+    if e is not None:
+        if e.etag:
+            headers["If-None-Match"] = e.etag
+        if e.last_modified:
+            headers["If-Modified-Since"] = e.last_modified
+    return headers
+
+
+def unchanged(source, digest=None):
+    """页面未变化时返回上次的解析结果，否则返回 None。digest=None 表示服务器返回了 304"""
+    e = _entries.get(source)
+    if e is None or (digest is not None and digest != e.digest):
+        return None
+    return e.data
+
+
+def store(source, digest, resp_headers, data):
+    """记录一次成功解析的页面（解析结果会被后续轮次复用，调用方不要原地修改 data）"""
+    with _lock:
+        _entries[source] = _Entry(digest, resp_headers.get("ETag"), resp_headers.get("Last-Modified"), data)
+
+
+def cached_enriched(source, classifier):
+    """同一页面、同一分类器下的分类结果；不满足时返回 None"""
+    e = _entries.get(source)
+    if e is None or e.enriched is None or e.classifier is not classifier:
+        return None
+    return e.enriched
+
+
+def store_enriched(source, classifier, enriched):
+    e = _entries.get(source)
+    if e is not None:
+        e.classifier = classifier
+        e.enriched = enriched
+
+
+def write_due(source, changed, cfg, mode="change", now=None):
+    """写入端调用：本轮读数是否需要写库（同时统计命中/未命中）。
+
+    mode 为 power_log_mode：every 表示每轮都写，不跳过。
+    """
+    now = now or time.time()
+    today = datetime.fromtimestamp(now).strftime("%Y-%m-%d")
+    (PAGE_CACHE_MISS if changed else PAGE_CACHE_HIT).inc()
+    if mode == "every":
+        return True
+    last = _written.get(source)
+    refresh = cfg.get_int("system", "page_cache_refresh_seconds", DEFAULT_REFRESH_SECONDS)
+    if not changed and refresh > 0 and last is not None and last[1] == today and now - last[0] < refresh:
+        SKIPPED_WRITES.inc()
+        return False
+    _written[source] = (now, today)
+    return True
+
+
+def forget(source=None):
+    """丢弃 source（None 表示全部）的缓存，下次抓取按新页面处理"""
+    with _lock:
+        if source is None:
+            _entries.clear()
+            _written.clear()
+        else:
+            _entries.pop(source, None)
+            _written.pop(source, None)
+
+
+def snapshot():
+    """供 /api/status 展示的命中统计"""
+    hits, misses = PAGE_CACHE_HIT.value, PAGE_CACHE_MISS.value
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": round(hits / total, 3) if total else None,
+        "skipped_writes": SKIPPED_WRITES.value,
+    }
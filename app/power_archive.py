@@ -0,0 +1,289 @@
+"""
+历史读数归档模块 - 把过期的 power_log 数据导出为按月的列式 NumPy 文件
+
+目录结构（默认在数据库所在目录下的 archive/，与 power.db 同在数据卷中；可用 [system] archive_dir 覆盖）：
+
+    archive/2025-07/ts.npy      int64   本地时间按 UTC 换算的秒数
+    archive/2025-07/room.npy    uint32  房间字典下标
+    archive/2025-07/kwh.npy     float32 剩余电量
+    archive/2025-07/rooms.json  房间字典 [[source, room], ...]（最后写入，作为完成标记）
+
+查询时以 mmap 方式打开，向量化过滤，不把整月数据读入内存。
+归档任务可重复执行：同月已有归档时先合并去重再覆盖，最后才删除 SQLite 中的数据——
+月份分区（见 power_partitions）整个文件删掉，主库里未分区的旧数据才执行 DELETE。
+"""
+import os
+import json
+import shutil
+import calendar
+from datetime import datetime, date, timedelta
+import numpy as np
+from config import logger
+import power_db
+from power_db import get_db
+import power_partitions
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def default_archive_dir():
+    # 跟随数据库目录（DORM_DATA_DIR），归档是删除分区后唯一的一份历史数据，必须在持久化的数据卷里
+    return os.path.join(os.path.dirname(os.path.abspath(power_db.DB_PATH)), "archive")
+
+
+def archive_dir(cfg=None):
+    path = cfg.get("system", "archive_dir", "") if cfg is not None else ""
+    return path or default_archive_dir()
+
+
+def _to_ts(date_str, time_str):
+    return int((datetime.strptime(f"{date_str} {time_str}", "%Y-%m-%d %H:%M:%S") - _EPOCH).total_seconds())
+
+
+def _from_ts(ts):
+    return _EPOCH + timedelta(seconds=int(ts))
+
+
+def _month_range(month):
+    """'2025-07' -> ('2025-07-01', '2025-07-31')"""
+    y, m = (int(x) for x in month.split("-"))
+    last = calendar.monthrange(y, m)[1]
+    return f"{month}-01", f"{month}-{last:02d}"
+
+
+def _month_path(base, month):
+    return os.path.join(base, month)
+
+
+def list_months(base=None):
+    """已完成归档的月份（含 rooms.json 才算完成）"""
+    base = base or default_archive_dir()
+    if not os.path.isdir(base):
+        return []
+    return sorted(
+        m for m in os.listdir(base)
+        if os.path.exists(os.path.join(base, m, "rooms.json"))
+    )
+
+
+def load_month(base, month, mmap=True):
+    """返回 (rooms, ts, room_ids, kwh)；数组默认以只读 mmap 打开（零拷贝）"""
+    path = _month_path(base, month)
+    with open(os.path.join(path, "rooms.json"), "r", encoding="utf-8") as f:
+        rooms = [tuple(x) for x in json.load(f)]
+    mode = "r" if mmap else None
+    ts = np.load(os.path.join(path, "ts.npy"), mmap_mode=mode)
+    room_ids = np.load(os.path.join(path, "room.npy"), mmap_mode=mode)
+    kwh = np.load(os.path.join(path, "kwh.npy"), mmap_mode=mode)
+    return rooms, ts, room_ids, kwh
+
+
+def _write_month(base, month, rooms, ts, room_ids, kwh):
+    """先写临时目录再整体替换，避免留下半个归档"""
+    final = _month_path(base, month)
+    tmp = final + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    np.save(os.path.join(tmp, "ts.npy"), ts.astype(np.int64))
+    np.save(os.path.join(tmp, "room.npy"), room_ids.astype(np.uint32))
+    np.save(os.path.join(tmp, "kwh.npy"), kwh.astype(np.float32))
+    with open(os.path.join(tmp, "rooms.json"), "w", encoding="utf-8") as f:
+        json.dump([list(r) for r in rooms], f, ensure_ascii=False)
+    old = final + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(final):
+        os.replace(final, old)
+    os.replace(tmp, final)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def archive_month(conn, month, base):
+    """归档单个月份：合并已有归档 + SQLite 中该月数据，去重后写回，再删除该月的分区文件
+    与主库中未分区的行。
+
+    返回本次从 SQLite 迁出的行数。
+    """
+    start, end = _month_range(month)
+    power_partitions.attach_months(conn, [month])
+    rows = conn.execute('''
+        SELECT source, room, date, time, remain_power FROM power_log_view
+        WHERE date BETWEEN ? AND ?
+    ''', (start, end)).fetchall()
+
+    if os.path.exists(os.path.join(_month_path(base, month), "rooms.json")):
+        rooms, ts, room_ids, kwh = load_month(base, month, mmap=False)
+    else:
+        rooms, ts = [], np.empty(0, np.int64)
+        room_ids, kwh = np.empty(0, np.uint32), np.empty(0, np.float32)
+
+    if rows:
+        index = {r: i for i, r in enumerate(rooms)}
+        new_ts = np.empty(len(rows), np.int64)
+        new_ids = np.empty(len(rows), np.uint32)
+        new_kwh = np.empty(len(rows), np.float32)
+        for i, r in enumerate(rows):
+            key = (r["source"], r["room"] or "")
+            rid = index.get(key)
+            if rid is None:
+                rid = index[key] = len(rooms)
+                rooms.append(key)
+            new_ts[i] = _to_ts(r["date"], r["time"])
+            new_ids[i] = rid
+            new_kwh[i] = r["remain_power"]
+        ts = np.concatenate([ts, new_ts])
+        room_ids = np.concatenate([room_ids, new_ids])
+        kwh = np.concatenate([kwh, new_kwh])
+
+        # 重复执行（例如上次写完归档后、删除 SQLite 行前中断）时去重
+        rec = np.rec.fromarrays([room_ids, ts, kwh], names="room,ts,kwh")
+        _u, keep = np.unique(rec, return_index=True)
+        keep.sort()
+        order = keep[np.lexsort((ts[keep], room_ids[keep]))]
+        ts, room_ids, kwh = ts[order], room_ids[order], kwh[order]
+
+        _write_month(base, month, rooms, ts, room_ids, kwh)
+
+    conn.execute("DELETE FROM main.power_log WHERE date BETWEEN ? AND ?", (start, end))
+    conn.execute("DELETE FROM main.power_log_interval WHERE end_date BETWEEN ? AND ?", (start, end))
+    conn.commit()
+    power_partitions.attach_months(conn, [])
+    freed = power_partitions.drop(month)
+    if freed:
+        logger.info(f"[归档] {month} 分区文件已删除，释放 {freed / 1024 / 1024:.1f}MB")
+    return len(rows)
+
+
+def archive_old_months(cfg=None, keep_days=180, today=None):
+    """把早于 keep_days 的完整月份归档。可重复执行，返回 {month: rows}。"""
+    base = archive_dir(cfg)
+    os.makedirs(base, exist_ok=True)
+    today = today or date.today()
+    cutoff = (today - timedelta(days=keep_days)).strftime("%Y-%m-%d")
+
+    conn = get_db()
+    try:
+        legacy = {r[0] for r in conn.execute('''
+            SELECT DISTINCT substr(date, 1, 7) FROM main.power_log_view WHERE date < ?
+        ''', (cutoff,))}
+        months = sorted(legacy.union(power_partitions.months(end=cutoff)))
+        result = {}
+        for month in months:
+            # 只归档整月都早于 cutoff 的月份，当月剩余部分下次再处理
+            if _month_range(month)[1] >= cutoff:
+                continue
+            result[month] = archive_month(conn, month, base)
+            logger.info(f"[归档] {month} 已归档 {result[month]} 行")
+        return result
+    finally:
+        conn.close()
+
+
+def query_archive(start_date, end_date, source=None, room=None, base=None):
+    """在归档中查询 [start_date, end_date] 的读数。
+
+    返回 list[dict]：source/room/date/time/remain_power，按时间排序。
+    """
+    base = base or default_archive_dir()
+    lo = _to_ts(start_date, "00:00:00")
+    hi = _to_ts(end_date, "23:59:59")
+    out = []
+    for month in list_months(base):
+        m_start, m_end = _month_range(month)
+        if m_end < start_date or m_start > end_date:
+            continue
+        rooms, ts, room_ids, kwh = load_month(base, month)
+        mask = (ts >= lo) & (ts <= hi)
+        if source is not None or room is not None:
+            wanted = [i for i, (s, r) in enumerate(rooms)
+                      if (source is None or s == source) and (room is None or r == room)]
+            if not wanted:
+                continue
+            mask &= np.isin(room_ids, np.asarray(wanted, dtype=np.uint32))
+        idx = np.nonzero(mask)[0]
+        for t, rid, v in zip(ts[idx].tolist(), room_ids[idx].tolist(), kwh[idx].tolist()):
+            dt = _from_ts(t)
+            s, r = rooms[rid]
+            out.append({
+                "source": s, "room": r,
+                "date": dt.strftime("%Y-%m-%d"), "time": dt.strftime("%H:%M:%S"),
+                "remain_power": round(float(v), 2)
+            })
+    out.sort(key=lambda d: (d["date"], d["time"]))
+    return out
+
+
+def iter_archive(start_date=None, end_date=None, source=None, room=None, base=None, chunk=5000):
+    """按块遍历归档读数，yield [(source, room, date, time, remain_power), ...]。
+
+    mmap 数组按 chunk 分片过滤与转换，不会一次性生成整月的结果（用于流式导出）。
+    """
+    base = base or default_archive_dir()
+    lo = _to_ts(start_date, "00:00:00") if start_date else None
+    hi = _to_ts(end_date, "23:59:59") if end_date else None
+    for month in list_months(base):
+        m_start, m_end = _month_range(month)
+        if (end_date and m_start > end_date) or (start_date and m_end < start_date):
+            continue
+        rooms, ts, room_ids, kwh = load_month(base, month)
+        wanted = None
+        if source is not None or room is not None:
+            wanted = np.asarray([i for i, (s, r) in enumerate(rooms)
+                                 if (source is None or s == source) and (room is None or r == room)],
+                                dtype=np.uint32)
+            if not len(wanted):
+                continue
+        for pos in range(0, len(ts), chunk):
+            t = np.asarray(ts[pos:pos + chunk])
+            ids = np.asarray(room_ids[pos:pos + chunk])
+            mask = np.ones(len(t), dtype=bool)
+            if lo is not None:
+                mask &= t >= lo
+            if hi is not None:
+                mask &= t <= hi
+            if wanted is not None:
+                mask &= np.isin(ids, wanted)
+            idx = np.flatnonzero(mask)
+            if not len(idx):
+                continue
+            # 归档时间戳按"本地时间当作 UTC"换算，直接转回即为本地时间
+            stamps = np.datetime_as_string(t[idx].astype("datetime64[s]")).tolist()
+            values = np.asarray(kwh[pos:pos + chunk])[idx].astype(np.float64).round(2).tolist()
+            yield [(rooms[i][0], rooms[i][1], st[:10], st[11:], v)
+                   for i, st, v in zip(ids[idx].tolist(), stamps, values)]
+
+
+def query_readings(start_date, end_date, source=None, room=None, cfg=None):
+    """统一历史查询：归档（mmap）+ SQLite 在线数据，按时间排序"""
+    rows = query_archive(start_date, end_date, source=source, room=room, base=archive_dir(cfg))
+    sql = "SELECT source, room, date, time, remain_power FROM power_log_view WHERE date BETWEEN ? AND ?"
+    params = [start_date, end_date]
+    if source is not None:
+        sql += " AND source = ?"
+        params.append(source)
+    if room is not None:
+        sql += " AND room = ?"
+        params.append(room)
+    conn = get_db()
+    try:
+        for lo, hi in power_partitions.split_range(start_date, end_date, power_partitions.max_attached(conn)):
+            power_partitions.attach(conn, lo, hi)
+            params[0], params[1] = lo, hi
+            rows.extend(dict(r) for r in conn.execute(sql, params))
+    finally:
+        conn.close()
+    rows.sort(key=lambda d: (d["date"], d["time"]))
+    return rows
+
+
+def daily_consumption(start_date, end_date, source=None, room=None, cfg=None):
+    """按天统计消耗（与 calc_daily_power 一致：当天 max - min），归档与在线数据合并计算"""
+    result = {}
+    for d in query_readings(start_date, end_date, source=source, room=room, cfg=cfg):
+        key = (d["date"], d["source"], d["room"])
+        lo_hi = result.get(key)
+        v = d["remain_power"]
+        result[key] = (min(lo_hi[0], v), max(lo_hi[1], v)) if lo_hi else (v, v)
+    days = {}
+    for (day, _s, _r), (lo, hi) in result.items():
+        days[day] = days.get(day, 0.0) + (hi - lo)
+    return days
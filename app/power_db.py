@@ -1,26 +1,53 @@
 import sqlite3
 import os
 
-DB_PATH = os.path.join(os.path.dirname(__file__), 'power.db')
+# DORM_DATA_DIR：数据库所在目录（Docker 部署时指向挂载的数据卷），默认与代码同目录
+DB_PATH = os.path.join(os.environ.get("DORM_DATA_DIR") or os.path.dirname(__file__), 'power.db')
 
 SCHEMA_PATH = os.path.join(os.path.dirname(__file__), 'power_schema.sql')
 # SCHEMA_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'power_schema.sql')
 
+# 旧库升级时需要补齐的列：(表, 列, 定义)
+_MIGRATE_COLUMNS = [
+    ("power_log", "room", "TEXT"),
+]
+
+
+def _migrate(conn):
+    """为已存在的旧库补齐新增列（建表语句均为 IF NOT EXISTS，可重复执行）"""
+    for table, column, decl in _MIGRATE_COLUMNS:
+        cols = [r[1] for r in conn.execute(f"PRAGMA table_info({table})")]
+        if cols and column not in cols:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+            print(f"[init_db] 已为 {table} 补充列 {column}")
+
+
 def init_db():
-    if not os.path.exists(DB_PATH):
+    is_new = not os.path.exists(DB_PATH)
+    if is_new:
         print(f"[init_db] DB不存在，准备初始化，SCHEMA_PATH={SCHEMA_PATH}")
-        with open(SCHEMA_PATH, 'r', encoding='utf-8') as f:
-            schema = f.read()
-        print(f"[init_db] 读取SQL内容：{schema[:100]}...")  # 打印前100字符
-        conn = sqlite3.connect(DB_PATH)
-        try:
-            conn.executescript(schema)
-            conn.commit()
+    with open(SCHEMA_PATH, 'r', encoding='utf-8') as f:
+        schema = f.read()
+    os.makedirs(os.path.dirname(os.path.abspath(DB_PATH)), exist_ok=True)
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        if is_new:
+            # 只能在建表前设置；旧库需 VACUUM 才能转换（见 power_maintenance convert）
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        # WAL：读（备份、导出、统计）不阻塞监控线程写入；模式记录在库文件中，之后的连接沿用
+        conn.execute("PRAGMA journal_mode=WAL")
+        # 先补列再执行建表脚本：视图依赖新增列
+        _migrate(conn)
+        conn.executescript(schema)
+        conn.commit()
+        if is_new:
             print("[init_db] 建表SQL已执行")
-        finally:
-            conn.close()
+    finally:
+        conn.close()
 
 def get_db():
     conn = sqlite3.connect(DB_PATH)
+    # WAL 下 NORMAL 只在检查点时 fsync，断电最多丢最后几次提交，不会损坏库
+    conn.execute("PRAGMA synchronous=NORMAL")
     conn.row_factory = sqlite3.Row
     return conn
@@ -0,0 +1,226 @@
+"""
+历史数据导出 - 以流式方式导出读数（power_log + 区间表 + 归档）与每日统计（power_daily）
+
+- 按主键分块读取（keyset 分页：WHERE id > 上一块最后的 id ORDER BY id LIMIT N），
+  每块是一条独立的短查询，导出期间不长时间持有读锁，监控线程可以照常写入；
+  内存只与块大小有关，不会把结果集整体读入内存。
+- 读数与 power_log_view 一致：逐条日志 + 区间起止两个数据点；默认包含已归档月份（archive=0 关闭）。
+- 输出 CSV（带 BOM，Excel 可直接打开）或 NDJSON（每行一个 JSON 对象），可选 gzip 流式压缩。
+- 输出顺序：归档（按月）-> 主库 power_log -> power_log_interval -> 各月份分区（同样两张表），
+  各部分内部按写入顺序；不保证全局按时间排序，每行都带 date/time。
+
+用法：
+    python power_export.py readings|daily [--format csv|ndjson] [--gzip] [--source S] [--room R]
+                           [--start YYYY-MM-DD] [--end YYYY-MM-DD] [--no-archive] [--out 文件]
+或管理员接口 GET /api/admin/export。
+"""
+import csv
+import io
+import json
+import re
+import sys
+import time
+import zlib
+
+import power_archive
+import power_partitions
+from config import logger
+from power_db import get_db
+
+DEFAULT_CHUNK_ROWS = 5000
+
+COLUMNS = {
+    "readings": ("source", "room", "date", "time", "remain_power"),
+    "daily": ("source", "date", "consume_power"),
+}
+FORMATS = ("csv", "ndjson")
+
+_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+def _filters(source, room, start, end, date_col, with_room=True):
+    conds, params = [], []
+    if source is not None:
+        conds.append("source = ?")
+        params.append(source)
+    if room is not None and with_room:
+        conds.append("room = ?")
+        params.append(room)
+    if start is not None:
+        conds.append(f"{date_col} >= ?")
+        params.append(start)
+    if end is not None:
+        conds.append(f"{date_col} <= ?")
+        params.append(end)
+    return conds, params
+
+
+def _keyset(conn, columns, table, conds, params, chunk):
+    """按 id 分块读取（第一列必须是 id）；每块一条短查询，块之间不持有读锁"""
+    where = " AND ".join(["id > ?"] + conds)
+    sql = f"SELECT {columns} FROM {table} WHERE {where} ORDER BY id LIMIT ?"
+    last = 0
+    while True:
+        rows = conn.execute(sql, [last, *params, chunk]).fetchall()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk:
+            return
+        last = rows[-1][0]
+
+
+def iter_readings(source=None, room=None, start=None, end=None, include_archive=True,
+                  chunk=DEFAULT_CHUNK_ROWS, cfg=None):
+    """按块 yield [(source, room, date, time, remain_power), ...]"""
+    if include_archive:
+        yield from power_archive.iter_archive(start, end, source=source, room=room,
+                                              base=power_archive.archive_dir(cfg), chunk=chunk)
+    conn = get_db()
+    conn.row_factory = None
+    try:
+        yield from _iter_tables(conn, source, room, start, end, chunk)
+    finally:
+        conn.close()
+    # 月份分区逐个直连读取，不受 ATTACH 数量限制
+    for month in power_partitions.months(start, end):
+        conn = power_partitions.connect(month)
+        conn.row_factory = None
+        try:
+            yield from _iter_tables(conn, source, room, start, end, chunk)
+        finally:
+            conn.close()
+
+
+def _iter_tables(conn, source, room, start, end, chunk):
+    """读取一个库里的 power_log 与 power_log_interval"""
+    conds, params = _filters(source, room, start, end, "date")
+    for rows in _keyset(conn, "id, source, room, date, time, remain_power", "power_log",
+                        conds, params, chunk):
+        yield [r[1:] for r in rows]
+
+    # 区间不跨天，按 start_date 过滤即可；与视图一致，samples > 1 时再输出结束点
+    conds, params = _filters(source, room, start, end, "start_date")
+    for rows in _keyset(conn, "id, source, room, start_date, start_time, end_date, end_time, remain_power, samples",
+                        "power_log_interval", conds, params, chunk):
+        block = []
+        for _id, s, r, sd, st, ed, et, p, n in rows:
+            block.append((s, r, sd, st, p))
+            if n > 1:
+                block.append((s, r, ed, et, p))
+        yield block
+
+
+def iter_daily(source=None, start=None, end=None, chunk=DEFAULT_CHUNK_ROWS):
+    """按块 yield [(source, date, consume_power), ...]"""
+    conn = get_db()
+    conn.row_factory = None
+    try:
+        conds, params = _filters(source, None, start, end, "date", with_room=False)
+        for rows in _keyset(conn, "id, source, date, consume_power", "power_daily", conds, params, chunk):
+            yield [r[1:] for r in rows]
+    finally:
+        conn.close()
+
+
+def _csv_chunks(columns, blocks):
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    buf.write("\ufeff")
+    writer.writerow(columns)
+    for block in blocks:
+        writer.writerows(block)
+        yield buf.getvalue().encode("utf-8"), len(block)
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8"), 0
+
+
+def _ndjson_chunks(columns, blocks):
+    dumps = json.JSONEncoder(ensure_ascii=False).encode
+    for block in blocks:
+        text = "".join(dumps(dict(zip(columns, row))) + "\n" for row in block)
+        yield text.encode("utf-8"), len(block)
+
+
+def validate(kind, fmt, room=None, start=None, end=None):
+    """参数校验，不合法时抛 ValueError（在开始输出前调用）"""
+    if kind not in COLUMNS:
+        raise ValueError(f"kind 必须是 {' / '.join(COLUMNS)}")
+    if fmt not in FORMATS:
+        raise ValueError(f"format 必须是 {' / '.join(FORMATS)}")
+    if kind == "daily" and room is not None:
+        raise ValueError("power_daily 没有房间列，不支持 room 过滤")
+    for name, value in (("start", start), ("end", end)):
+        if value is not None and not _DATE_RE.match(value):
+            raise ValueError(f"{name} 格式应为 YYYY-MM-DD")
+
+
+def stream_export(kind="readings", fmt="csv", source=None, room=None, start=None, end=None,
+                  compress=False, include_archive=True, chunk=DEFAULT_CHUNK_ROWS, cfg=None):
+    """校验参数并返回 bytes 块的生成器（参数错误时立即抛 ValueError）"""
+    validate(kind, fmt, room=room, start=start, end=end)
+    chunk = max(100, int(chunk))
+    if kind == "readings":
+        blocks = iter_readings(source, room, start, end, include_archive=include_archive, chunk=chunk, cfg=cfg)
+    else:
+        blocks = iter_daily(source, start, end, chunk=chunk)
+    encoded = (_csv_chunks if fmt == "csv" else _ndjson_chunks)(COLUMNS[kind], blocks)
+    return _stream(encoded, compress, f"{kind}/{fmt}{'+gzip' if compress else ''}")
+
+
+def _stream(encoded, compress, what):
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    rows = 0
+    t0 = time.perf_counter()
+    done = False
+    try:
+        for data, n in encoded:
+            rows += n
+            if gz is not None:
+                data = gz.compress(data)
+            if data:
+                yield data
+        if gz is not None:
+            yield gz.flush()
+        done = True
+    finally:
+        # 客户端中途断开时生成器被 close()，同样走到这里并关闭数据库连接
+        encoded.close()
+        logger.info("[导出] %s %s：%d 行，用时 %.1fs", what, "完成" if done else "中断",
+                    rows, time.perf_counter() - t0)
+
+
+if __name__ == '__main__':
+    import argparse
+    from config import Config
+
+    ap = argparse.ArgumentParser(description="流式导出历史读数 / 每日统计")
+    ap.add_argument("kind", choices=list(COLUMNS))
+    ap.add_argument("--format", default="csv", choices=FORMATS)
+    ap.add_argument("--gzip", action="store_true")
+    ap.add_argument("--source")
+    ap.add_argument("--room")
+    ap.add_argument("--start")
+    ap.add_argument("--end")
+    ap.add_argument("--no-archive", action="store_true", help="不包含已归档月份")
+    ap.add_argument("--out", help="输出文件（默认标准输出）")
+    args = ap.parse_args()
+
+    cfg = Config()
+    try:
+        stream = stream_export(args.kind, args.format, source=args.source, room=args.room,
+                               start=args.start, end=args.end, compress=args.gzip,
+                               include_archive=not args.no_archive,
+                               chunk=cfg.get_int("system", "export_chunk_rows", DEFAULT_CHUNK_ROWS), cfg=cfg)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(2)
+    out = open(args.out, "wb") if args.out else sys.stdout.buffer
+    try:
+        for piece in stream:
+            out.write(piece)
+    finally:
+        if args.out:
+            out.close()
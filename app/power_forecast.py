@@ -0,0 +1,183 @@
+"""
+耗尽预测模块 - 按房间拟合近期耗电速度，缓存"预计几天用完/何时跌破阈值"
+
+每轮监控结束后调用一次 update()：
+- 从 power_log_view 取最近 N 天读数，按小时汇总（rollup）
+- 识别充值（读数上升）并只用最后一次充值之后的数据
+- 指数衰减加权的最小二乘，所有房间在一次向量化计算中完成
+- 汇总与拟合按小时粒度变化，最多每 forecast_min_interval_seconds 秒（默认 600）重做一次；
+  期间每轮只用缓存的耗电速度和最新读数重算各房间的预测（不访问数据库）
+结果缓存在内存中，/api/status 与提前告警直接读取，不做逐请求计算。
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from config import logger
+from power_db import get_db
+import power_partitions
+
+# 读数上升超过该值视为一次充值
+RECHARGE_EPSILON = 0.01
+# 每天耗电低于该值视为"几乎不耗电"，不给出预测
+MIN_RATE_PER_DAY = 0.05
+
+DEFAULT_MIN_INTERVAL_SECONDS = 600
+
+_forecasts = {}
+_updated_at = None
+_rates = None           # (index, rates, 拟合时刻 monotonic, window_days, half_life)
+_lock = threading.Lock()
+
+
+def _load_rollups(conn, window_days):
+    """按 (source, room, 小时) 汇总最近 window_days 天的读数"""
+    since = (datetime.now() - timedelta(days=window_days)).strftime("%Y-%m-%d")
+    power_partitions.attach(conn, since)
+    return conn.execute('''
+        SELECT source, room,
+               AVG((julianday(date || ' ' || time) - 2440587.5) * 24.0) AS t_hours,
+               AVG(remain_power) AS kwh
+        FROM power_log_view
+        WHERE date >= ? AND room IS NOT NULL AND room != ''
+        GROUP BY source, room, date, substr(time, 1, 2)
+        ORDER BY source, room, t_hours
+    ''', (since,)).fetchall()
+
+
+def fit_rates(keys, t_hours, kwh, now_hours, half_life_hours=48.0):
+    """向量化拟合每个 key 的耗电速度（度/小时，正数表示在消耗）。
+
+    keys: int 数组，同一 key 的点需连续且按时间升序
+    返回 float 数组（长度 = keys.max()+1），无法拟合的为 nan。
+    """
+    n_keys = int(keys.max()) + 1 if len(keys) else 0
+    rates = np.full(n_keys, np.nan)
+    if len(keys) < 2:
+        return rates
+
+    # 充值感知：同一 key 内读数上升处为新段起点，只保留每个 key 的最后一段
+    same = np.r_[False, keys[1:] == keys[:-1]]
+    rise = np.r_[False, np.diff(kwh) > RECHARGE_EPSILON] & same
+    seg_start = ~same | rise
+    seg_id = np.cumsum(seg_start)
+    last_seg = np.zeros(n_keys, dtype=seg_id.dtype)
+    np.maximum.at(last_seg, keys, seg_id)
+    use = seg_id == last_seg[keys]
+
+    k = keys[use]
+    t = t_hours[use] - now_hours
+    y = kwh[use]
+    w = np.power(0.5, -t / half_life_hours)
+
+    sw = np.bincount(k, w, n_keys)
+    swt = np.bincount(k, w * t, n_keys)
+    swy = np.bincount(k, w * y, n_keys)
+    swtt = np.bincount(k, w * t * t, n_keys)
+    swty = np.bincount(k, w * t * y, n_keys)
+    cnt = np.bincount(k, None, n_keys)
+
+    denom = sw * swtt - swt * swt
+    ok = (cnt >= 2) & (denom > 1e-9)
+    slope = np.divide(sw * swty - swt * swy, denom, out=np.full(n_keys, np.nan), where=ok)
+    rates[ok] = -slope[ok]
+    return rates
+
+
+def _fit(window_days, half_life, now):
+    """汇总最近 window_days 天的读数并拟合每个 (source, room) 的耗电速度，返回 (index, rates)"""
+    conn = get_db()
+    try:
+        rows = _load_rollups(conn, window_days)
+    finally:
+        conn.close()
+
+    index = {}
+    keys = np.empty(len(rows), dtype=np.int64)
+    t_hours = np.empty(len(rows), dtype=np.float64)
+    kwh = np.empty(len(rows), dtype=np.float64)
+    for i, r in enumerate(rows):
+        keys[i] = index.setdefault((r["source"], r["room"]), len(index))
+        t_hours[i] = r["t_hours"]
+        kwh[i] = r["kwh"]
+
+    now_hours = (now - datetime(1970, 1, 1)).total_seconds() / 3600.0
+    return index, fit_rates(keys, t_hours, kwh, now_hours, half_life_hours=half_life)
+
+
+def update(current_rooms, cfg, refit=None):
+    """根据最新读数刷新全部房间的预测缓存。
+
+    current_rooms: merge_room_data 的结果（Reading 列表，含 room/kwh/sources）
+    refit: None 时按 forecast_min_interval_seconds 决定是否重新汇总拟合；True/False 强制
+    """
+    global _updated_at, _rates
+
+    window_days = cfg.get_int("system", "forecast_window_days", 7)
+    half_life = cfg.get_float("system", "forecast_half_life_hours", 48.0)
+    thresh = cfg.get_float("system", "low_power_threshold", 15.0)
+    min_interval = cfg.get_int("system", "forecast_min_interval_seconds", DEFAULT_MIN_INTERVAL_SECONDS)
+
+    now = datetime.now()
+    cached = _rates
+    if refit is None:
+        refit = (cached is None or cached[3:] != (window_days, half_life)
+                 or time.monotonic() - cached[2] >= min_interval)
+    if refit or cached is None:
+        index, rates = _fit(window_days, half_life, now)
+        _rates = (index, rates, time.monotonic(), window_days, half_life)
+    else:
+        index, rates = cached[0], cached[1]
+
+    forecasts = {}
+    for r in current_rooms or []:
+        room, current = r.room, r.kwh
+        if not room or current is None:
+            continue
+        rate = np.nan
+        for s in r.sources:
+            idx = index.get((s, room))
+            if idx is not None and not np.isnan(rates[idx]):
+                rate = rates[idx]
+                break
+        entry = {"rate_kwh_per_day": None, "days_until_empty": None, "threshold_date": None,
+                 "days_until_threshold": None}
+        per_day = float(rate) * 24.0 if not np.isnan(rate) else None
+        if per_day is not None and per_day >= MIN_RATE_PER_DAY:
+            entry["rate_kwh_per_day"] = round(per_day, 2)
+            entry["days_until_empty"] = round(max(0.0, current) / per_day, 1)
+            days_to_thresh = max(0.0, (current - thresh) / per_day)
+            entry["days_until_threshold"] = round(days_to_thresh, 1)
+            entry["threshold_date"] = (now + timedelta(days=days_to_thresh)).strftime("%Y-%m-%d %H:%M")
+        forecasts[room] = entry
+
+    with _lock:
+        _forecasts.clear()
+        _forecasts.update(forecasts)
+        _updated_at = now.strftime("%Y-%m-%d %H:%M:%S")
+    return forecasts
+
+
+def get_forecast(room):
+    with _lock:
+        return _forecasts.get(room)
+
+
+def snapshot():
+    """供 /api/status 使用的缓存副本"""
+    with _lock:
+        return {"updated_at": _updated_at, "rooms": dict(_forecasts)}
+
+
+def safe_update(current_rooms, cfg):
+    """monitor_task 调用入口：预测失败不影响监控主流程"""
+    started = time.time()
+    try:
+        fitted = _rates
+        result = update(current_rooms, cfg)
+        if _rates is not fitted:
+            logger.info(f"📈 耗尽预测已更新: {len(result)} 个房间, 用时 {time.time() - started:.3f}s")
+        return result
+    except Exception as e:
+        logger.error(f"[预测] 更新失败: {e}")
+        return {}
@@ -0,0 +1,388 @@
+"""
+历史读数批量导入 - 从旧表格/备份恢复大量读数到 power_log
+
+- 输入：CSV（表头行）或 NDJSON（每行一个 JSON 对象），可 gzip 压缩，格式与 /api/admin/export 导出一致，
+  按流读取、逐行校验，不把整个文件读入内存。
+    列：source, room, date, time, remain_power
+    兼容：timestamp（"YYYY-MM-DD HH:MM[:SS]"）代替 date + time；kwh 代替 remain_power；
+          没有 source 列时使用调用方指定的默认 source。
+- 每批（[system] import_batch_rows，默认 50000 行）一个事务：executemany 写入临时表
+  （主键去掉文件内重复，先出现的行优先），再按 (source, room, date, time) 删掉与已有数据
+  （主库与对应月份分区中 power_log、区间表的起止点）重复的行，最后按月份各一条 INSERT ... SELECT
+  写入该月的分区（见 power_partitions；一批涉及的月份超过可附加上限时分组处理）。
+  每批单独提交，不会长时间阻塞监控写入。
+- 导入结束后只重算受影响的日期范围与 source 的 power_daily（不含今天，也不含已归档/超出保留期的日期）。
+- dry_run：完整执行校验与去重，但不写入 power_log、不重算统计。
+
+用法：
+    python power_import.py 文件|- [--format csv|ndjson] [--source 默认source] [--dry-run]
+或管理员接口 POST /api/admin/import。
+"""
+import csv
+import gzip
+import io
+import json
+import math
+import operator
+import re
+import sys
+import time
+from datetime import datetime, timedelta
+
+from config import logger
+from power_db import get_db
+from power_tasks import rebuild_daily
+import power_partitions
+
+DEFAULT_BATCH_ROWS = 50000
+MAX_ERROR_SAMPLES = 20
+
+_SOURCE_RE = re.compile(r"^[A-Za-z0-9_-]+$")
+_DATE_RE = re.compile(r"^\d{4}-(0[1-9]|1[0-2])-(0[1-9]|[12]\d|3[01])$")
+_TIME_RE = re.compile(r"^([01]?\d|2[0-3]):([0-5]\d)(?::([0-5]\d))?$")
+
+# 表头别名 -> 标准列名
+_ALIASES = {"kwh": "remain_power", "datetime": "timestamp"}
+
+# import_stage：每批的暂存表；import_seen：dry-run 时代替 power_log 接收"将会写入"的行
+_STAGE_DDL = '''
+    CREATE TEMP TABLE IF NOT EXISTS {name} (
+        source TEXT NOT NULL,
+        room TEXT NOT NULL,
+        date TEXT NOT NULL,
+        time TEXT NOT NULL,
+        remain_power REAL NOT NULL,
+        PRIMARY KEY (source, room, date, time)
+    ) WITHOUT ROWID
+'''
+
+# 与已有数据重复：power_log 同一时刻、区间起点或（samples > 1 时）区间终点；
+# 主库（未分区部分）与本批涉及的月份分区都要查，dry-run 时还要对比之前批次
+_DUPLICATE_IN = '''
+       EXISTS (SELECT 1 FROM {db}.power_log p
+               WHERE p.source = s.source AND p.room = s.room AND p.date = s.date AND p.time = s.time)
+    OR EXISTS (SELECT 1 FROM {db}.power_log_interval i
+               WHERE i.source = s.source AND i.room = s.room AND i.start_date = s.date
+                 AND (i.start_time = s.time OR (i.samples > 1 AND i.end_time = s.time)))'''
+_DELETE_DUPLICATES = '''
+    DELETE FROM temp.import_stage AS s
+    WHERE {checks}
+       OR EXISTS (SELECT 1 FROM temp.import_seen t
+                  WHERE t.source = s.source AND t.room = s.room AND t.date = s.date AND t.time = s.time)
+'''
+
+
+class ImportFormatError(ValueError):
+    """文件整体格式错误（缺少必需列、无法识别的格式等），导入不会开始"""
+
+
+class _RawStream(io.RawIOBase):
+    """把只有 read(n) 的流（如 Flask request.stream）包装成 RawIOBase，以便加缓冲与 peek"""
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self._stream.read(len(b))
+        n = len(data)
+        b[:n] = data
+        return n
+
+
+def open_text(stream, fmt=None):
+    """二进制流 -> (文本流, 格式)；自动识别 gzip，未指定格式时按首字符判断（"{" 为 NDJSON）"""
+    buf = stream if isinstance(stream, io.BufferedReader) else io.BufferedReader(_RawStream(stream), 1 << 16)
+    if buf.peek(2)[:2] == b"\x1f\x8b":
+        buf = gzip.GzipFile(fileobj=buf)
+    if fmt is None:
+        head = buf.peek(256).lstrip(b"\xef\xbb\xbf \t\r\n")
+        fmt = "ndjson" if head[:1] == b"{" else "csv"
+    if fmt not in ("csv", "ndjson"):
+        raise ImportFormatError("format 必须是 csv / ndjson")
+    return io.TextIOWrapper(buf, encoding="utf-8-sig", newline=""), fmt
+
+
+def _normalize_time(value):
+    if len(value) == 8 and value[2] == ":" and value[5] == ":" and _TIME_RE.match(value):
+        return value
+    m = _TIME_RE.match(value)
+    if not m:
+        raise ValueError(f"时间格式错误: {value!r}")
+    return f"{int(m.group(1)):02d}:{m.group(2)}:{m.group(3) or '00'}"
+
+
+class _RowValidator:
+    """把一行原始字段校验/规范化为 (source, room, date, time, remain_power)，不合法时抛 ValueError"""
+
+    def __init__(self, default_source=None):
+        if default_source is not None and not _SOURCE_RE.match(default_source):
+            raise ImportFormatError(f"source 名称不合法: {default_source}（仅允许 A-Za-z0-9_-）")
+        self.default_source = default_source
+        # 已校验过的 source / 日期 / 时间（取值重复度很高，缓存后大部分行不用再跑正则）
+        self._sources = set()
+        self._dates = set()
+        self._times = {}
+
+    def __call__(self, source, room, date, time_, timestamp, kwh):
+        source = (source or "").strip() or self.default_source
+        if not source:
+            raise ValueError("缺少 source")
+        if source not in self._sources:
+            if not _SOURCE_RE.match(source):
+                raise ValueError(f"source 名称不合法: {source!r}")
+            self._sources.add(source)
+        room = (room or "").strip()
+        if not room:
+            raise ValueError("缺少 room")
+        if timestamp is not None:
+            timestamp = timestamp.strip()
+            date, time_ = timestamp[:10], timestamp[11:]
+        date = (date or "").strip()
+        if date not in self._dates:
+            if not _DATE_RE.match(date):
+                raise ValueError(f"日期格式错误: {date!r}")
+            self._dates.add(date)
+        norm = self._times.get(time_)
+        if norm is None:
+            norm = self._times[time_] = _normalize_time((time_ or "").strip())
+        try:
+            value = float(kwh)
+        except (TypeError, ValueError):
+            raise ValueError(f"读数不是数字: {kwh!r}") from None
+        if not math.isfinite(value):
+            raise ValueError(f"读数不是有限数: {kwh!r}")
+        return source, room, date, norm, value
+
+
+def _columns(names, has_default_source):
+    """表头 -> 各字段下标（不存在为 None）；缺少必需列时抛 ImportFormatError"""
+    index = {}
+    for i, name in enumerate(names):
+        key = str(name or "").strip().lower()
+        index.setdefault(_ALIASES.get(key, key), i)
+    missing = [c for c in ("room", "remain_power") if c not in index]
+    if "timestamp" not in index and not ("date" in index and "time" in index):
+        missing.append("date+time 或 timestamp")
+    if "source" not in index and not has_default_source:
+        missing.append("source（或指定默认 source）")
+    if missing:
+        raise ImportFormatError(f"缺少列: {', '.join(missing)}")
+    return [index.get(c) for c in ("source", "room", "date", "time", "timestamp", "remain_power")]
+
+
+def _iter_csv(text, validate, errors):
+    """yield 规范化后的行；不合法的行（带行号）记入 errors 后跳过"""
+    reader = csv.reader(text)
+    try:
+        header = next(reader)
+    except StopIteration:
+        return
+    cols = _columns(header, validate.default_source is not None)
+    width = max(i for i in cols if i is not None) + 1
+    # 缺少的列指向行尾补上的 None
+    pick = operator.itemgetter(*[i if i is not None else -1 for i in cols])
+    for row in reader:
+        if not row:
+            continue
+        if len(row) < width:
+            row.extend([None] * (width - len(row)))
+        row.append(None)
+        try:
+            yield validate(*pick(row))
+        except ValueError as e:
+            errors.append((reader.line_num, str(e)))
+
+
+def _iter_ndjson(text, validate, errors):
+    keys = None
+    for line_no, line in enumerate(text, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            obj = json.loads(line)
+            if not isinstance(obj, dict):
+                raise ValueError("不是 JSON 对象")
+        except ValueError as e:
+            errors.append((line_no, f"JSON 解析失败: {e}"))
+            continue
+        if keys is None:
+            # 以第一条记录的字段名确定列（与 CSV 表头相同的规则）
+            names = list(obj)
+            keys = [names[i] if i is not None else None
+                    for i in _columns(names, validate.default_source is not None)]
+        try:
+            values = [obj.get(k) if k is not None else None for k in keys]
+            yield validate(*[str(v) if v is not None else None for v in values])
+        except ValueError as e:
+            errors.append((line_no, str(e)))
+
+
+class _ErrorLog:
+    """记录不合法行：只保留前若干条样例，其余只计数"""
+
+    def __init__(self, limit=MAX_ERROR_SAMPLES):
+        self.count = 0
+        self.samples = []
+        self.limit = limit
+
+    def append(self, item):
+        self.count += 1
+        if len(self.samples) < self.limit:
+            self.samples.append({"line": item[0], "error": item[1]})
+
+
+def _merge_affected(affected, rows):
+    for source, lo, hi in rows:
+        cur = affected.get(source)
+        affected[source] = (min(cur[0], lo), max(cur[1], hi)) if cur else (lo, hi)
+
+
+def _flush(conn, batch, stats, affected, dry_run):
+    """一批：按月份分组（每组的分区数不超过单个连接可附加的上限）后逐组写入"""
+    by_month = {}
+    for row in batch:
+        by_month.setdefault(row[2][:7], []).append(row)
+    months = sorted(by_month)
+    step = power_partitions.max_attached(conn)
+    for i in range(0, len(months), step):
+        group = months[i:i + step]
+        _flush_months(conn, group, [r for m in group for r in by_month[m]], stats, affected, dry_run)
+
+
+def _flush_months(conn, months, rows, stats, affected, dry_run):
+    """暂存（文件内去重）-> 删掉与已有数据重复的行 -> 写入各月份分区 -> 提交"""
+    # dry-run 不创建分区文件，只对比已有的分区
+    attached = power_partitions.attach_months(conn, months, create=not dry_run)
+    checks = "\n    OR".join(_DUPLICATE_IN.format(db=db) for db in ["main"] + [power_partitions.alias(m) for m in attached])
+    try:
+        staged = conn.executemany("INSERT OR IGNORE INTO temp.import_stage VALUES (?, ?, ?, ?, ?)", rows).rowcount
+        dropped = conn.execute(_DELETE_DUPLICATES.format(checks=checks)).rowcount
+        _merge_affected(affected, conn.execute(
+            "SELECT source, MIN(date), MAX(date) FROM temp.import_stage GROUP BY source"))
+        inserted = 0
+        for m in months:
+            target = "temp.import_seen" if dry_run else f"{power_partitions.alias(m)}.power_log"
+            start, end = power_partitions.month_range(m)
+            inserted += conn.execute(f'''
+                INSERT INTO {target} (source, room, date, time, remain_power)
+                SELECT source, room, date, time, remain_power FROM temp.import_stage WHERE date BETWEEN ? AND ?
+            ''', (start, end)).rowcount
+        conn.execute("DELETE FROM temp.import_stage")
+        conn.commit()
+    except Exception:
+        # 暂存表也在同一事务中，回滚后一并清空
+        conn.rollback()
+        raise
+    stats["inserted"] += inserted
+    stats["duplicates"] += len(rows) - staged + dropped
+
+
+def _daily_range(affected, archive_after_days, today=None):
+    """受影响日期中可以重算 power_daily 的部分：不含今天，不早于保留期/归档边界"""
+    if not affected:
+        return None
+    today = today or datetime.now().date()
+    floor = (today - timedelta(days=min(180, archive_after_days))).strftime("%Y-%m-%d")
+    yesterday = (today - timedelta(days=1)).strftime("%Y-%m-%d")
+    lo = max(min(v[0] for v in affected.values()), floor)
+    hi = min(max(v[1] for v in affected.values()), yesterday)
+    return (lo, hi) if lo <= hi else None
+
+
+def import_readings(stream, fmt=None, default_source=None, dry_run=False,
+                    batch_rows=DEFAULT_BATCH_ROWS, archive_after_days=180):
+    """导入读数流，返回统计结果 dict。
+
+    文件格式错误（缺列等）抛 ImportFormatError；逐行错误只计数并给出前若干条样例。
+    中途失败时已提交的批次保留，返回结果中带 error 字段。
+    """
+    text, fmt = open_text(stream, fmt)
+    validate = _RowValidator(default_source)
+    errors = _ErrorLog()
+    rows = (_iter_csv if fmt == "csv" else _iter_ndjson)(text, validate, errors)
+    batch_rows = max(1000, int(batch_rows))
+
+    stats = {"format": fmt, "dry_run": bool(dry_run), "valid": 0, "inserted": 0, "duplicates": 0}
+    affected = {}
+    t0 = time.perf_counter()
+    conn = get_db()
+    conn.row_factory = None
+    try:
+        conn.execute(_STAGE_DDL.format(name="import_stage"))
+        conn.execute(_STAGE_DDL.format(name="import_seen"))
+        conn.execute("DELETE FROM temp.import_seen")
+        conn.commit()  # 之后每批要 ATTACH 月份分区，不能处在事务中
+        batch = []
+        try:
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= batch_rows:
+                    stats["valid"] += len(batch)
+                    _flush(conn, batch, stats, affected, dry_run)
+                    batch = []
+            if batch:
+                stats["valid"] += len(batch)
+                _flush(conn, batch, stats, affected, dry_run)
+        except ImportFormatError:
+            raise
+        except Exception as e:
+            logger.error(f"[导入] 中途失败，已提交 {stats['inserted']} 行: {e}")
+            stats["error"] = str(e)
+
+        conn.execute("DROP TABLE temp.import_seen")
+        stats["daily_rebuilt"] = 0
+        daily = _daily_range(affected, archive_after_days)
+        stats["daily_range"] = list(daily) if daily else None
+        if daily and not dry_run and stats["inserted"]:
+            stats["daily_rebuilt"] = 0
+            for lo, hi in power_partitions.split_range(daily[0], daily[1], power_partitions.max_attached(conn)):
+                power_partitions.attach(conn, lo, hi)
+                stats["daily_rebuilt"] += rebuild_daily(conn, lo, hi, sources=list(affected))
+                conn.commit()
+    finally:
+        conn.close()
+
+    elapsed = time.perf_counter() - t0
+    stats.update({
+        "invalid": errors.count,
+        "errors": errors.samples,
+        "sources": len(affected),
+        "date_range": [min(v[0] for v in affected.values()), max(v[1] for v in affected.values())] if affected else None,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round((stats["valid"] + errors.count) / elapsed) if elapsed > 0 else None,
+    })
+    logger.info("[导入] %s%s：有效 %d 行，写入 %d，重复 %d，无效 %d，用时 %.1fs",
+                fmt, "（dry-run）" if dry_run else "", stats["valid"], stats["inserted"],
+                stats["duplicates"], errors.count, elapsed)
+    return stats
+
+
+if __name__ == '__main__':
+    import argparse
+    from config import Config
+
+    ap = argparse.ArgumentParser(description="批量导入历史读数（CSV / NDJSON，可 gzip）")
+    ap.add_argument("file", help="文件路径，- 表示标准输入")
+    ap.add_argument("--format", choices=("csv", "ndjson"))
+    ap.add_argument("--source", help="文件中没有 source 列时使用的 source")
+    ap.add_argument("--dry-run", action="store_true", help="只校验与去重，不写入")
+    args = ap.parse_args()
+
+    cfg = Config()
+    src = sys.stdin.buffer if args.file == "-" else open(args.file, "rb")
+    try:
+        result = import_readings(src, fmt=args.format, default_source=args.source, dry_run=args.dry_run,
+                                 batch_rows=cfg.get_int("system", "import_batch_rows", DEFAULT_BATCH_ROWS),
+                                 archive_after_days=cfg.get_int("system", "archive_after_days", 180))
+    except ImportFormatError as e:
+        print(e, file=sys.stderr)
+        sys.exit(2)
+    finally:
+        if src is not sys.stdin.buffer:
+            src.close()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    sys.exit(1 if result.get("error") else 0)
@@ -0,0 +1,116 @@
+"""
+读数入库模块 - 负责把每轮抓取到的房间读数写入 SQLite
+
+两种模式（config.ini [system] power_log_mode）：
+- change（默认）：按 (source, room) 在内存中记住当前区间；读数不变时只延长区间的
+  结束时间，读数变化（或跨天）才新开一个区间，写入 power_log_interval。
+- every：兼容旧行为，每轮每个房间都插入一行 power_log。
+
+两种模式都写入当天所在月份的分区文件（见 power_partitions）；区间不跨天，区间 id 只在
+同一天内被引用，换月后自然落到新分区。读取统一走 power_log_view，两种模式写入的数据都能查到。
+"""
+import threading
+from datetime import datetime
+from config import logger
+import power_partitions
+
+# (source, room) -> [interval_id, remain_power, start_date]（id 属于 start_date 所在月份的分区）
+_current_intervals = {}
+_loaded = False
+_lock = threading.Lock()
+
+
+def _load_current_intervals(conn):
+    """启动后首次写入时，从当月分区恢复每个 (source, room) 最近的区间（更早的区间不会再被延长）"""
+    global _loaded
+    rows = conn.execute('''
+        SELECT i.id, i.source, i.room, i.remain_power, i.start_date
+        FROM power_log_interval i
+        JOIN (SELECT MAX(id) AS id FROM power_log_interval GROUP BY source, room) m ON m.id = i.id
+    ''').fetchall()
+    for r in rows:
+        _current_intervals[(r['source'], r['room'])] = [r['id'], r['remain_power'], r['start_date']]
+    _loaded = True
+
+
+def _parse_readings(data):
+    """提取 (room, remain_power)；无房间或读数无法解析的跳过"""
+    readings = []
+    for r in data:
+        if r.room and r.kwh is not None:
+            readings.append((r.room, r.kwh))
+    return readings
+
+
+def write_readings(source, data, mode="change", now=None):
+    """写入一个 source 本轮抓到的房间读数。
+
+    返回 (inserted, extended)：新写入的行数 / 仅延长区间的行数。
+    """
+    now = now or datetime.now()
+    date_str = now.strftime("%Y-%m-%d")
+    time_str = now.strftime("%H:%M:%S")
+    readings = _parse_readings(data)
+    if not readings:
+        return 0, 0
+
+    conn = power_partitions.connect(power_partitions.month_of(date_str))
+    try:
+        if mode == "every":
+            conn.executemany(
+                "INSERT INTO power_log (source, room, date, time, remain_power) VALUES (?, ?, ?, ?, ?)",
+                [(source, room, date_str, time_str, p) for room, p in readings]
+            )
+            conn.commit()
+            return len(readings), 0
+
+        with _lock:
+            if not _loaded:
+                _load_current_intervals(conn)
+
+            extend = []
+            inserted = 0
+            for room, p in readings:
+                key = (source, room)
+                cur = _current_intervals.get(key)
+                if cur and cur[1] == p and cur[2] == date_str:
+                    extend.append((date_str, time_str, cur[0]))
+                    continue
+                cursor = conn.execute('''
+                    INSERT INTO power_log_interval
+                        (source, room, start_date, start_time, end_date, end_time, remain_power, samples)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, 1)
+                ''', (source, room, date_str, time_str, date_str, time_str, p))
+                _current_intervals[key] = [cursor.lastrowid, p, date_str]
+                inserted += 1
+
+            if extend:
+                conn.executemany(
+                    "UPDATE power_log_interval SET end_date=?, end_time=?, samples=samples+1 WHERE id=?",
+                    extend
+                )
+            conn.commit()
+            return inserted, len(extend)
+    except Exception:
+        conn.rollback()
+        # 内存状态可能与库不一致，下次写入时重新从库加载
+        reset_cache()
+        raise
+    finally:
+        conn.close()
+
+
+def reset_cache():
+    """清空内存中的当前区间（例如数据被清理/导入后）"""
+    global _loaded
+    with _lock:
+        _current_intervals.clear()
+        _loaded = False
+
+
+def log_mode(cfg):
+    mode = cfg.get("system", "power_log_mode", "change").lower()
+    if mode not in ("change", "every"):
+        logger.warning(f"[power_log] 未知的 power_log_mode={mode}，使用 change")
+        mode = "change"
+    return mode
@@ -0,0 +1,275 @@
+"""
+数据库维护 - 在线备份、统计信息、WAL 检查点与增量回收空间（每天一次，见 power_tasks.start_schedules）
+
+- 主库与月份分区都以 WAL 模式打开（power_db.init_db / power_partitions.ensure），读不阻塞写。
+- 备份：sqlite3 在线备份 API 一步拷完（单个读事务，得到一致的快照；WAL 下不阻塞监控线程写入），
+  写到 <backup_dir>/YYYYmmdd-HHMMSS/（power.db + partitions/ + archive/），完成后整体改名，保留最近 backup_keep 份。
+  归档（power_archive）删除分区后是历史数据的唯一副本，按文件一并备份。
+  上一份备份之后没有变化的月份分区与归档文件直接硬链接上一份的文件，不再重复拷贝。
+- 统计信息：ANALYZE（analysis_limit 限制每个索引的采样行数，大表也很快）。
+  新连接上的 PRAGMA optimize 没有可参考的查询记录，基本什么都不做，所以这里直接 ANALYZE。
+- 回收空间：auto_vacuum=INCREMENTAL 的库每次 incremental_vacuum 一小批页（各自一个短事务），
+  总用时不超过 vacuum_max_seconds，剩下的下次再回收。旧库需先执行一次
+  `python power_maintenance.py convert`（完整 VACUUM，会锁库，建议停机时执行）。
+- 检查点：wal_checkpoint(TRUNCATE) 把 WAL 写回主文件并截断；有长读事务时返回 busy，下次再做。
+- 每一步的耗时与回收的字节数见 /api/status 的 db_maintenance 字段。
+"""
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import closing
+from datetime import datetime
+
+import metrics
+import power_archive
+import power_db
+import power_partitions
+from config import Config, logger
+
+ANALYSIS_LIMIT = 1000
+CHECKPOINT_TIMEOUT = 2.0    # 等待写锁的秒数，超时本次检查点返回 busy
+
+MAINTENANCE_SECONDS = metrics.Histogram("dorm_db_maintenance_seconds", "数据库维护各步骤耗时", ("step",))
+RECLAIMED_BYTES = metrics.Counter("dorm_db_reclaimed_bytes_total", "incremental_vacuum 回收的字节数")
+
+_lock = threading.Lock()        # 同一时间只跑一次维护
+_lock_snapshot = threading.Lock()
+_last = {}
+
+
+def backup_dir(cfg=None):
+    path = cfg.get("system", "backup_dir", "") if cfg is not None else ""
+    return path or os.path.join(os.path.dirname(os.path.abspath(power_db.DB_PATH)), "backups")
+
+
+def _targets():
+    """[(名称, 路径)]：主库 + 各月份分区"""
+    return [("main", power_db.DB_PATH)] + [(m, power_partitions.path_for(m)) for m in power_partitions.months()]
+
+
+def _mtime(path):
+    # WAL 模式下写入先落在 -wal 文件，主文件要到检查点才变
+    return max((os.path.getmtime(p) for p in (path, path + "-wal") if os.path.exists(p)), default=0)
+
+
+def _file_bytes(path):
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+
+
+def _copy_db(src, dst):
+    """在线备份一个库文件（一步拷完，期间持有一个读事务）"""
+    with closing(sqlite3.connect(src)) as s, closing(sqlite3.connect(dst)) as d:
+        s.backup(d)
+
+
+def _reuse(old, target):
+    """硬链接上一份备份中的同一文件（不支持硬链接时复制）"""
+    try:
+        os.link(old, target)
+    except OSError:
+        shutil.copyfile(old, target)
+
+
+def list_backups(base):
+    """已完成的备份（目录名升序）"""
+    if not os.path.isdir(base):
+        return []
+    return sorted(d for d in os.listdir(base)
+                  if not d.endswith(".tmp") and os.path.exists(os.path.join(base, d, "power.db")))
+
+
+def backup(cfg=None, keep=None):
+    """备份主库、全部月份分区与归档目录，返回 {path, bytes, copied, linked, seconds}"""
+    t0 = time.perf_counter()
+    cfg = cfg or Config()
+    keep = cfg.get_int("system", "backup_keep", 7) if keep is None else keep
+    base = backup_dir(cfg)
+    previous = list_backups(base)
+    prev = os.path.join(base, previous[-1]) if previous else None
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    dest = os.path.join(base, stamp)
+    n = 1
+    while os.path.exists(dest):     # 同一秒内手动再跑一次
+        dest = os.path.join(base, f"{stamp}-{n}")
+        n += 1
+    tmp = dest + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(os.path.join(tmp, "partitions"))
+
+    copied = linked = 0
+    _copy_db(power_db.DB_PATH, os.path.join(tmp, "power.db"))
+    copied += 1
+    for m in power_partitions.months():
+        src = power_partitions.path_for(m)
+        name = os.path.basename(src)
+        target = os.path.join(tmp, "partitions", name)
+        old = os.path.join(prev, "partitions", name) if prev else None
+        if old and os.path.exists(old) and _mtime(src) < os.path.getmtime(old):
+            _reuse(old, target)
+            linked += 1
+        else:
+            _copy_db(src, target)
+            copied += 1
+    # 归档：只备份已完成（含 rooms.json）的月份；归档重写时整体替换目录，文件 mtime 会变
+    archive = power_archive.archive_dir(cfg)
+    for month in power_archive.list_months(archive):
+        os.makedirs(os.path.join(tmp, "archive", month))
+        for name in sorted(os.listdir(os.path.join(archive, month))):
+            src = os.path.join(archive, month, name)
+            target = os.path.join(tmp, "archive", month, name)
+            old = os.path.join(prev, "archive", month, name) if prev else None
+            if old and os.path.exists(old) and os.path.getmtime(src) < os.path.getmtime(old):
+                _reuse(old, target)
+                linked += 1
+            else:
+                # copyfile 不保留 mtime：下一次据此判断源文件之后是否变化
+                shutil.copyfile(src, target)
+                copied += 1
+    os.replace(tmp, dest)
+
+    for name in list_backups(base)[:-keep] if keep > 0 else []:
+        shutil.rmtree(os.path.join(base, name), ignore_errors=True)
+
+    size = sum(os.path.getsize(os.path.join(root, f)) for root, _d, files in os.walk(dest) for f in files)
+    return {"path": dest, "bytes": size, "copied": copied, "linked": linked,
+            "seconds": round(time.perf_counter() - t0, 3)}
+
+
+def analyze(conn):
+    conn.execute(f"PRAGMA analysis_limit={ANALYSIS_LIMIT}")
+    conn.execute("ANALYZE")
+    conn.commit()
+
+
+def incremental_vacuum(conn, step_pages, deadline):
+    """分批 incremental_vacuum 直到空闲页回收完或超过 deadline，返回 (回收字节, 剩余空闲页)；
+    未启用 INCREMENTAL 时返回 (None, 空闲页数)"""
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return None, free
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    start = free
+    while free and time.monotonic() < deadline:
+        # 每批是一个独立的短写事务，批次之间监控线程可以写入
+        conn.execute(f"PRAGMA incremental_vacuum({step_pages})").fetchall()
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return (start - free) * page_size, free
+
+
+def checkpoint(conn):
+    """返回 (busy, WAL 页数, 已写回页数)；非 WAL 模式为 (0, -1, -1)"""
+    return tuple(conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone())
+
+
+def run_maintenance(cfg=None):
+    """备份 -> ANALYZE -> 增量回收 -> 检查点，结果记入 snapshot()；已有维护在跑时直接返回 None"""
+    if not _lock.acquire(blocking=False):
+        logger.warning("[维护] 上一次维护尚未结束，跳过")
+        return None
+    try:
+        cfg = cfg or Config()
+        t0 = time.perf_counter()
+        result = {"started_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "error": None}
+        step_pages = max(1, cfg.get_int("system", "vacuum_step_pages", 256))
+        deadline = time.monotonic() + max(0.0, cfg.get_float("system", "vacuum_max_seconds", 5.0))
+
+        if cfg.get_int("system", "backup_keep", 7) > 0:
+            try:
+                with MAINTENANCE_SECONDS.labels("backup").time():
+                    result["backup"] = backup(cfg)
+                logger.info(f"[维护] 备份完成: {result['backup']['path']} "
+                            f"({result['backup']['bytes'] / 1024 / 1024:.1f}MB, {result['backup']['seconds']}s)")
+            except Exception as e:
+                result["error"] = f"备份失败: {e}"
+                logger.error(f"[维护] 备份失败: {e}")
+
+        timings = {"analyze": 0.0, "vacuum": 0.0, "checkpoint": 0.0}
+        reclaimed, free_left, busy, unconverted = 0, 0, [], []
+        before = sum(_file_bytes(p) for _n, p in _targets())
+        for name, path in _targets():
+            try:
+                with closing(sqlite3.connect(path, timeout=CHECKPOINT_TIMEOUT)) as conn:
+                    t = time.perf_counter()
+                    analyze(conn)
+                    timings["analyze"] += time.perf_counter() - t
+                    t = time.perf_counter()
+                    freed, free = incremental_vacuum(conn, step_pages, deadline)
+                    timings["vacuum"] += time.perf_counter() - t
+                    if freed is None:
+                        if free:
+                            unconverted.append(name)
+                    else:
+                        reclaimed += freed
+                    free_left += free
+                    t = time.perf_counter()
+                    if checkpoint(conn)[0]:
+                        busy.append(name)
+                    timings["checkpoint"] += time.perf_counter() - t
+            except sqlite3.Error as e:
+                result["error"] = f"{name}: {e}"
+                logger.error(f"[维护] {name} 维护失败: {e}")
+        for step, secs in timings.items():
+            MAINTENANCE_SECONDS.labels(step).observe(secs)
+        RECLAIMED_BYTES.inc(reclaimed)
+        if unconverted:
+            logger.warning(f"[维护] {', '.join(unconverted)} 未启用 incremental auto_vacuum，"
+                           f"空闲页无法回收，可停机执行 python app/power_maintenance.py convert")
+
+        result.update({
+            "seconds": round(time.perf_counter() - t0, 3),
+            "analyze_seconds": round(timings["analyze"], 3),
+            "vacuum_seconds": round(timings["vacuum"], 3),
+            "checkpoint_seconds": round(timings["checkpoint"], 3),
+            "reclaimed_bytes": reclaimed,
+            "free_pages_left": free_left,
+            "checkpoint_busy": busy,
+            "db_bytes_before": before,
+            "db_bytes": sum(_file_bytes(p) for _n, p in _targets()),
+        })
+        with _lock_snapshot:
+            _last.clear()
+            _last.update(result)
+        logger.info(f"[维护] 完成，用时 {result['seconds']}s，回收 {reclaimed / 1024 / 1024:.1f}MB，"
+                    f"数据库 {before / 1024 / 1024:.1f}MB -> {result['db_bytes'] / 1024 / 1024:.1f}MB")
+        return result
+    finally:
+        _lock.release()
+
+
+def snapshot():
+    """供 /api/status 展示的最近一次维护结果（尚未运行过为 None）"""
+    with _lock_snapshot:
+        return dict(_last) if _last else None
+
+
+def convert():
+    """把未启用 INCREMENTAL 的库转换过来（auto_vacuum 只能在 VACUUM 时改变；会锁库直到完成）"""
+    done = []
+    for name, path in _targets():
+        with closing(sqlite3.connect(path)) as conn:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                continue
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+            done.append(name)
+    return done
+
+
+# 用法：python power_maintenance.py [run|backup|convert]
+if __name__ == '__main__':
+    import json
+
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "run"
+    power_db.init_db()
+    if cmd == "run":
+        print(json.dumps(run_maintenance(), ensure_ascii=False, indent=2))
+    elif cmd == "backup":
+        print(json.dumps(backup(), ensure_ascii=False, indent=2))
+    elif cmd == "convert":
+        print(json.dumps(convert(), ensure_ascii=False))
+    else:
+        print("用法: python power_maintenance.py [run|backup|convert]", file=sys.stderr)
+        sys.exit(2)
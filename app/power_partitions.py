@@ -0,0 +1,257 @@
+"""
+读数按月分区 - power_log / power_log_interval 按月份写入独立的 SQLite 文件，查询时按需 ATTACH
+
+- 文件：<power.db 所在目录>/partitions/power_log_2026-10.db，表与索引和主库中的两张读数表相同。
+  主库里升级前写入的读数留在原表（"未分区"部分，查询时总会带上），
+  可用 `python power_partitions.py migrate` 按月搬进分区。
+- 写入：power_ingest / power_import 直接写对应月份的分区文件（区间不跨天，也就不跨月）。
+- 读取：attach(conn, start, end) 只 ATTACH 日期范围涉及的月份，并在该连接上创建同名的
+  TEMP VIEW power_log_view（主库两张表 + 这些分区），原有按 power_log_view 写的查询不用改。
+  SQLite 单个连接最多附加 10 个库，范围更大时用 split_range() 分段查询。
+- 保留期：过期月份归档后直接删除分区文件（drop），不再对大表执行 DELETE。
+"""
+import os
+import re
+import sqlite3
+import sys
+import threading
+import calendar
+from datetime import date, timedelta
+from urllib.parse import quote
+
+import power_db
+
+_FILE_RE = re.compile(r"^power_log_(\d{4}-\d{2})\.db$")
+
+# auto_vacuum 只对新文件生效；WAL 与主库一致（见 power_db.init_db）
+_SCHEMA = '''
+PRAGMA auto_vacuum = INCREMENTAL;
+PRAGMA journal_mode = WAL;
+CREATE TABLE IF NOT EXISTS power_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source TEXT NOT NULL,
+    date TEXT NOT NULL,
+    time TEXT NOT NULL,
+    remain_power REAL NOT NULL,
+    room TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_power_log_key ON power_log (source, room, date, time);
+CREATE TABLE IF NOT EXISTS power_log_interval (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source TEXT NOT NULL,
+    room TEXT NOT NULL,
+    start_date TEXT NOT NULL,
+    start_time TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    end_time TEXT NOT NULL,
+    remain_power REAL NOT NULL,
+    samples INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS idx_power_log_interval_key ON power_log_interval (source, room, id);
+CREATE INDEX IF NOT EXISTS idx_power_log_interval_start ON power_log_interval (source, room, start_date, start_time);
+'''
+
+# 视图的三个分支（与 power_schema.sql 中的 power_log_view 一致），{db} 为库名
+_VIEW_BRANCHES = '''
+    SELECT source, room, date, time, remain_power FROM {db}.power_log
+    UNION ALL
+    SELECT source, room, start_date, start_time, remain_power FROM {db}.power_log_interval
+    UNION ALL
+    SELECT source, room, end_date, end_time, remain_power FROM {db}.power_log_interval
+    WHERE samples > 1'''
+
+_ready = set()          # 已建表的分区文件路径
+_ready_lock = threading.Lock()
+
+
+def partition_dir():
+    # 每次按当前 DB_PATH 计算（基准测试会把数据库指向临时目录）
+    return os.path.join(os.path.dirname(os.path.abspath(power_db.DB_PATH)), "partitions")
+
+
+def month_of(date_str):
+    """'2026-10-19' -> '2026-10'"""
+    return date_str[:7]
+
+
+def month_range(month):
+    """'2026-10' -> ('2026-10-01', '2026-10-31')"""
+    y, m = (int(x) for x in month.split("-"))
+    return f"{month}-01", f"{month}-{calendar.monthrange(y, m)[1]:02d}"
+
+
+def path_for(month):
+    return os.path.join(partition_dir(), f"power_log_{month}.db")
+
+
+def alias(month):
+    return "p_" + month.replace("-", "_")
+
+
+def months(start=None, end=None):
+    """已有分区的月份（升序）；给出 start/end 时只返回与该日期范围相交的月份"""
+    base = partition_dir()
+    if not os.path.isdir(base):
+        return []
+    found = sorted(m.group(1) for m in map(_FILE_RE.match, os.listdir(base)) if m)
+    lo = month_of(start) if start else None
+    hi = month_of(end) if end else None
+    return [m for m in found if (lo is None or m >= lo) and (hi is None or m <= hi)]
+
+
+def ensure(month):
+    """创建分区文件与表（已存在时什么都不做），返回路径"""
+    path = path_for(month)
+    if path in _ready and os.path.exists(path):
+        return path
+    with _ready_lock:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = sqlite3.connect(path)
+        try:
+            conn.executescript(_SCHEMA)
+            conn.commit()
+        finally:
+            conn.close()
+        _ready.add(path)
+    return path
+
+
+def connect(month):
+    """直接连接某个月份的分区（不存在则创建），用于写入"""
+    conn = sqlite3.connect(ensure(month))
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _attached(conn):
+    return {row[1]: row[2] for row in conn.execute("PRAGMA database_list") if row[1].startswith("p_")}
+
+
+def max_attached(conn):
+    return conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+
+
+def attach(conn, start=None, end=None, readonly=False):
+    """为连接附加 [start, end] 涉及的月份分区，并把 power_log_view 指向主库 + 这些分区。
+
+    需在事务之外调用（ATTACH / DETACH 不能在事务中执行）；重复调用会按新范围调整。
+    readonly=True 时以只读方式附加（连接需以 uri=True 打开）。返回附加的月份列表。
+    """
+    return attach_months(conn, months(start, end), readonly=readonly)
+
+
+def attach_months(conn, wanted, readonly=False, create=False):
+    """附加指定的月份分区（create=True 时不存在的先创建，否则跳过），规则同 attach()"""
+    if create:
+        for m in wanted:
+            ensure(m)
+    else:
+        wanted = [m for m in wanted if os.path.exists(path_for(m))]
+    limit = max_attached(conn)
+    if len(wanted) > limit:
+        raise ValueError(f"日期范围涉及 {len(wanted)} 个月份分区，超过单个连接可附加的上限 {limit}，请分段查询")
+    current = _attached(conn)
+    keep = {alias(m) for m in wanted}
+    conn.execute("DROP VIEW IF EXISTS temp.power_log_view")
+    for name in current:
+        if name not in keep:
+            conn.execute(f"DETACH DATABASE {name}")
+    for m in wanted:
+        if alias(m) not in current:
+            path = path_for(m)
+            target = f"file:{quote(path)}?mode=ro" if readonly else path
+            conn.execute(f"ATTACH DATABASE ? AS {alias(m)}", (target,))
+    branches = [_VIEW_BRANCHES.format(db="main")] + [_VIEW_BRANCHES.format(db=alias(m)) for m in wanted]
+    conn.execute("CREATE TEMP VIEW power_log_view AS" + "\n    UNION ALL".join(branches))
+    return wanted
+
+
+def split_range(start, end, max_months=None):
+    """把 [start, end] 切成若干段，每段涉及的分区数不超过 max_months（默认 SQLite 上限 10）"""
+    max_months = max_months or 10
+    touched = months(start, end)
+    if len(touched) <= max_months:
+        return [(start, end)]
+    ranges = []
+    lo = start
+    for i in range(max_months, len(touched), max_months):
+        # 下一段从第 i 个分区的月初开始
+        first_day = month_range(touched[i])[0]
+        ranges.append((lo, (date.fromisoformat(first_day) - timedelta(days=1)).isoformat()))
+        lo = first_day
+    ranges.append((lo, end))
+    return ranges
+
+
+def drop(month):
+    """删除某个月份的分区文件，返回释放的字节数（调用方确保没有连接仍附加着它）"""
+    path = path_for(month)
+    freed = 0
+    for p in (path, path + "-wal", path + "-shm", path + "-journal"):
+        if os.path.exists(p):
+            freed += os.path.getsize(p)
+            os.remove(p)
+    _ready.discard(path)
+    return freed
+
+
+def size_bytes():
+    """全部分区文件的大小之和"""
+    return sum(os.path.getsize(path_for(m)) for m in months())
+
+
+def migrate():
+    """把主库中未分区的读数按月搬进分区文件，返回 {month: 搬迁行数}"""
+    conn = power_db.get_db()
+    result = {}
+    try:
+        legacy = [r[0] for r in conn.execute('''
+            SELECT DISTINCT substr(date, 1, 7) FROM main.power_log
+            UNION SELECT DISTINCT substr(start_date, 1, 7) FROM main.power_log_interval
+            ORDER BY 1
+        ''')]
+        for m in legacy:
+            start, end = month_range(m)
+            ensure(m)
+            conn.execute(f"ATTACH DATABASE ? AS {alias(m)}", (path_for(m),))
+            try:
+                moved = conn.execute(f'''
+                    INSERT INTO {alias(m)}.power_log (source, room, date, time, remain_power)
+                    SELECT source, room, date, time, remain_power FROM main.power_log
+                    WHERE date BETWEEN ? AND ? ORDER BY id
+                ''', (start, end)).rowcount
+                moved += conn.execute(f'''
+                    INSERT INTO {alias(m)}.power_log_interval
+                        (source, room, start_date, start_time, end_date, end_time, remain_power, samples)
+                    SELECT source, room, start_date, start_time, end_date, end_time, remain_power, samples
+                    FROM main.power_log_interval WHERE start_date BETWEEN ? AND ? ORDER BY id
+                ''', (start, end)).rowcount
+                conn.execute("DELETE FROM main.power_log WHERE date BETWEEN ? AND ?", (start, end))
+                conn.execute("DELETE FROM main.power_log_interval WHERE start_date BETWEEN ? AND ?", (start, end))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.execute(f"DETACH DATABASE {alias(m)}")
+            result[m] = moved
+    finally:
+        conn.close()
+    return result
+
+
+# 用法：python power_partitions.py [list|migrate]
+if __name__ == '__main__':
+    import json
+
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "list"
+    if cmd == "migrate":
+        power_db.init_db()
+        print(json.dumps(migrate(), ensure_ascii=False, indent=2))
+    elif cmd == "list":
+        for m in months():
+            print(f"{m}  {os.path.getsize(path_for(m)) / 1024 / 1024:.1f}MB  {path_for(m)}")
+    else:
+        print("用法: python power_partitions.py [list|migrate]", file=sys.stderr)
+        sys.exit(2)
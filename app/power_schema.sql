@@ -6,8 +6,11 @@ CREATE TABLE IF NOT EXISTS power_log (
     source TEXT NOT NULL,
     date TEXT NOT NULL,         -- 格式: YYYY-MM-DD
     time TEXT NOT NULL,         -- 格式: HH:MM:SS
-    remain_power REAL NOT NULL
+    remain_power REAL NOT NULL,
+    room TEXT                   -- 绑定房间文字（旧数据为空）
 );
+-- 批量导入按 (source, room, date, time) 去重
+CREATE INDEX IF NOT EXISTS idx_power_log_key ON power_log (source, room, date, time);
 
 -- 2. 每日消耗统计表
 CREATE TABLE IF NOT EXISTS power_daily (
@@ -16,7 +19,72 @@ CREATE TABLE IF NOT EXISTS power_daily (
     date TEXT NOT NULL,         -- 格式: YYYY-MM-DD
     consume_power REAL NOT NULL
 );
+-- 按日期查缺口 / 先删后插重算时使用
+CREATE INDEX IF NOT EXISTS idx_power_daily_date ON power_daily (date, source);
 
--- 3. 半年数据清理建议
+-- 3. 读数区间表（变化才写入：读数不变时只延长 end_date/end_time）
+--    区间不跨天：每天第一次读数总会开启新区间，保证按天统计都有数据点
+CREATE TABLE IF NOT EXISTS power_log_interval (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source TEXT NOT NULL,
+    room TEXT NOT NULL,
+    start_date TEXT NOT NULL,   -- 格式: YYYY-MM-DD
+    start_time TEXT NOT NULL,   -- 格式: HH:MM:SS
+    end_date TEXT NOT NULL,
+    end_time TEXT NOT NULL,
+    remain_power REAL NOT NULL,
+    samples INTEGER NOT NULL DEFAULT 1  -- 区间内合并的抓取次数
+);
+CREATE INDEX IF NOT EXISTS idx_power_log_interval_key ON power_log_interval (source, room, id);
+CREATE INDEX IF NOT EXISTS idx_power_log_interval_date ON power_log_interval (start_date);
+CREATE INDEX IF NOT EXISTS idx_power_log_interval_start ON power_log_interval (source, room, start_date, start_time);
+
+-- 4. 统一读取视图：逐条日志 + 区间展开为起止两个数据点
+--    查询读数请使用 power_log_view，而不是直接查 power_log
+CREATE VIEW IF NOT EXISTS power_log_view AS
+    SELECT source, room, date, time, remain_power FROM power_log
+    UNION ALL
+    SELECT source, room, start_date, start_time, remain_power FROM power_log_interval
+    UNION ALL
+    SELECT source, room, end_date, end_time, remain_power FROM power_log_interval
+    WHERE samples > 1;
+
+-- 5. 告警冷却记录（进程重启后恢复，避免重复发送低电量/修复邮件）
+--    kind: repair（key=source）/ low_power（key=规范化房间 key，提前提醒为 forecast:<key>）
+CREATE TABLE IF NOT EXISTS alert_cooldown (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    last_sent REAL NOT NULL,    -- Unix 时间戳（秒）
+    PRIMARY KEY (kind, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_alert_cooldown_last_sent ON alert_cooldown (last_sent);
+
+-- 6. source 注册表（迁移后取代 config.ini 中的 [auth.*] / [auth.labels] / [notify.sources] / auth_sources）
+CREATE TABLE IF NOT EXISTS source_registry (
+    source TEXT PRIMARY KEY COLLATE NOCASE,
+    label TEXT,
+    cookie TEXT,
+    user_agent TEXT,
+    recipients TEXT,            -- 逗号分隔
+    polled INTEGER NOT NULL DEFAULT 0,  -- 是否在轮询列表中
+    position INTEGER,           -- 轮询列表中的顺序
+    updated_at TEXT
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_source_registry_polled ON source_registry (polled, position);
+
+-- 7. 房间收件人（迁移后取代 [notify.rooms]）
+CREATE TABLE IF NOT EXISTS room_recipients (
+    room TEXT PRIMARY KEY COLLATE NOCASE,
+    recipients TEXT NOT NULL
+) WITHOUT ROWID;
+
+-- 8. 注册表元信息（migrated_at 存在即表示已从 config.ini 迁移）
+CREATE TABLE IF NOT EXISTS registry_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+
+-- 9. 半年数据清理建议
 -- 可定期执行: DELETE FROM power_log WHERE date < date('now', '-180 days');
+--             DELETE FROM power_log_interval WHERE end_date < date('now', '-180 days');
 --             DELETE FROM power_daily WHERE date < date('now', '-180 days');
@@ -2,97 +2,347 @@
 # 依赖：pip install apscheduler
 from apscheduler.schedulers.background import BackgroundScheduler
 from datetime import datetime, timedelta
+import power_db
+import power_partitions
 from power_db import get_db
+from power_ingest import reset_cache as reset_ingest_cache
+from power_archive import archive_old_months
+from power_maintenance import run_maintenance
 from config import Config, logger
+import metrics
+import json
+import multiprocessing
+import sqlite3
+import sys
 import time
 import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 scheduler = BackgroundScheduler()
 
+DAILY_BACKFILL = metrics.Counter("dorm_daily_backfill_total", "补算/重算的 (source, 日期) 数（按触发方式）", ("mode",))
+
 # ========== 每日消耗统计 ==========
+def rebuild_daily(conn, start, end, sources=None):
+    """重新统计 [start, end] 每天每个 source/房间的消耗（当天 max - min），先删后插，可重复执行。
+
+    sources 为 None 时处理全部 source。调用前需 power_partitions.attach(conn, start, end)。
+    不提交事务，返回写入的行数。
+    """
+    where = "date BETWEEN ? AND ?"
+    params = [start, end]
+    if sources is not None:
+        # json_each 展开 source 列表，避免 source 很多时超出 SQL 变量个数上限
+        where += " AND source IN (SELECT value FROM json_each(?))"
+        params.append(json.dumps(sorted(sources)))
+    conn.execute(f"DELETE FROM power_daily WHERE {where}", params)
+    cur = conn.execute(f'''
+        INSERT INTO power_daily (source, date, consume_power)
+        SELECT source, date, MAX(remain_power) - MIN(remain_power)
+        FROM power_log_view
+        WHERE {where}
+        GROUP BY source, room, date
+    ''', params)
+    return cur.rowcount
+
+
 def calc_daily_power():
-    """统计前一天每个source的电量消耗，写入power_daily表"""
+    """统计前一天每个source的电量消耗，写入power_daily表，并补算回看窗口内漏掉的日期"""
     conn = get_db()
     try:
-        # 统计所有source、所有房间
+        # 统计所有source、所有房间；重复执行时覆盖而不是重复插入
         yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
-        sql = '''
-        SELECT source, room,
-            MAX(remain_power) as max_power,
-            MIN(remain_power) as min_power
-        FROM power_log
-        WHERE date = ?
-        GROUP BY source, room
-        '''
-        for row in conn.execute(sql, (yesterday,)):
-            source, room, max_power, min_power = row['source'], row['room'], row['max_power'], row['min_power']
-            if max_power is not None and min_power is not None:
-                consume = max_power - min_power
-                # 写入/更新power_daily
-                conn.execute('''
-                    INSERT INTO power_daily (source, date, consume_power)
-                    VALUES (?, ?, ?)
-                ''', (source, yesterday, consume))
+        power_partitions.attach(conn, yesterday, yesterday)
+        rebuild_daily(conn, yesterday, yesterday)
         conn.commit()
     except Exception as e:
         logger.error(f"[power_daily] 统计失败: {e}")
     finally:
         conn.close()
+    catch_up_daily()
+
+
+# ========== 每日统计补算 ==========
+# 进程在 0:10 前后停机时当天的统计不会执行（内存 job store 没有补跑），
+# 周报会把这一天算成 0。启动时与每次统计后按 (source, 日期) 找出"有读数但没有统计"的缺口补上。
+
+# 待补算的 (source, date) 放在临时表里，删除与重算都和它连接，一条语句处理全部缺口
+_TODO_DDL = "CREATE TEMP TABLE IF NOT EXISTS daily_todo (source TEXT NOT NULL, date TEXT NOT NULL, PRIMARY KEY (source, date))"
+_TODO_SELECT = '''
+    SELECT v.source, v.date, MAX(v.remain_power) - MIN(v.remain_power)
+    FROM power_log_view v
+    JOIN temp.daily_todo t ON t.source = v.source AND t.date = v.date
+    WHERE v.date BETWEEN ? AND ?
+    GROUP BY v.source, v.room, v.date
+'''
+
+
+def find_missing_days(conn, start, end):
+    """[start, end] 内有读数但 power_daily 没有任何统计的 (source, date)，按日期排序"""
+    return [tuple(r) for r in conn.execute('''
+        SELECT DISTINCT source, date FROM power_log_view WHERE date BETWEEN ? AND ?
+        EXCEPT
+        SELECT DISTINCT source, date FROM power_daily WHERE date BETWEEN ? AND ?
+        ORDER BY 2, 1
+    ''', (start, end, start, end))]
+
+
+def _load_todo(conn, pairs):
+    conn.execute(_TODO_DDL)
+    conn.execute("DELETE FROM temp.daily_todo")
+    conn.executemany("INSERT OR IGNORE INTO temp.daily_todo (source, date) VALUES (?, ?)", pairs)
+
+
+def _aggregate_partition(db_path, pairs):
+    """工作进程：只读连接上计算一段日期的每日消耗，返回待插入的行（写入由主进程完成）"""
+    power_db.DB_PATH = db_path  # 分区目录跟随主库位置
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        power_partitions.attach(conn, pairs[0][1], pairs[-1][1], readonly=True)
+        _load_todo(conn, pairs)
+        return conn.execute(_TODO_SELECT, (pairs[0][1], pairs[-1][1])).fetchall()
+    finally:
+        conn.close()
+
+
+def _partitions(pairs, parts):
+    """按日期把 pairs（已按日期排序）切成至多 parts 段，同一天不跨段"""
+    dates = sorted({d for _s, d in pairs})
+    per = -(-len(dates) // parts)
+    bounds = {d: i // per for i, d in enumerate(dates)}
+    chunks = [[] for _ in range(parts)]
+    for p in pairs:
+        chunks[bounds[p[1]]].append(p)
+    return [c for c in chunks if c]
+
+
+def rebuild_days(conn, pairs, workers=1):
+    """重算给定的 (source, date)（先删后插，不提交事务），返回写入的行数。
+
+    调用前需为 conn 附加 pairs 日期范围的分区。workers > 1 时按日期分段交给进程池
+    并行聚合（只读），主进程在一个事务里统一写入。
+    """
+    if not pairs:
+        return 0
+    pairs = sorted(set(pairs), key=lambda p: (p[1], p[0]))
+    results = None
+    if workers > 1:
+        # 先并行聚合再开启写事务，聚合期间不持有写锁
+        chunks = _partitions(pairs, workers)
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=len(chunks), mp_context=ctx) as pool:
+            results = list(pool.map(_aggregate_partition, [power_db.DB_PATH] * len(chunks), chunks))
+
+    _load_todo(conn, pairs)
+    conn.execute("DELETE FROM power_daily WHERE (source, date) IN (SELECT source, date FROM temp.daily_todo)")
+    if results is None:
+        cur = conn.execute(f"INSERT INTO power_daily (source, date, consume_power) {_TODO_SELECT}",
+                           (pairs[0][1], pairs[-1][1]))
+        return cur.rowcount
+    rows = 0
+    for result in results:
+        conn.executemany("INSERT INTO power_daily (source, date, consume_power) VALUES (?, ?, ?)", result)
+        rows += len(result)
+    return rows
+
+
+def backfill_daily(start, end, sources=None, missing_only=True, cfg=None, mode="rebuild"):
+    """补算 / 重算 [start, end] 的每日统计，返回统计信息。
+
+    missing_only=True 只处理没有统计的 (source, date)；False 时范围内有读数的 (source, date) 全部重算
+    （没有读数的日期，例如已归档的月份，保留原有统计）。
+    缺口跨越的天数超过 daily_backfill_parallel_days 时按日期分段并行聚合（daily_backfill_workers 个进程）。
+    """
+    cfg = cfg or Config()
+    for d in (start, end):
+        datetime.strptime(d, "%Y-%m-%d")
+    if start > end:
+        raise ValueError("start 不能晚于 end")
+    t0 = time.perf_counter()
+    parallel_days = max(1, cfg.get_int("system", "daily_backfill_parallel_days", 31))
+    pairs, rows, days, workers = [], 0, 0, 1
+    conn = get_db()
+    conn.row_factory = None
+    try:
+        # 跨越的月份分区超过单个连接可附加的上限时分段处理
+        for lo, hi in power_partitions.split_range(start, end, power_partitions.max_attached(conn)):
+            power_partitions.attach(conn, lo, hi)
+            if missing_only:
+                part = find_missing_days(conn, lo, hi)
+            else:
+                part = [tuple(r) for r in conn.execute(
+                    "SELECT DISTINCT source, date FROM power_log_view WHERE date BETWEEN ? AND ?", (lo, hi))]
+            if sources is not None:
+                wanted = set(sources)
+                part = [p for p in part if p[0] in wanted]
+            n_days = len({d for _s, d in part})
+            n_workers = 1
+            if n_days > parallel_days:
+                n_workers = max(1, min(n_days, cfg.get_int("system", "daily_backfill_workers", 4)))
+            rows += rebuild_days(conn, part, workers=n_workers)
+            conn.commit()
+            pairs += part
+            days += n_days
+            workers = max(workers, n_workers)
+    finally:
+        conn.close()
+    if pairs:
+        DAILY_BACKFILL.labels(mode).inc(len(pairs))
+    stats = {"start": start, "end": end, "pairs": len(pairs), "days": days, "rows": rows,
+             "workers": workers, "seconds": round(time.perf_counter() - t0, 3)}
+    if pairs:
+        logger.info("[power_daily] %s %s~%s：%d 个 (source, 日期)，%d 天，写入 %d 行，%d 进程，用时 %.1fs",
+                    "补算" if missing_only else "重算", start, end, len(pairs), days, rows, workers, stats["seconds"])
+    return stats
+
+
+def catch_up_daily():
+    """补算最近 daily_catchup_days 天（不含今天）漏掉的每日统计；0 表示关闭"""
+    cfg = Config()
+    days = cfg.get_int("system", "daily_catchup_days", 30)
+    if days <= 0:
+        return None
+    today = datetime.now().date()
+    try:
+        return backfill_daily((today - timedelta(days=days)).strftime('%Y-%m-%d'),
+                              (today - timedelta(days=1)).strftime('%Y-%m-%d'), cfg=cfg, mode="catch_up")
+    except Exception as e:
+        logger.error(f"[power_daily] 补算失败: {e}")
+        return None
 
 # ========== 周报邮件任务 ==========
-def send_weekly_report():
-    """每周一10:00发送上周电量消耗周报邮件"""
+def _last_week(today=None):
+    today = today or datetime.now().date()
+    week_start = today - timedelta(days=today.weekday()+7)  # 上周一
+    week_end = week_start + timedelta(days=6)               # 上周日
+    return week_start, week_end
+
+
+def build_weekly_reports(conn, cfg, today=None):
+    """一次性为所有 source 生成上周周报。
+
+    聚合查询：
+    1) power_daily 只扫上周 7 天，按 source 分组透视成 7 列
+    2) DISTINCT source 给出全部 source（上周无数据的也照常出周报，用量记 0）
+    3) 窗口函数取每个 source 本周以来的最新剩余电量
+    返回 list[dict]：source/subject/content/recipients
+    """
+    week_start, week_end = _last_week(today)
+    power_partitions.attach(conn, week_start.strftime('%Y-%m-%d'))
+    week_dates = [(week_start + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(7)]
+
+    pivot = ',\n'.join([f'SUM(CASE WHEN date = ? THEN consume_power ELSE 0 END) AS d{i}' for i in range(7)])
+    weekly = conn.execute(f'''
+        SELECT source,
+        {pivot}
+        FROM power_daily
+        WHERE date BETWEEN ? AND ?
+        GROUP BY source
+    ''', week_dates + [week_dates[0], week_dates[6]]).fetchall()
+    by_source = {row['source']: row for row in weekly}
+    sources = [r['source'] for r in conn.execute('SELECT DISTINCT source FROM power_daily ORDER BY source')]
+
+    latest = {r['source']: r['remain_power'] for r in conn.execute('''
+        SELECT source, remain_power FROM (
+            SELECT source, remain_power,
+                   ROW_NUMBER() OVER (PARTITION BY source ORDER BY date DESC, time DESC) AS rn
+            FROM power_log_view
+            WHERE date >= ?
+        ) WHERE rn = 1
+    ''', (week_start.strftime('%Y-%m-%d'),))}
+
+    # 收件人映射只读一次；匹配规则与 Config.get_source_recipients 一致（先精确，再忽略大小写）
+    recipient_map = cfg.get_source_recipient_map()
+    recipient_map_cf = {}
+    for k, v in recipient_map.items():
+        recipient_map_cf.setdefault(k.casefold(), v)
+
+    reports = []
+    for source in sources:
+        row = by_source.get(source)
+        values = [(row[f'd{i}'] or 0) if row else 0 for i in range(7)]
+        remain_power = latest.get(source, '未知')
+        # 统计
+        total = sum(values)
+        maxv = max(values)
+        minv = min(values)
+        maxd = week_dates[values.index(maxv)]
+        mind = week_dates[values.index(minv)]
+        # 构造表格
+        table = '日期      | 消耗\n' + '\n'.join([f'{d} | {v:.2f}' for d, v in zip(week_dates, values)])
+        content = f'''电量周报（{week_start}~{week_end}）\n\n{table}\n\n总消耗: {total:.2f}\n最高: {maxv:.2f}（{maxd}）\n最低: {minv:.2f}（{mind}）\n当前剩余: {remain_power}'''
+        key = str(source or '').strip()
+        recipients = recipient_map.get(key) or recipient_map_cf.get(key.casefold(), [])
+        reports.append({
+            'source': source,
+            'subject': f'【电量周报】{source}',
+            'content': content,
+            'recipients': recipients
+        })
+    return reports
+
+
+def _deliver_report(report):
+    # 每个线程使用独立的 Config，send_email 会重新读取配置文件
+    Config().send_email(report['subject'], report['content'], to_override=report['recipients'])
+    return report['source']
+
+
+def send_weekly_report(dry_run=False):
+    """每周一10:00发送上周电量消耗周报邮件
+
+    周报数据集中生成后，由有界线程池并发投递（[system] weekly_report_workers，默认 4）。
+    dry_run=True 时只生成不发送，返回生成的周报列表。
+    """
     cfg = Config()
     conn = get_db()
     try:
-        today = datetime.now().date()
-        week_start = today - timedelta(days=today.weekday()+7)  # 上周一
-        week_end = week_start + timedelta(days=6)               # 上周日
-        week_dates = [(week_start + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(7)]
-        # 查询所有source
-        sources = set([row['source'] for row in conn.execute('SELECT DISTINCT source FROM power_daily')])
-        for source in sources:
-            # 查询一周消耗
-            rows = list(conn.execute('''
-                SELECT date, consume_power FROM power_daily
-                WHERE source=? AND date BETWEEN ? AND ?
-                ORDER BY date
-            ''', (source, week_start.strftime('%Y-%m-%d'), week_end.strftime('%Y-%m-%d'))))
-            daily = {r['date']: r['consume_power'] for r in rows}
-            # 查询最新剩余电量
-            last_remain = conn.execute('''
-                SELECT remain_power FROM power_log
-                WHERE source=?
-                ORDER BY date DESC, time DESC LIMIT 1
-            ''', (source,)).fetchone()
-            remain_power = last_remain['remain_power'] if last_remain else '未知'
-            # 统计
-            values = [daily.get(d, 0) for d in week_dates]
-            total = sum(values)
-            maxv = max(values) if values else 0
-            minv = min(values) if values else 0
-            maxd = week_dates[values.index(maxv)] if values else ''
-            mind = week_dates[values.index(minv)] if values else ''
-            # 构造表格
-            table = '日期      | 消耗\n' + '\n'.join([f'{d} | {daily.get(d, 0):.2f}' for d in week_dates])
-            content = f'''电量周报（{week_start}~{week_end}）\n\n{table}\n\n总消耗: {total:.2f}\n最高: {maxv:.2f}（{maxd}）\n最低: {minv:.2f}（{mind}）\n当前剩余: {remain_power}'''
-            # 收件人策略
-            recipients = cfg.get_source_recipients(source)
-            if recipients:
-                cfg.send_email(f'【电量周报】{source}', content, to_override=recipients)
-            else:
-                logger.warning(f"[周报] 未找到source={source}的收件人")
+        reports = build_weekly_reports(conn, cfg)
     except Exception as e:
-        logger.error(f"[周报] 发送失败: {e}")
+        logger.error(f"[周报] 生成失败: {e}")
+        return []
     finally:
         conn.close()
 
-# ========== 半年数据清理 ==========
+    deliverable = []
+    for report in reports:
+        if report['recipients']:
+            deliverable.append(report)
+        else:
+            logger.warning(f"[周报] 未找到source={report['source']}的收件人")
+
+    if dry_run:
+        logger.info(f"[周报] dry-run: 已生成 {len(reports)} 份周报，其中 {len(deliverable)} 份有收件人，未发送")
+        return reports
+
+    workers = max(1, cfg.get_int("system", "weekly_report_workers", 4))
+    metrics.EMAIL_QUEUE_G.inc(len(deliverable))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="weekly-report") as pool:
+        futures = [pool.submit(_deliver_report, r) for r in deliverable]
+        for fut in as_completed(futures):
+            metrics.EMAIL_QUEUE_G.dec()
+            try:
+                fut.result()
+            except Exception as e:
+                logger.error(f"[周报] 发送失败: {e}")
+    logger.info(f"[周报] 已投递 {len(deliverable)} 份周报（并发 {workers}）")
+    return reports
+
+# ========== 半年数据归档/清理 ==========
 def cleanup_history():
+    """把超过保留期的读数归档为按月列式文件（可重复执行，归档后直接删除该月分区文件），
+    并清理过期的每日统计"""
+    cfg = Config()
+    keep_days = cfg.get_int("system", "archive_after_days", 180)
+    daily_days = cfg.get_int("system", "daily_retention_days", keep_days)
+    try:
+        archive_old_months(cfg, keep_days=keep_days)
+        reset_ingest_cache()
+    except Exception as e:
+        logger.error(f"[归档] 失败: {e}")
     conn = get_db()
     try:
-        conn.execute("DELETE FROM power_log WHERE date < date('now', '-180 days')")
-        conn.execute("DELETE FROM power_daily WHERE date < date('now', '-180 days')")
+        conn.execute("DELETE FROM power_daily WHERE date < date('now', ?)", (f'-{daily_days} days',))
         conn.commit()
     except Exception as e:
         logger.error(f"[清理] 失败: {e}")
@@ -101,16 +351,56 @@ def cleanup_history():
 
 # ========== 定时任务注册 ==========
 def start_schedules():
-    # 每天0:10统计昨日消耗
-    scheduler.add_job(calc_daily_power, 'cron', hour=0, minute=10)
+    # 每天0:10统计昨日消耗（进程卡顿错过触发点时一小时内仍补跑一次）
+    scheduler.add_job(calc_daily_power, 'cron', hour=0, minute=10, misfire_grace_time=3600, coalesce=True)
     # 每周一10:00发周报
     scheduler.add_job(send_weekly_report, 'cron', day_of_week='mon', hour=10, minute=0)
-    # 每天1:00清理历史
-    scheduler.add_job(cleanup_history, 'cron', hour=1, minute=0)
+    # 每天1:00归档/清理历史
+    scheduler.add_job(cleanup_history, 'cron', hour=1, minute=0, misfire_grace_time=3600, coalesce=True)
+    # 每天备份 + ANALYZE + 增量回收 + WAL 检查点（默认 3:30，归档/清理之后）
+    cfg = Config()
+    scheduler.add_job(run_maintenance, 'cron', hour=cfg.get_int("system", "maintenance_hour", 3), minute=30,
+                      misfire_grace_time=3600, coalesce=True)
+    # 启动时补算停机期间漏掉的每日统计（在调度线程中执行，不阻塞启动）
+    scheduler.add_job(catch_up_daily, next_run_time=datetime.now())
     scheduler.start()
 
 # ========== 启动入口 ==========
+# 用法：
+#   python power_tasks.py                         启动定时任务
+#   python power_tasks.py weekly-report [--dry-run]  立即生成/发送上周周报
+#   python power_tasks.py catch-up                   补算最近 daily_catchup_days 天漏掉的每日统计
+#   python power_tasks.py rebuild-daily 开始日期 [结束日期] [--source a,b] [--missing-only]
+#                                                    重算一段日期的每日统计（默认全部重算）
 if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args and args[0] == 'catch-up':
+        print(json.dumps(catch_up_daily(), ensure_ascii=False, indent=2))
+        sys.exit(0)
+    if args and args[0] == 'rebuild-daily':
+        import argparse
+        ap = argparse.ArgumentParser(prog="power_tasks.py rebuild-daily", description="重算一段日期的每日统计")
+        ap.add_argument("start", help="开始日期 YYYY-MM-DD")
+        ap.add_argument("end", nargs="?", help="结束日期（默认与开始日期相同）")
+        ap.add_argument("--source", help="只处理这些 source（逗号分隔）")
+        ap.add_argument("--missing-only", action="store_true", help="只补算没有统计的 (source, 日期)")
+        opts = ap.parse_args(args[1:])
+        try:
+            result = backfill_daily(opts.start, opts.end or opts.start,
+                                    sources=[x.strip() for x in opts.source.split(',') if x.strip()] if opts.source else None,
+                                    missing_only=opts.missing_only)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            sys.exit(2)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        sys.exit(0)
+    if args and args[0] == 'weekly-report':
+        dry = '--dry-run' in args
+        for r in send_weekly_report(dry_run=dry):
+            if dry:
+                print(f"===== {r['subject']} -> {', '.join(r['recipients']) or '(无收件人)'}\n{r['content']}\n")
+        sys.exit(0)
+
     start_schedules()
     logger.info('定时任务已启动，按Ctrl+C退出')
     try:
@@ -0,0 +1,84 @@
+"""
+房间读数模型 - 页面解析时构造一次，合并、入库、告警、预测与状态接口全程共用
+
+- Reading 用 __slots__ 存放 room / kwh / money / source / meter_type / sources，
+  kwh、money 在解析时就转成 float（无法解析为 None），下游不再各自做字符串转数字；
+  room / source / meter_type 经 sys.intern 驻留，每轮重新解析出的同名房间共用同一个字符串对象。
+- 抓取端原地补上 source / meter_type（页面缓存复用的是同一批对象，分类规则不变时不会重复分类）；
+  合并时只出现在一个 source 的房间直接复用原对象，重复房间才生成新的合并记录。
+- 需要 JSON 时调用 to_dict()；对象可 pickle，分片模式下直接在进程间传递。
+"""
+import re
+import sys
+
+_intern = sys.intern
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+def parse_number(value):
+    """读数转 float：纯数字走快速路径，带单位的（如 "27.04度"）再用正则提取；无法解析返回 None"""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        m = _NUMBER.search(str(value))
+        return float(m.group(0)) if m else None
+
+
+def fmt(value):
+    """邮件 / 日志里展示读数（保留两位小数，与学校页面一致）"""
+    return "-" if value is None else f"{value:.2f}"
+
+
+class Reading:
+    __slots__ = ("room", "kwh", "money", "source", "meter_type", "sources")
+
+    def __init__(self, room, kwh, money, source=None, meter_type="unknown", sources=()):
+        self.room = _intern(room)
+        self.kwh = kwh
+        self.money = money
+        self.source = source
+        self.meter_type = meter_type
+        self.sources = sources
+
+    @classmethod
+    def parse(cls, room, kwh_text, money_text):
+        """页面文本 -> Reading（解析失败的数值为 None）"""
+        return cls(room, parse_number(kwh_text), parse_number(money_text))
+
+    def tag(self, source, meter_type):
+        """抓取端补上来源与分类（原地修改）"""
+        self.source = _intern(source)
+        self.meter_type = _intern(meter_type or "unknown")
+        self.sources = (self.source,)
+
+    def to_dict(self):
+        return {"room": self.room, "kwh": self.kwh, "money": self.money,
+                "meter_type": self.meter_type, "sources": self.sources}
+
+    def key(self):
+        """用于判断内容是否变化的不可变值（见 status_delta）"""
+        return (self.kwh, self.money, self.meter_type, self.sources)
+
+    def __getstate__(self):
+        return (self.room, self.kwh, self.money, self.source, self.meter_type, self.sources)
+
+    def __setstate__(self, state):
+        room, self.kwh, self.money, source, meter_type, sources = state
+        # 跨进程传过来的字符串重新驻留
+        self.room = _intern(room)
+        self.source = _intern(source) if source else source
+        self.meter_type = _intern(meter_type) if meter_type else meter_type
+        self.sources = tuple(_intern(x) for x in sources)
+
+    def __eq__(self, other):
+        if not isinstance(other, Reading):
+            return NotImplemented
+        return self.room == other.room and self.source == other.source and self.key() == other.key()
+
+    __hash__ = None
+
+    def __repr__(self):
+        return (f"Reading(room={self.room!r}, kwh={self.kwh!r}, money={self.money!r}, "
+                f"source={self.source!r}, meter_type={self.meter_type!r})")
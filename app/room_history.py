@@ -0,0 +1,190 @@
+"""
+房间读数环形缓冲 - 仪表盘迷你走势图（sparkline）直接从内存取数
+
+- 每个房间一行：float32 读数 + uint32 时间戳（Unix 秒）的定长环形缓冲，行号按房间首次出现分配；
+  内存只与 房间数 x sparkline_points 有关（每个点 8 字节，1 万房间 x 96 点约 7.3MB）。
+- 监控线程每轮把新抓到的读数追加进来（单进程与分片模式都在写入端记录）；
+  启动时从 power_log_view 预热最近的读数，重启后走势图不会从空白开始。
+- GET /api/sparklines 一次返回所有（或指定）房间最近 N 个点，不访问数据库。
+"""
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from config import logger
+from power_db import get_db
+import power_partitions
+
+DEFAULT_POINTS = 96
+
+
+class RoomRing:
+    """按房间的列式环形缓冲（线程安全：监控线程写、Flask 请求线程读）"""
+
+    def __init__(self, points=DEFAULT_POINTS):
+        self._lock = threading.Lock()
+        self.points = points
+        self._index = {}        # room -> 行号
+        self._rooms = []        # 行号 -> room
+        self._alloc(0, points)
+
+    def _alloc(self, capacity, points):
+        self._values = np.full((capacity, points), np.nan, dtype=np.float32)
+        self._times = np.zeros((capacity, points), dtype=np.uint32)
+        self._ptr = np.zeros(capacity, dtype=np.int32)       # 下一个写入位置
+        self._count = np.zeros(capacity, dtype=np.int32)     # 已写入的点数（不超过 points）
+
+    def _grow(self, need):
+        cap = len(self._ptr)
+        if need <= cap:
+            return
+        new_cap = max(need, cap * 2, 64)
+        old = (self._values, self._times, self._ptr, self._count)
+        self._alloc(new_cap, self.points)
+        self._values[:cap], self._times[:cap], self._ptr[:cap], self._count[:cap] = old
+
+    def _ordered(self, rows, n):
+        """rows 每行最近 n 个点（旧 -> 新），返回 (values, times, 有效点数)"""
+        cols = (self._ptr[rows, None] - n + np.arange(n)[None, :]) % self.points
+        values = np.take_along_axis(self._values[rows], cols, axis=1)
+        times = np.take_along_axis(self._times[rows], cols, axis=1)
+        return values, times, np.minimum(self._count[rows], n)
+
+    def resize(self, points):
+        """调整每个房间保留的点数（保留最近的点）"""
+        points = max(2, int(points))
+        with self._lock:
+            if points == self.points:
+                return
+            n = len(self._rooms)
+            keep = min(points, self.points)
+            rows = np.arange(n)
+            values, times, count = self._ordered(rows, keep)
+            cap = len(self._ptr)
+            self.points = points
+            self._alloc(cap, points)
+            self._values[:n, :keep] = values
+            self._times[:n, :keep] = times
+            # 有效点是 [keep - count, keep) 这一段；写指针接在 keep 之后，读取时按 count 截取
+            self._ptr[:n] = keep % points
+            self._count[:n] = count
+
+    def _rows_for(self, rooms):
+        rows = np.empty(len(rooms), dtype=np.int64)
+        for i, room in enumerate(rooms):
+            r = self._index.get(room)
+            if r is None:
+                r = self._index[room] = len(self._rooms)
+                self._rooms.append(room)
+            rows[i] = r
+        self._grow(len(self._rooms))
+        return rows
+
+    def record(self, items, now=None):
+        """追加一轮读数（items 为合并后的房间列表，每个房间至多一条）"""
+        ts = int(time.time() if now is None else now)
+        rooms, values = [], []
+        for r in items:
+            if r.room and r.kwh is not None:
+                rooms.append(r.room)
+                values.append(r.kwh)
+        if not rooms:
+            return 0
+        with self._lock:
+            rows = self._rows_for(rooms)
+            cols = self._ptr[rows]
+            self._values[rows, cols] = values
+            self._times[rows, cols] = ts
+            self._ptr[rows] = (cols + 1) % self.points
+            self._count[rows] = np.minimum(self._count[rows] + 1, self.points)
+        return len(rooms)
+
+    def load(self, series):
+        """批量写入 {room: [(ts, value), ...]}（按时间升序，只保留最近 points 个）"""
+        with self._lock:
+            rows = self._rows_for(list(series))
+            for r, pts in zip(rows, series.values()):
+                pts = list(pts)[-self.points:]
+                k = len(pts)
+                self._times[r, :k] = [p[0] for p in pts]
+                self._values[r, :k] = [p[1] for p in pts]
+                self._ptr[r] = k % self.points
+                self._count[r] = k
+
+    def last(self, n=None, rooms=None):
+        """返回 {room: {"t": [...], "v": [...]}}（旧 -> 新），n 不超过 points"""
+        n = self.points if not n else max(1, min(int(n), self.points))
+        with self._lock:
+            if rooms is None:
+                names = list(self._rooms)
+                rows = np.arange(len(names))
+            else:
+                names = [r for r in rooms if r in self._index]
+                rows = np.array([self._index[r] for r in names], dtype=np.int64)
+            if not names:
+                return {}
+            values, times, count = self._ordered(rows, n)
+        values = np.round(values.astype(np.float64), 2).tolist()
+        times = times.tolist()
+        out = {}
+        for i, room in enumerate(names):
+            k = int(count[i])
+            if k:
+                out[room] = {"t": times[i][n - k:], "v": values[i][n - k:]}
+        return out
+
+    def memory_bytes(self):
+        return self._values.nbytes + self._times.nbytes + self._ptr.nbytes + self._count.nbytes
+
+    def __len__(self):
+        return len(self._rooms)
+
+
+ring = RoomRing()
+
+
+def configure(cfg):
+    ring.resize(cfg.get_int("system", "sparkline_points", DEFAULT_POINTS))
+
+
+def warm(cfg):
+    """启动时从 power_log_view 预热最近的读数（按 interval 估算需要回看的天数）"""
+    configure(cfg)
+    interval = max(60, cfg.get_int("system", "interval", 900))
+    days = min(31, int(ring.points * interval / 86400) + 1)
+    start = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+    t0 = time.perf_counter()
+    series = {}
+    try:
+        conn = get_db()
+        conn.row_factory = None
+        try:
+            power_partitions.attach(conn, start)
+            rows = conn.execute(
+                "SELECT room, date, time, remain_power FROM power_log_view "
+                "WHERE date >= ? AND room IS NOT NULL AND room != '' ORDER BY date, time",
+                (start,)
+            )
+            parse = datetime.strptime
+            for room, d, t, v in rows:
+                if v is None:
+                    continue
+                try:
+                    ts = int(parse(f"{d} {t}", "%Y-%m-%d %H:%M:%S").timestamp())
+                except ValueError:
+                    continue
+                pts = series.get(room)
+                if pts is None:
+                    pts = series[room] = deque(maxlen=ring.points)
+                pts.append((ts, v))
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.error(f"[走势缓存] 预热失败: {e}")
+        return 0
+    ring.load(series)
+    logger.info(f"📈 走势缓存已预热: {len(series)} 个房间, 用时 {time.perf_counter() - t0:.2f}s")
+    return len(series)
@@ -0,0 +1,397 @@
+"""
+source 注册表 - 把 source 列表、Cookie/UA、显示名称、收件人映射存入 power.db
+
+config.ini 中的 [auth] / [auth.<source>] / [auth.labels] / [notify.sources] / [notify.rooms]
+以及 [system] auth_sources 在迁移后全部转入 SQLite，config.ini 只保留系统级设置：
+- 按主键索引查询，不再每次扫描全部 section；
+- 写一个 Cookie / 一条收件人映射只更新一行，不再重写整个 config.ini；
+- 支持批量导入/导出（JSON）。
+
+迁移前 Config 仍读写 config.ini（两种存储接口一致，见 config.Config）。迁移方式：
+    python source_registry.py migrate              从 config.ini 迁移（会先备份 config.ini）
+    python source_registry.py export [文件]        导出为 JSON（包含 Cookie，注意保管）
+    python source_registry.py import 文件 [--replace]
+或管理员接口 /api/admin/sources/*。
+"""
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+
+import power_db
+
+logger = logging.getLogger("System")
+
+LEGACY = "legacy"
+
+# 迁移后从 config.ini 移除的内容
+_MOVED_SECTIONS = ("auth", "auth.labels", "notify.sources", "notify.rooms")
+
+_local = threading.local()
+_active_cache = {}      # (DB_PATH, inode) -> (是否已迁移, 检查时间)
+_ACTIVE_RECHECK = 30.0
+
+
+def _db_identity():
+    """(路径, inode)：库文件被替换/删除重建后需要重新连接"""
+    path = power_db.DB_PATH
+    try:
+        st = os.stat(path)
+        return path, st.st_dev, st.st_ino
+    except OSError:
+        return path, None, None
+
+
+def _conn():
+    """线程内复用的连接（测试/压测会替换 DB 路径或重建库文件）"""
+    ident = _db_identity()
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "ident", None) != ident:
+        if conn is not None:
+            conn.close()
+        conn = sqlite3.connect(power_db.DB_PATH)
+        conn.row_factory = sqlite3.Row
+        _local.conn, _local.ident = conn, _db_identity()
+    return conn
+
+
+def _split(value):
+    if isinstance(value, (list, tuple, set)):
+        parts = [str(x).strip() for x in value]
+    else:
+        parts = str(value or "").replace(";", ",").replace("\n", ",").split(",")
+    return [x.strip() for x in parts if x.strip()]
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def is_active():
+    """是否已迁移到注册表（已迁移的状态长期缓存；未迁移时每 30 秒重新检查一次）"""
+    ident = _db_identity()
+    cached = _active_cache.get(ident)
+    if cached and (cached[0] or time.monotonic() - cached[1] < _ACTIVE_RECHECK):
+        return cached[0]
+    active = False
+    if ident[2] is not None:
+        try:
+            row = _conn().execute("SELECT value FROM registry_meta WHERE key = 'migrated_at'").fetchone()
+            active = row is not None
+        except sqlite3.Error:
+            active = False
+    _active_cache[ident] = (active, time.monotonic())
+    return active
+
+
+def _mark_active(conn):
+    conn.execute("INSERT OR REPLACE INTO registry_meta (key, value) VALUES ('migrated_at', ?)", (_now(),))
+    _active_cache[_db_identity()] = (True, time.monotonic())
+
+
+# ========== 读取 ==========
+
+def get_auth(source):
+    row = _conn().execute(
+        "SELECT cookie, user_agent FROM source_registry WHERE source = ?", (source or LEGACY,)
+    ).fetchone()
+    if row is None:
+        return "", ""
+    return row["cookie"] or "", row["user_agent"] or ""
+
+
+def polled_sources():
+    rows = _conn().execute(
+        "SELECT source FROM source_registry WHERE polled = 1 ORDER BY position, source"
+    ).fetchall()
+    return [r["source"] for r in rows]
+
+
+def labels():
+    rows = _conn().execute("SELECT source, label FROM source_registry WHERE label IS NOT NULL AND label != ''")
+    return {r["source"]: r["label"] for r in rows}
+
+
+def source_recipient_map():
+    rows = _conn().execute(
+        "SELECT source, recipients FROM source_registry WHERE recipients IS NOT NULL AND recipients != ''"
+    )
+    return {r["source"]: _split(r["recipients"]) for r in rows}
+
+
+def source_recipients(source):
+    row = _conn().execute("SELECT recipients FROM source_registry WHERE source = ?", (source,)).fetchone()
+    return _split(row["recipients"]) if row else []
+
+
+def room_recipient_map():
+    return {r["room"]: _split(r["recipients"]) for r in _conn().execute("SELECT room, recipients FROM room_recipients")}
+
+
+def room_recipients(room):
+    row = _conn().execute("SELECT recipients FROM room_recipients WHERE room = ?", (room,)).fetchone()
+    return _split(row["recipients"]) if row else []
+
+
+# ========== 写入（每次只改涉及的行） ==========
+
+def set_auth(source, cookie, ua):
+    conn = _conn()
+    with conn:
+        conn.execute('''
+            INSERT INTO source_registry (source, cookie, user_agent, updated_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(source) DO UPDATE SET
+                cookie = excluded.cookie, user_agent = excluded.user_agent, updated_at = excluded.updated_at
+        ''', (source or LEGACY, cookie, ua, _now()))
+
+
+def set_source_recipients(source, recipients):
+    conn = _conn()
+    with conn:
+        conn.execute('''
+            INSERT INTO source_registry (source, recipients, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT(source) DO UPDATE SET recipients = excluded.recipients, updated_at = excluded.updated_at
+        ''', (source, ",".join(_split(recipients)), _now()))
+
+
+def set_room_recipients(room, recipients):
+    rec = ",".join(_split(recipients))
+    conn = _conn()
+    with conn:
+        if rec:
+            conn.execute("INSERT OR REPLACE INTO room_recipients (room, recipients) VALUES (?, ?)", (room, rec))
+        else:
+            conn.execute("DELETE FROM room_recipients WHERE room = ?", (room,))
+
+
+def set_polled_sources(sources):
+    """设置轮询列表（顺序即 position），一次事务"""
+    conn = _conn()
+    now = _now()
+    with conn:
+        conn.execute("UPDATE source_registry SET polled = 0, position = NULL WHERE polled = 1")
+        conn.executemany('''
+            INSERT INTO source_registry (source, polled, position, updated_at) VALUES (?, 1, ?, ?)
+            ON CONFLICT(source) DO UPDATE SET polled = 1, position = excluded.position
+        ''', [(s, i, now) for i, s in enumerate(sources)])
+
+
+def replace_labels(mapping):
+    conn = _conn()
+    now = _now()
+    with conn:
+        conn.execute("UPDATE source_registry SET label = NULL WHERE label IS NOT NULL")
+        conn.executemany('''
+            INSERT INTO source_registry (source, label, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT(source) DO UPDATE SET label = excluded.label
+        ''', [(s, str(v).strip(), now) for s, v in mapping.items() if str(v or "").strip()])
+
+
+def replace_source_recipients(mapping):
+    conn = _conn()
+    now = _now()
+    with conn:
+        conn.execute("UPDATE source_registry SET recipients = NULL WHERE recipients IS NOT NULL")
+        conn.executemany('''
+            INSERT INTO source_registry (source, recipients, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT(source) DO UPDATE SET recipients = excluded.recipients
+        ''', [(s, ",".join(_split(v)), now) for s, v in mapping.items() if _split(v)])
+
+
+def replace_room_recipients(mapping):
+    conn = _conn()
+    with conn:
+        conn.execute("DELETE FROM room_recipients")
+        conn.executemany("INSERT OR REPLACE INTO room_recipients (room, recipients) VALUES (?, ?)",
+                         [(r, ",".join(_split(v))) for r, v in mapping.items() if _split(v)])
+
+
+# ========== 批量导入/导出 ==========
+
+_SOURCE_FIELDS = ("source", "label", "cookie", "user_agent", "recipients", "polled", "position")
+
+
+def export_all():
+    """导出全部 source 与房间收件人（包含 Cookie）"""
+    conn = _conn()
+    sources = [
+        {k: r[k] for k in _SOURCE_FIELDS}
+        for r in conn.execute(f"SELECT {', '.join(_SOURCE_FIELDS)} FROM source_registry ORDER BY source")
+    ]
+    for s in sources:
+        s["polled"] = bool(s["polled"])
+        s["recipients"] = _split(s["recipients"])
+    rooms = [{"room": r["room"], "recipients": _split(r["recipients"])}
+             for r in conn.execute("SELECT room, recipients FROM room_recipients ORDER BY room")]
+    return {"sources": sources, "rooms": rooms}
+
+
+def import_all(payload, replace=False, conn=None):
+    """批量导入 {"sources": [...], "rooms": [...]}，一次事务。
+
+    replace=True 先清空注册表；否则按 source/room 合并，只覆盖提供了的字段。
+    返回 (source 数, room 数)。
+    """
+    own = conn is None
+    conn = conn or _conn()
+    now = _now()
+    source_rows = []
+    for item in payload.get("sources") or []:
+        name = str(item.get("source") or "").strip()
+        if not name:
+            continue
+        row = {"source": name}
+        for k in ("label", "cookie", "user_agent"):
+            if k in item:
+                row[k] = str(item.get(k) or "").strip()
+        if "recipients" in item:
+            row["recipients"] = ",".join(_split(item.get("recipients")))
+        if "polled" in item:
+            row["polled"] = 1 if item.get("polled") else 0
+        if "position" in item:
+            row["position"] = item.get("position")
+        source_rows.append(row)
+    room_rows = [
+        (str(r.get("room") or "").strip(), ",".join(_split(r.get("recipients"))))
+        for r in payload.get("rooms") or []
+    ]
+    room_rows = [r for r in room_rows if r[0] and r[1]]
+
+    def run():
+        if replace:
+            conn.execute("DELETE FROM source_registry")
+            conn.execute("DELETE FROM room_recipients")
+        # 按字段组合分组，每组一条 executemany
+        groups = {}
+        for row in source_rows:
+            groups.setdefault(tuple(k for k in row if k != "source"), []).append(row)
+        for cols, rows in groups.items():
+            names = ("source",) + cols + ("updated_at",)
+            updates = ", ".join(f"{c} = excluded.{c}" for c in cols + ("updated_at",))
+            conn.executemany(
+                f"INSERT INTO source_registry ({', '.join(names)}) VALUES ({', '.join('?' * len(names))}) "
+                f"ON CONFLICT(source) DO UPDATE SET {updates}",
+                [tuple(r["source"] if c == "source" else (now if c == "updated_at" else r[c]) for c in names)
+                 for r in rows]
+            )
+        conn.executemany("INSERT OR REPLACE INTO room_recipients (room, recipients) VALUES (?, ?)", room_rows)
+        _mark_active(conn)
+
+    if own:
+        with conn:
+            run()
+    else:
+        run()
+    return len(source_rows), len(room_rows)
+
+
+# ========== 从 config.ini 迁移 ==========
+
+def _read_ini_registry(cp):
+    """从 ConfigParser 读出注册表内容（与原 Config 的读取规则一致）"""
+    defaults = set(cp.defaults().keys()) | {"config_file"}
+
+    def items(section):
+        if not cp.has_section(section):
+            return []
+        return [(k.strip(), str(v).strip()) for k, v in cp.items(section, raw=True)
+                if k.strip() and k.strip() not in defaults and k.strip().casefold() != "config_file"]
+
+    raw = cp.get("system", "auth_sources", fallback="").strip() if cp.has_section("system") else ""
+    polled = [x.strip() for x in raw.replace(";", ",").replace("\n", ",").split(",") if x.strip()]
+    auth_sections = [sec[len("auth."):] for sec in cp.sections()
+                     if sec.startswith("auth.") and sec != "auth.labels" and len(sec) > len("auth.")]
+    if not raw:
+        # 未配置 auth_sources 时原逻辑按已有的 [auth.xxx] 段轮询
+        polled = sorted(set(auth_sections))
+
+    sources = {}
+
+    def row(name):
+        return sources.setdefault(name, {"source": name})
+
+    for i, s in enumerate(polled):
+        row(s).update(polled=True, position=i)
+    for s in auth_sections:
+        sec = f"auth.{s}"
+        row(s).update(cookie=cp.get(sec, "cookie", fallback="").strip(),
+                      user_agent=cp.get(sec, "user_agent", fallback="").strip())
+    if cp.has_section("auth") and cp.get("auth", "cookie", fallback="").strip():
+        row(LEGACY).update(cookie=cp.get("auth", "cookie").strip(),
+                           user_agent=cp.get("auth", "user_agent", fallback="").strip())
+    for s, label in items("auth.labels"):
+        row(s)["label"] = label
+    for s, rec in items("notify.sources"):
+        row(s)["recipients"] = rec
+    rooms = [{"room": r, "recipients": rec} for r, rec in items("notify.rooms")]
+    return {"sources": list(sources.values()), "rooms": rooms}
+
+
+def migrate_from_config(config_file=None):
+    """把 config.ini 中的 source/Cookie/收件人迁入注册表，并从 config.ini 移除这些段。
+
+    先备份 config.ini（config.ini.bak-时间戳）。已迁移过则不做任何事，返回 None。
+    """
+    import configparser
+    import config as config_mod
+
+    config_file = config_file or config_mod.CONFIG_FILE
+    power_db.init_db()
+    if is_active():
+        return None
+
+    cp = configparser.ConfigParser(inline_comment_prefixes=(";", "#"), interpolation=None)
+    cp.optionxform = str
+    cp.read(config_file, encoding="utf-8")
+    payload = _read_ini_registry(cp)
+
+    conn = _conn()
+    with conn:
+        counts = import_all(payload, conn=conn)
+
+    if os.path.exists(config_file):
+        backup = f"{config_file}.bak-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        shutil.copy2(config_file, backup)
+        for sec in list(cp.sections()):
+            if sec in _MOVED_SECTIONS or (sec.startswith("auth.") and sec != "auth."):
+                cp.remove_section(sec)
+        if cp.has_section("system"):
+            cp.remove_option("system", "auth_sources")
+        with open(config_file, "w", encoding="utf-8") as f:
+            cp.write(f)
+        logger.info(f"📦 已迁移 {counts[0]} 个 source、{counts[1]} 条房间收件人到注册表，原配置备份为 {backup}")
+    return {"sources": counts[0], "rooms": counts[1]}
+
+
+# ========== 命令行 ==========
+# 用法：
+#   python source_registry.py migrate
+#   python source_registry.py export [文件]
+#   python source_registry.py import 文件 [--replace]
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    cmd = args[0] if args else ""
+    power_db.init_db()
+    if cmd == "migrate":
+        result = migrate_from_config()
+        print("已迁移，无需重复执行" if result is None else f"迁移完成: {result}")
+    elif cmd == "export":
+        text = json.dumps(export_all(), ensure_ascii=False, indent=2)
+        if len(args) > 1:
+            with open(args[1], "w", encoding="utf-8") as f:
+                f.write(text + "\n")
+        else:
+            print(text)
+    elif cmd == "import" and len(args) > 1:
+        with open(args[1], "r", encoding="utf-8") as f:
+            data = json.load(f)
+        n_src, n_room = import_all(data, replace="--replace" in args)
+        print(f"已导入 {n_src} 个 source、{n_room} 条房间收件人")
+    else:
+        print(__doc__)
+        sys.exit(1)
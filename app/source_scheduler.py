@@ -0,0 +1,115 @@
+"""
+按 source 调度模块 - 每个 source 独立的下次运行时间、退避状态与抖动
+
+monitor_task 通过本模块决定"哪些 source 到点了"，
+某个 source 持续 502 时只会拉长它自己的轮询间隔，不会拖慢其他健康的 source。
+"""
+import heapq
+import random
+import threading
+import time
+
+
+# 网络/服务器类失败的退避节奏（秒），不会超过 interval
+BACKOFF_SCHEDULE = [60, 120, 300, 900]
+
+
+def backoff_seconds_for_failures(fails: int, cap: int) -> int:
+    """按连续失败次数返回下一次重试的等待秒数（不超过 cap）。"""
+    if fails <= 0:
+        return cap
+    idx = min(fails - 1, len(BACKOFF_SCHEDULE) - 1)
+    return min(BACKOFF_SCHEDULE[idx], cap)
+
+
+class SourceScheduler:
+    """基于最小堆的 source 调度器。
+
+    堆元素为 (next_run, seq, source)。同一 source 可能因重新调度在堆中留下旧条目，
+    以 self._next_run 中记录的时间为准，弹出时丢弃过期条目（惰性删除）。
+    """
+
+    def __init__(self, jitter_ratio=0.1, max_jitter=30.0):
+        self._heap = []
+        self._next_run = {}
+        self._active = set()
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self.jitter_ratio = jitter_ratio
+        self.max_jitter = max_jitter
+
+    def _push(self, source, when):
+        self._seq += 1
+        self._next_run[source] = when
+        heapq.heappush(self._heap, (when, self._seq, source))
+
+    def sync_sources(self, sources):
+        """与配置中的 sources 对齐：新增的立即到期，已移除的不再调度。返回被移除的 sources。"""
+        now = time.time()
+        wanted = set(sources)
+        removed = []
+        with self._lock:
+            for s in sources:
+                if s not in self._active:
+                    self._active.add(s)
+                    self._push(s, now)
+            for s in list(self._active):
+                if s not in wanted:
+                    self._active.discard(s)
+                    self._next_run.pop(s, None)
+                    removed.append(s)
+        return removed
+
+    def schedule(self, source, delay):
+        """在 delay 秒（加抖动）后再次运行该 source。返回实际等待秒数。"""
+        jitter = min(self.max_jitter, max(0.0, delay) * self.jitter_ratio)
+        actual = max(1.0, delay + random.uniform(-jitter, jitter))
+        with self._lock:
+            # 抓取期间被 request_now 重新排上的（如扫码刚更新 cookie），保留更早的那次
+            if source in self._active and source not in self._next_run:
+                self._push(source, time.time() + actual)
+        return actual
+
+    def request_now(self, source=None):
+        """让指定 source（None 表示全部）立即到期，并唤醒等待中的监控线程。"""
+        now = time.time()
+        with self._lock:
+            targets = [source] if source else list(self._active)
+            for s in targets:
+                if s in self._active:
+                    self._push(s, now)
+        self._wakeup.set()
+
+    def pop_due(self, now=None):
+        """弹出所有已到期的 source（按到期先后）。"""
+        if now is None:
+            now = time.time()
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                when, _seq, source = heapq.heappop(self._heap)
+                if self._next_run.get(source) != when:
+                    continue  # 已被重新调度或移除的旧条目
+                del self._next_run[source]
+                due.append(source)
+        return due
+
+    def seconds_until_next(self, default=60.0):
+        """距离最近一个 source 到期的秒数；堆为空时返回 default。"""
+        with self._lock:
+            while self._heap and self._next_run.get(self._heap[0][2]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            if not self._heap:
+                return default
+            return max(0.0, self._heap[0][0] - time.time())
+
+    def next_run_time(self, source):
+        """返回 source 的下次运行时间戳（未调度返回 None）。"""
+        with self._lock:
+            return self._next_run.get(source)
+
+    def wait(self, timeout):
+        """等待到 timeout 或被 request_now 唤醒。"""
+        self._wakeup.wait(timeout=timeout)
+        self._wakeup.clear()
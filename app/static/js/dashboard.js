@@ -2,6 +2,42 @@
 // 这样 Alpine.js 就不会去“监听”它的内部变化，避免了鼠标移动时的冲突
 let trendChartInstance = null;
 
+// /api/status 增量轮询：页面实际渲染的字段（rooms / source_status 只取用到的子字段）
+const STATUS_FIELDS = [
+  "is_monitoring", "has_cookie", "last_check_time", "next_check_in", "last_error", "interval",
+  "auth_sources", "auth_labels", "auth_configured",
+  "rooms.kwh", "rooms.money",
+  "source_status.has_cookie", "source_status.last_error", "source_status.last_ok_time",
+].join(",");
+// 房间卡片迷你走势图的点数（/api/sparklines?n=）
+const SPARKLINE_POINTS = 48;
+const STATUS_SCALAR_FIELDS = [
+  "is_monitoring", "has_cookie", "last_check_time", "next_check_in", "last_error", "interval",
+  "auth_sources", "auth_labels", "auth_configured",
+];
+
+// 按 key 合并增量列表：保持原有顺序，替换变化项、删除已移除项、新增项追加到末尾
+function mergeByKey(current, changed, removed, full, key) {
+  if (full) return changed || [];
+  changed = changed || [];
+  removed = removed || [];
+  if (!changed.length && !removed.length) return current;
+  const updates = new Map(changed.map((item) => [item[key], item]));
+  const gone = new Set(removed);
+  const out = [];
+  for (const item of current || []) {
+    if (gone.has(item[key])) continue;
+    if (updates.has(item[key])) {
+      out.push(updates.get(item[key]));
+      updates.delete(item[key]);
+    } else {
+      out.push(item);
+    }
+  }
+  for (const item of updates.values()) out.push(item);
+  return out;
+}
+
 function dashboard() {
   return {
     showPowerTrend: false,
@@ -114,6 +150,8 @@ function dashboard() {
     adminInputToken: "",
     newAdminToken: "",
     currentTime: "",
+    statusVersion: null,
+    sparklines: {},
 
     status: {
       is_monitoring: true,
@@ -440,26 +478,36 @@ function dashboard() {
 
     async loadStatus() {
       try {
-        const resp = await fetch("/api/status");
+        // 增量协议：只请求页面用到的字段，并带上次的 version，
+        // 服务端只返回之后变化的房间 / source 状态（配置字段也只在变化后返回）
+        const params = new URLSearchParams({ fields: STATUS_FIELDS });
+        if (this.statusVersion !== null) params.set("since", this.statusVersion);
+        const resp = await fetch(`/api/status?${params}`);
         const data = await resp.json();
         if (data.success) {
-            // 优化：不要整个替换 status，而是只更新需要的字段
+            // 优化：不要整个替换 status，而是只更新返回了的字段
             // 这可以减少房间列表（卡片）的 DOM 抖动
-            this.status.is_monitoring = data.is_monitoring;
-            this.status.has_cookie = data.has_cookie;
-            this.status.last_check_time = data.last_check_time;
-            this.status.next_check_in = data.next_check_in;
-            this.status.last_error = data.last_error;
-            
-            // 房间数据深度比较/替换（如果需要更细致的防抖动，可以在这里做）
-            this.status.rooms = data.rooms;
-            
-            // 其他配置
-            this.status.auth_sources = data.auth_sources;
-            this.status.auth_labels = data.auth_labels;
-            this.status.auth_configured = data.auth_configured;
-            this.status.source_status = data.source_status;
-            this.status.interval = data.interval;
+            for (const key of STATUS_SCALAR_FIELDS) {
+              if (key in data) this.status[key] = data[key];
+            }
+
+            // 房间：全量时直接替换；增量时按 room 合并，无变化时保持原数组不动
+            this.status.rooms = mergeByKey(
+              this.status.rooms, data.rooms, data.rooms_removed, data.full, "room"
+            );
+            if (data.full) {
+              this.status.source_status = data.source_status || {};
+            } else if (
+              Object.keys(data.source_status || {}).length ||
+              (data.source_status_removed || []).length
+            ) {
+              const next = { ...(this.status.source_status || {}), ...data.source_status };
+              for (const s of data.source_status_removed || []) delete next[s];
+              this.status.source_status = next;
+            }
+            this.statusVersion = data.version;
+            // 有新读数时刷新走势图（数据来自服务端内存，不查库）
+            if (data.full || (data.rooms && data.rooms.length)) this.loadSparklines();
 
           const list = this.getDisplayAuthSources();
           if (list.length && !list.includes(this.manualCookie.source)) {
@@ -471,6 +519,34 @@ function dashboard() {
       }
     },
 
+    async loadSparklines() {
+      try {
+        const resp = await fetch(`/api/sparklines?n=${SPARKLINE_POINTS}`);
+        const data = await resp.json();
+        if (data.success) this.sparklines = data.rooms || {};
+      } catch (e) {
+        console.error(e);
+      }
+    },
+
+    // 读数为数值（解析失败为 null），按学校页面的两位小数展示
+    formatReading(value) {
+      return value === null || value === undefined ? "-" : Number(value).toFixed(2);
+    },
+
+    // 迷你走势图：把最近的读数映射到 100x24 的 SVG 折线坐标
+    sparklinePoints(roomName) {
+      const series = this.sparklines[roomName];
+      if (!series || !series.v || series.v.length < 2) return "";
+      const v = series.v;
+      const min = Math.min(...v);
+      const span = Math.max(...v) - min || 1;
+      const step = 100 / (v.length - 1);
+      return v
+        .map((x, i) => `${(i * step).toFixed(1)},${(22 - ((x - min) / span) * 20).toFixed(1)}`)
+        .join(" ");
+    },
+
     async loadLoginState() {
       try {
         const resp = await fetch("/api/login-state");
@@ -0,0 +1,104 @@
+"""
+状态版本与增量 - 支持 /api/status?since=<version>&fields=... 只返回变化的部分
+
+- 房间（rooms）、source 状态（source_status）、耗尽预测（forecast）与配置派生字段（config）
+  按 key 记录"最后一次变化时的版本号"；监控线程每轮结束调用 publish()，
+  状态接口在请求时更新 config 段（配置文件可能被随时修改）。
+- 全局版本号只在有内容变化时递增，起始值取启动时的毫秒时间戳：服务重启后版本号不会倒退，
+  客户端带着旧版本号来时能判断出需要全量同步。
+- 被删除的 key 记录为墓碑（最多 MAX_TOMBSTONES 个），增量中以 *_removed 返回；
+  since 早于最旧的墓碑或大于当前版本（另一个进程实例的版本号）时返回全量（full=true）。
+"""
+import threading
+import time
+
+MAX_TOMBSTONES = 10000
+
+
+def _freeze(value):
+    """把 dict/list 转成可比较的不可变结构（用于判断内容是否变化）"""
+    if isinstance(value, dict):
+        return tuple((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+class StatusVersions:
+    def __init__(self):
+        self.version = int(time.time() * 1000)
+        self.floor = self.version       # 早于该版本的 since 无法给出完整增量
+        self._sections = {}             # section -> {key: (version, frozen)}
+        self._removed = {}              # section -> {key: version}
+        self._lock = threading.Lock()
+
+    def update(self, section, items):
+        """items: {key: 当前值}；有变化时递增版本号，返回当前版本号"""
+        frozen = {k: _freeze(v) for k, v in items.items()}
+        with self._lock:
+            known = self._sections.setdefault(section, {})
+            removed = self._removed.setdefault(section, {})
+            changed = [k for k, f in frozen.items() if k not in known or known[k][1] != f]
+            gone = [k for k in known if k not in frozen]
+            if not changed and not gone:
+                return self.version
+            self.version += 1
+            v = self.version
+            for k in changed:
+                known[k] = (v, frozen[k])
+                removed.pop(k, None)
+            for k in gone:
+                del known[k]
+                removed[k] = v
+            if len(removed) > MAX_TOMBSTONES:
+                # 丢弃最旧的一半墓碑，并把可增量同步的起点推到被丢弃的最新版本之后
+                cut = sorted(removed.values())[len(removed) // 2]
+                for k in [k for k, rv in removed.items() if rv <= cut]:
+                    del removed[k]
+                self.floor = max(self.floor, cut)
+            return v
+
+    def valid_since(self, since):
+        return since is not None and self.floor <= since <= self.version
+
+    def changed_since(self, section, since):
+        """返回 (since 之后变化的 key 集合, since 之后删除的 key 列表)"""
+        with self._lock:
+            known = self._sections.get(section, {})
+            removed = self._removed.get(section, {})
+            changed = {k for k, (v, _f) in known.items() if v > since}
+            gone = [k for k, v in removed.items() if v > since]
+        return changed, gone
+
+
+versions = StatusVersions()
+
+
+def publish(system_status, forecast_snapshot):
+    """监控线程每轮结束调用：记录房间 / source 状态 / 预测的变化"""
+    versions.update("rooms", {r.room: r.key() for r in system_status.get("last_check_data") or []})
+    versions.update("source_status", dict(system_status.get("sources") or {}))
+    versions.update("forecast", forecast_snapshot.get("rooms") or {})
+
+
+def parse_fields(text):
+    """'rooms.kwh,rooms.money,last_error' -> ({顶层字段}, {顶层字段: {子字段}})；为空返回 (None, {})"""
+    if not text:
+        return None, {}
+    top, sub = set(), {}
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, child = part.partition(".")
+        top.add(name)
+        if child:
+            sub.setdefault(name, set()).add(child)
+    return top, sub
+
+
+def project(item, keep, key_field=None):
+    """只保留 keep 中的子字段（key_field 始终保留，用于客户端按 key 合并）"""
+    if not keep or not isinstance(item, dict):
+        return item
+    return {k: v for k, v in item.items() if k in keep or k == key_field}
@@ -0,0 +1,181 @@
+"""
+监控轮次追踪模块 - 记录每轮 monitor 各阶段耗时（span），并支持按需 cProfile
+
+- span：fetch / parse / enrich / db_write / merge / alert / forecast / email ...
+  只在监控线程的一轮内记录（线程局部），轮次外调用是空操作，开销极低。
+- 最近 N 轮保存在内存环形缓冲区（[system] trace_cycles，默认 50）。
+- profiler：管理员请求后对接下来 K 轮启用 cProfile，结束后生成可下载的 .prof 文件。
+"""
+import collections
+import cProfile
+import io
+import os
+import pstats
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+_local = threading.local()
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("_cycle", "_name", "_source", "_t0")
+
+    def __init__(self, cycle, name, source):
+        self._cycle = cycle
+        self._name = name
+        self._source = source
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        t1 = time.perf_counter()
+        self._cycle["spans"].append((self._name, self._source, self._t0, t1 - self._t0))
+        return False
+
+
+def span(name, source=None):
+    """with tracing.span("fetch", source=s): ...（不在监控轮次内时为空操作）"""
+    cycle = getattr(_local, "cycle", None)
+    if cycle is None:
+        return _NULL_SPAN
+    return _Span(cycle, name, source)
+
+
+class CycleTracer:
+    """保存最近 N 轮的 span 记录"""
+
+    def __init__(self, maxlen=50):
+        self._cycles = collections.deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+        self._seq = 0
+
+    def resize(self, maxlen):
+        maxlen = max(1, int(maxlen))
+        if maxlen != self._cycles.maxlen:
+            with self._lock:
+                self._cycles = collections.deque(self._cycles, maxlen=maxlen)
+
+    def begin(self):
+        _local.cycle = {"t0": time.perf_counter(), "started": datetime.now(), "spans": []}
+
+    def end(self, **info):
+        cycle = getattr(_local, "cycle", None)
+        _local.cycle = None
+        if cycle is None:
+            return None
+        t0 = cycle["t0"]
+        totals = collections.defaultdict(float)
+        spans = []
+        # 嵌套 span 按结束顺序追加，这里按开始时间重新排序
+        for name, source, start, dur in sorted(cycle["spans"], key=lambda sp: sp[2]):
+            totals[name] += dur
+            item = {"name": name, "start_ms": round((start - t0) * 1e3, 3), "duration_ms": round(dur * 1e3, 3)}
+            if source:
+                item["source"] = source
+            spans.append(item)
+        with self._lock:
+            self._seq += 1
+            record = {
+                "cycle": self._seq,
+                "started": cycle["started"].strftime("%Y-%m-%d %H:%M:%S"),
+                "duration_ms": round((time.perf_counter() - t0) * 1e3, 3),
+                "totals_ms": {k: round(v * 1e3, 3) for k, v in totals.items()},
+                "spans": spans,
+            }
+            record.update(info)
+            self._cycles.append(record)
+        return record
+
+    def recent(self, limit=None, with_spans=True):
+        with self._lock:
+            items = list(self._cycles)
+        if limit:
+            items = items[-int(limit):]
+        if not with_spans:
+            items = [{k: v for k, v in c.items() if k != "spans"} for c in items]
+        return items
+
+
+class CycleProfiler:
+    """对接下来 K 轮监控启用 cProfile，结束后保存 pstats 文件"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._profile = None
+        self._remaining = 0
+        self._requested = 0
+        self._started = None
+        self.last_file = None
+        self.last_info = None
+
+    def request(self, cycles):
+        with self._lock:
+            if self._remaining > 0:
+                return False
+            self._remaining = self._requested = max(1, int(cycles))
+            self._profile = cProfile.Profile()
+            self._started = datetime.now()
+            return True
+
+    def status(self):
+        with self._lock:
+            return {
+                "running": self._remaining > 0,
+                "requested_cycles": self._requested,
+                "remaining_cycles": self._remaining,
+                "last": self.last_info,
+            }
+
+    def begin(self):
+        prof = self._profile if self._remaining > 0 else None
+        if prof is not None:
+            prof.enable()
+        return prof
+
+    def end(self, prof):
+        if prof is None:
+            return
+        prof.disable()
+        with self._lock:
+            self._remaining -= 1
+            if self._remaining > 0:
+                return
+            self._profile = None
+            fd, path = tempfile.mkstemp(prefix="dorm_monitor_", suffix=".prof")
+            os.close(fd)
+            prof.dump_stats(path)
+            if self.last_file and os.path.exists(self.last_file):
+                try:
+                    os.remove(self.last_file)
+                except OSError:
+                    pass
+            out = io.StringIO()
+            pstats.Stats(prof, stream=out).sort_stats("cumulative").print_stats(15)
+            self.last_file = path
+            self.last_info = {
+                "cycles": self._requested,
+                "started": self._started.strftime("%Y-%m-%d %H:%M:%S"),
+                "finished": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "summary": out.getvalue(),
+            }
+
+
+tracer = CycleTracer()
+profiler = CycleProfiler()
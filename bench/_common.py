@@ -0,0 +1,58 @@
+"""
+基准测试公共工具：把 app/ 加入 sys.path，并把配置文件/数据库指向临时目录，
+保证基准测试离线运行、不改动项目中的 config.ini 与 power.db。
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+TMP_DIR = tempfile.mkdtemp(prefix="dorm_bench_")
+
+import config  # noqa: E402
+import power_db  # noqa: E402
+
+config.CONFIG_FILE = os.path.join(TMP_DIR, "config.ini")
+power_db.DB_PATH = os.path.join(TMP_DIR, "power.db")
+
+
+def reset_db():
+    """删除临时数据库（含 WAL 文件）与月份分区目录"""
+    import power_partitions
+    for path in (power_db.DB_PATH, power_db.DB_PATH + "-wal", power_db.DB_PATH + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+    shutil.rmtree(power_partitions.partition_dir(), ignore_errors=True)
+
+
+def write_config(text):
+    with open(config.CONFIG_FILE, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def timed(fn, *args, repeat=1, **kwargs):
+    """运行 fn repeat 次，返回 (最快一次秒数, 最后一次返回值)"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn(*args, **kwargs)
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best, result
+
+
+def rss_mb():
+    """当前常驻内存（MB）；非 Linux 退回到峰值 RSS"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except Exception:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
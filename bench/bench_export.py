@@ -0,0 +1,73 @@
+"""
+历史数据流式导出基准：合成 N 行读数，测量各导出格式的行/秒与导出期间的峰值内存增量，
+并与一次性读入内存的查询（query_readings）对比。
+
+用法：python bench/bench_export.py [--rows 1000000] [--chunk 5000]
+"""
+import argparse
+import time
+
+from _common import rss_mb
+import power_db
+import power_archive
+import power_export
+
+
+def populate(n_rows, rooms=2000):
+    """按区间表写入合成数据：一半区间 samples > 1，视图展开后约 1.5 * n_rows 个数据点"""
+    power_db.init_db()
+    conn = power_db.get_db()
+
+    def rows():
+        for i in range(n_rows):
+            day = f"2026-{1 + (i // 200000) % 12:02d}-{1 + (i // 8000) % 28:02d}"
+            yield ("src%d" % (i % 20), "%d-%d空调" % (i % rooms // 100, i % rooms), day, "08:00:00",
+                   day, "08:45:00", round(200 - (i % 9000) * 0.02, 2), 1 + i % 2)
+    conn.executemany('''
+        INSERT INTO power_log_interval (source, room, start_date, start_time, end_date, end_time, remain_power, samples)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows())
+    conn.commit()
+    conn.close()
+
+
+def run_export(fmt, compress, chunk):
+    base = rss_mb()
+    peak = base
+    size = 0
+    t0 = time.perf_counter()
+    for piece in power_export.stream_export("readings", fmt, compress=compress, include_archive=False, chunk=chunk):
+        size += len(piece)
+        peak = max(peak, rss_mb())
+    return time.perf_counter() - t0, size, peak - base
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=1000000, help="区间表行数")
+    ap.add_argument("--chunk", type=int, default=power_export.DEFAULT_CHUNK_ROWS)
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    populate(args.rows)
+    conn = power_db.get_db()
+    points = conn.execute("SELECT COUNT(*) FROM power_log_view").fetchone()[0]
+    conn.close()
+    print(f"数据准备: {args.rows} 个区间 -> {points} 个数据点, 用时 {time.perf_counter() - t0:.1f}s")
+
+    print(f"{'模式':<16}{'用时':>9}{'行/秒':>12}{'输出':>10}{'峰值内存增量':>14}")
+    for fmt, compress in (("csv", False), ("ndjson", False), ("csv", True), ("ndjson", True)):
+        dt, size, grow = run_export(fmt, compress, args.chunk)
+        name = fmt + ("+gzip" if compress else "")
+        print(f"{name:<16}{dt:>8.2f}s{points / dt:>12,.0f}{size / 1e6:>8.1f}MB{grow:>12.1f}MB")
+
+    # 对照：一次性把结果读入内存（与 /api/room_power_trend 使用的 query_readings 相同方式）
+    base = rss_mb()
+    t0 = time.perf_counter()
+    rows = power_archive.query_readings("2000-01-01", "2999-12-31")
+    dt = time.perf_counter() - t0
+    print(f"{'一次性读入':<16}{dt:>8.2f}s{len(rows) / dt:>12,.0f}{'-':>10}{rss_mb() - base:>12.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
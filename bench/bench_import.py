@@ -0,0 +1,57 @@
+"""
+历史读数批量导入基准：生成 N 行 CSV / NDJSON，测量导入空库、在已有数据上重复导入（全部去重）的行/秒。
+
+用法：python bench/bench_import.py [--rows 500000] [--batch 50000]
+"""
+import argparse
+import gzip
+import io
+import json
+
+from _common import timed, reset_db
+import power_db
+import power_import
+
+
+def make_rows(n, rooms=2000):
+    for i in range(n):
+        day = f"2026-{1 + (i // 100000) % 12:02d}-{1 + (i // rooms) % 28:02d}"
+        yield (f"src{i % 20}", f"{i % rooms // 100}-{i % rooms}空调", day,
+               f"{(i // (rooms * 28)) % 24:02d}:{(i // 7) % 60:02d}:00", round(200 - (i % 9000) * 0.02, 2))
+
+
+def make_csv(n):
+    lines = ["source,room,date,time,remain_power"]
+    lines.extend("%s,%s,%s,%s,%s" % r for r in make_rows(n))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def make_ndjson(n):
+    keys = ("source", "room", "date", "time", "remain_power")
+    return "".join(json.dumps(dict(zip(keys, r)), ensure_ascii=False) + "\n" for r in make_rows(n)).encode("utf-8")
+
+
+def fresh_db():
+    reset_db()
+    power_db.init_db()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=500000)
+    ap.add_argument("--batch", type=int, default=power_import.DEFAULT_BATCH_ROWS)
+    args = ap.parse_args()
+
+    payloads = {"csv": make_csv(args.rows), "ndjson": make_ndjson(args.rows)}
+    payloads["csv+gzip"] = gzip.compress(payloads["csv"], 6)
+
+    print(f"{'模式':<22}{'用时':>9}{'行/秒':>12}{'写入':>10}{'重复':>10}")
+    for name, data in payloads.items():
+        fresh_db()
+        for label in ("空库", "重复导入"):
+            dt, r = timed(power_import.import_readings, io.BytesIO(data), batch_rows=args.batch)
+            print(f"{name + ' ' + label:<22}{dt:>8.2f}s{args.rows / dt:>12,.0f}{r['inserted']:>10}{r['duplicates']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+读数模型基准：1 万个房间（默认 50 个 source x 200 房间），对比旧的 dict + 字符串读数与 Reading 模型。
+
+一轮流程按监控线程的顺序模拟：页面文本 -> 解析 -> 补 source/分类 -> 合并 -> 告警/入库/走势取 float；
+/api/status 全量序列化单独计时（按请求发生，增量同步下很少走全量）。
+旧实现（dict、enrich 时复制、合并时每个房间新建 dict、下游各自 float()/正则）在本脚本中内联复现；
+页面 HTML 解析（BeautifulSoup）两边相同，不计入。
+
+内存：tracemalloc 统计一轮结束、页面文本释放后仍被 latest_by_source + merged 持有的字节数（含房间名字符串）。
+
+用法：python bench/bench_reading_model.py [--sources 50] [--rooms 200] [--repeat 5]
+"""
+import argparse
+import gc
+import json
+import random
+import re
+import time
+import tracemalloc
+
+from _common import write_config
+import config
+import meter_rules
+import monitor
+from reading import Reading
+
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+def make_pages(n_sources, rooms):
+    """每个 source 一页 (room, kwh 文本, money 文本)；每轮重新生成字符串，模拟重新解析页面"""
+    pages = []
+    for s in range(n_sources):
+        rows = []
+        for r in range(rooms):
+            kwh = random.uniform(0, 200)
+            rows.append((f"{s}-{700 + r}{'照明' if r % 2 else '空调'}", f"{kwh:.2f}", f"{kwh * 0.6:.2f}"))
+        pages.append((f"src{s:03d}", rows))
+    return pages
+
+
+def fresh_text(pages):
+    # 拷贝出新的字符串对象（与每轮 BeautifulSoup 产出的新 str 一致）
+    return [(s, [("".join(room), "".join(k), "".join(m)) for room, k, m in rows]) for s, rows in pages]
+
+
+# ---------- 旧实现：dict + 字符串读数 ----------
+
+def _legacy_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        m = _NUMBER.search(str(value or ""))
+        return float(m.group(0)) if m else None
+
+
+def _legacy_merge(all_lists):
+    merged = {}
+    for items in all_lists:
+        for d in items or []:
+            room = str(d.get("room") or "")
+            if not room:
+                continue
+            if room not in merged:
+                merged[room] = {"room": room, "kwh": d.get("kwh", "0"), "money": d.get("money", "0"),
+                                "meter_type": d.get("meter_type", "unknown"), "sources": []}
+            src = d.get("source")
+            if src and src not in merged[room]["sources"]:
+                merged[room]["sources"].append(src)
+            if merged[room]["meter_type"] in ("unknown", "ac") and d.get("meter_type") not in (None, "unknown"):
+                merged[room]["meter_type"] = d.get("meter_type")
+            merged[room]["kwh"] = d.get("kwh", merged[room]["kwh"])
+            merged[room]["money"] = d.get("money", merged[room]["money"])
+    return list(merged.values())
+
+
+def legacy_cycle(pages, classify):
+    latest = {}
+    for s, rows in pages:
+        data = [{"room": room, "kwh": k, "money": m} for room, k, m in rows]
+        enriched = []
+        for d in data:
+            d2 = dict(d)
+            d2["source"] = s
+            d2["meter_type"] = classify(d.get("room"))
+            enriched.append(d2)
+        latest[s] = enriched
+        [(str(d.get("room")), _legacy_float(d.get("kwh"))) for d in enriched]        # 入库
+    merged = _legacy_merge(latest.values())
+    [_legacy_float(d.get("kwh")) for d in merged]                                     # 告警
+    [_legacy_float(d.get("kwh")) for d in merged]                                     # 预测 / 走势
+    return latest, merged
+
+
+# ---------- Reading ----------
+
+def reading_cycle(pages, classify):
+    latest = {}
+    for s, rows in pages:
+        data = [Reading.parse(room, k, m) for room, k, m in rows]
+        for r in data:
+            r.tag(s, classify(r.room))
+        latest[s] = data
+        [(r.room, r.kwh) for r in data if r.kwh is not None]                          # 入库
+    merged = monitor.merge_room_data(latest.values())
+    [r.kwh for r in merged]                                                           # 告警
+    [r.kwh for r in merged]                                                           # 预测 / 走势
+    return latest, merged
+
+
+def legacy_serialize(merged):
+    return json.dumps(merged, ensure_ascii=False)
+
+
+def reading_serialize(merged):
+    return json.dumps([r.to_dict() for r in merged], ensure_ascii=False)
+
+
+def measure(cycle, serialize, pages, classify, repeat):
+    best = best_json = None
+    for _ in range(repeat):
+        text = fresh_text(pages)
+        gc.collect()
+        t0 = time.perf_counter()
+        _latest, merged = cycle(text, classify)
+        t1 = time.perf_counter()
+        serialize(merged)
+        t2 = time.perf_counter()
+        best = t1 - t0 if best is None else min(best, t1 - t0)
+        best_json = t2 - t1 if best_json is None else min(best_json, t2 - t1)
+
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    text = fresh_text(pages)
+    state = cycle(text, classify)
+    del text
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0] - base
+    del state
+    tracemalloc.stop()
+    return best, best_json, held
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sources", type=int, default=50)
+    ap.add_argument("--rooms", type=int, default=200, help="每个 source 的房间数")
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    random.seed(1)
+    pages = make_pages(args.sources, args.rooms)
+    write_config("[system]\ninterval = 900\n")
+    classify = meter_rules.classifier_for(config.Config()).classify
+    n = args.sources * args.rooms
+    print(f"{n} 个房间（{args.sources} source x {args.rooms}），每项取 {args.repeat} 轮最快\n")
+    print(f"{'模型':<10}{'采集一轮':>12}{'全量序列化':>14}{'常驻内存':>14}{'每房间':>10}")
+    results = {}
+    for name, cycle, serialize in (("dict", legacy_cycle, legacy_serialize),
+                                   ("Reading", reading_cycle, reading_serialize)):
+        secs, json_secs, held = measure(cycle, serialize, pages, classify, args.repeat)
+        results[name] = (secs, json_secs, held)
+        print(f"{name:<10}{secs * 1000:>10.1f}ms{json_secs * 1000:>12.1f}ms"
+              f"{held / 1024 / 1024:>12.2f}MB{held / n:>8.0f}B")
+    (t0, j0, m0), (t1, j1, m1) = results["dict"], results["Reading"]
+    print(f"\nReading / dict: 采集 {t1 / t0:.2f}x, 序列化 {j1 / j0:.2f}x, 内存 {m1 / m0:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
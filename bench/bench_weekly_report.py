@@ -0,0 +1,99 @@
+"""
+周报生成基准：500 个合成 source，对比逐 source 查询（旧实现）与集合化聚合查询，
+并对比串行与线程池投递（用 sleep 模拟 SMTP 会话耗时，不真正发信）。
+
+用法：python bench/bench_weekly_report.py [--sources 500] [--smtp-latency 0.05]
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from _common import write_config, timed
+import config
+import power_db
+import power_tasks
+
+
+def populate(n_sources, rooms_per_source=4, days=14):
+    power_db.init_db()
+    conn = power_db.get_db()
+    today = datetime.now().date()
+    daily, intervals = [], []
+    for i in range(n_sources):
+        source = f"src{i:04d}"
+        for r in range(rooms_per_source):
+            room = f"{i}-{r}"
+            remain = 200.0
+            for d in range(days, 0, -1):
+                day = (today - timedelta(days=d)).strftime("%Y-%m-%d")
+                used = random.uniform(1, 10)
+                daily.append((source, day, used))
+                for h in (0, 6, 12, 18):
+                    remain -= used / 4
+                    intervals.append((source, room, day, f"{h:02d}:00:00", day, f"{h:02d}:59:00", round(remain, 2), 4))
+    conn.executemany("INSERT INTO power_daily (source, date, consume_power) VALUES (?, ?, ?)", daily)
+    conn.executemany('''
+        INSERT INTO power_log_interval (source, room, start_date, start_time, end_date, end_time, remain_power, samples)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', intervals)
+    conn.commit()
+    conn.close()
+    lines = "\n".join(f"src{i:04d} = u{i}@example.com" for i in range(n_sources))
+    write_config(f"[system]\nweekly_report_workers = 8\n[notify.sources]\n{lines}\n")
+
+
+def legacy_build(conn, cfg):
+    """旧实现的查询/渲染方式：每个 source 两次查询 + 逐个查收件人"""
+    today = datetime.now().date()
+    week_start = today - timedelta(days=today.weekday() + 7)
+    week_end = week_start + timedelta(days=6)
+    week_dates = [(week_start + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(7)]
+    out = []
+    for source in set(r['source'] for r in conn.execute('SELECT DISTINCT source FROM power_daily')):
+        rows = conn.execute('''
+            SELECT date, consume_power FROM power_daily
+            WHERE source=? AND date BETWEEN ? AND ? ORDER BY date
+        ''', (source, week_start.strftime('%Y-%m-%d'), week_end.strftime('%Y-%m-%d'))).fetchall()
+        daily = {r['date']: r['consume_power'] for r in rows}
+        last = conn.execute('''
+            SELECT remain_power FROM power_log_view WHERE source=?
+            ORDER BY date DESC, time DESC LIMIT 1
+        ''', (source,)).fetchone()
+        values = [daily.get(d, 0) for d in week_dates]
+        out.append((source, sum(values), last['remain_power'] if last else None, cfg.get_source_recipients(source)))
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sources", type=int, default=500)
+    ap.add_argument("--smtp-latency", type=float, default=0.05)
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    populate(args.sources)
+    print(f"数据准备: {args.sources} sources, 用时 {time.perf_counter() - t0:.2f}s")
+
+    cfg = config.Config()
+    conn = power_db.get_db()
+    t_legacy, legacy = timed(legacy_build, conn, cfg)
+    t_bulk, reports = timed(power_tasks.build_weekly_reports, conn, cfg)
+    conn.close()
+    print(f"逐 source 查询（旧）: {t_legacy:.3f}s  ({len(legacy)} 份)")
+    print(f"集合化聚合（新）    : {t_bulk:.3f}s  ({len(reports)} 份)  加速 {t_legacy / max(t_bulk, 1e-9):.1f}x")
+
+    t_dry, _ = timed(power_tasks.send_weekly_report, dry_run=True)
+    print(f"dry-run 全流程      : {t_dry:.3f}s")
+
+    # 用 sleep 模拟 SMTP 会话
+    config.Config.send_email = lambda self, *a, **k: time.sleep(args.smtp_latency)
+    sample = reports[:100]
+    t_serial, _ = timed(lambda: [power_tasks._deliver_report(r) for r in sample])
+    t_pool, _ = timed(power_tasks.send_weekly_report)
+    print(f"串行投递 100 份      : {t_serial:.2f}s （外推 {len(reports)} 份约 {t_serial * len(reports) / 100:.1f}s）")
+    print(f"线程池投递 {len(reports)} 份   : {t_pool:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+monitor_task 规模压测：对本地替身服务器跑完整的监控轮次（抓取、解析、入库、合并、告警、预测），
+随 source 数量增长报告每轮耗时、单 source 抓取延迟分位数与进程内存。
+
+用法：
+    python bench/load_monitor.py --sources 10,100,500,1000 --rooms 4 --cycles 3 --latency-ms 20 --p502 0.01
+    python bench/load_monitor.py --url http://127.0.0.1:18080/zhyd/sydl/index   # 使用已启动的替身服务器
+    python bench/load_monitor.py --sources 500 --shards 1,2,4   # 对比单线程与多进程分片（monitor_shards）
+    python bench/load_monitor.py --sources 500 --update-seconds 3600 [--etag]   # 页面不变：指纹/304 短路
+
+分片模式下抓取在工作进程内进行，不统计单 source 抓取延迟分位数；每轮耗时为
+从触发全部 source 到最后一个结果写入完成的时间（不含工作进程启动的预热轮）。
+
+不会访问学校真实系统，也不会发送邮件（临时配置中未配置任何收件人）。
+"""
+import argparse
+import logging
+import time
+
+from _common import write_config, rss_mb, reset_db, TMP_DIR
+import page_cache
+import power_db
+import zhyd_standin
+
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    k = (len(values) - 1) * p
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def write_load_config(n_sources, url):
+    sources = [f"src{i}" for i in range(n_sources)]
+    auth = "\n".join(f"[auth.{s}]\ncookie = JSESSIONID={s}\nuser_agent = load-test\n" for s in sources)
+    write_config(
+        "[system]\n"
+        "interval = 900\n"
+        f"target_url = {url}\n"
+        f"auth_sources = {','.join(sources)}\n"
+        "school_rate_limit_per_second = 0\n"
+        "breaker_failure_threshold = 1000000\n"
+        "low_power_threshold = 15\n"
+        "forecast_alert_days = 0\n"
+        f"{auth}"
+    )
+    return sources
+
+
+def run_scale(n_sources, cycles, url):
+    import config
+    import monitor
+    import power_ingest
+
+    reset_db()
+    power_db.init_db()
+    power_ingest.reset_cache()
+    page_cache.forget()
+    hits0 = page_cache.PAGE_CACHE_HIT.value
+    monitor.system_status["sources"] = {}
+
+    sources = write_load_config(n_sources, url)
+    latencies = []
+    real_fetch = monitor.fetch_data
+
+    def timed_fetch(cookie, ua, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return real_fetch(cookie, ua, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - t0)
+
+    monitor.fetch_data = timed_fetch
+    state = monitor.MonitorState()
+    cycle_times = []
+    try:
+        for _ in range(cycles):
+            cfg = config.Config()
+            monitor.configure_target(cfg)
+            monitor.endpoint_guard.configure(cfg)
+            t0 = time.perf_counter()
+            merged = monitor.run_cycle(cfg, sources, sources, state)
+            cycle_times.append(time.perf_counter() - t0)
+    finally:
+        monitor.fetch_data = real_fetch
+
+    ok = sum(1 for s in sources if monitor.system_status["sources"].get(s, {}).get("last_ok_time"))
+    return {
+        "sources": n_sources,
+        "rooms": len(merged),
+        "ok_sources": ok,
+        "cycle_avg": sum(cycle_times) / len(cycle_times),
+        "cycle_max": max(cycle_times),
+        "p50": percentile(latencies, 0.50),
+        "p90": percentile(latencies, 0.90),
+        "p99": percentile(latencies, 0.99),
+        "rss_mb": rss_mb(),
+        "page_hits": page_cache.PAGE_CACHE_HIT.value - hits0,
+    }
+
+
+def run_scale_sharded(n_sources, cycles, url, shards):
+    import config
+    import monitor
+    import monitor_shards
+    import power_ingest
+
+    reset_db()
+    power_db.init_db()
+    power_ingest.reset_cache()
+    page_cache.forget()
+    hits0 = page_cache.PAGE_CACHE_HIT.value
+    monitor.system_status["sources"] = {}
+
+    sources = write_load_config(n_sources, url)
+    cfg = config.Config()
+    state = monitor.MonitorState()
+    pool = monitor_shards.ShardPool()
+    cycle_times = []
+    merged = []
+    try:
+        pool.resize(shards)
+        pool.assign(sources, state)
+        for c in range(cycles + 1):
+            if c:
+                pool.request_now()
+            t0 = time.perf_counter()
+            got = set()
+            while len(got) < n_sources:
+                results, entries = pool.collect(timeout=120)
+                if not results:
+                    raise RuntimeError(f"分片结果超时：{len(got)}/{n_sources}")
+                state.merge_cooldowns(entries)
+                merged = monitor.run_cycle(cfg, sources, [r["source"] for r in results], state, results=results)
+                got.update(r["source"] for r in results)
+            if c:
+                cycle_times.append(time.perf_counter() - t0)
+    finally:
+        pool.close()
+
+    ok = sum(1 for s in sources if monitor.system_status["sources"].get(s, {}).get("last_ok_time"))
+    nan = float("nan")
+    return {
+        "sources": n_sources,
+        "rooms": len(merged),
+        "ok_sources": ok,
+        "cycle_avg": sum(cycle_times) / len(cycle_times),
+        "cycle_max": max(cycle_times),
+        "p50": nan, "p90": nan, "p99": nan,
+        "rss_mb": rss_mb(),
+        "page_hits": page_cache.PAGE_CACHE_HIT.value - hits0,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sources", default="10,100,500", help="逗号分隔的 source 数量序列")
+    ap.add_argument("--rooms", type=int, default=4)
+    ap.add_argument("--cycles", type=int, default=3)
+    ap.add_argument("--shards", default="1", help="逗号分隔的分片数序列；1 为单线程 run_cycle")
+    ap.add_argument("--url", default="", help="使用已运行的替身服务器；为空则在进程内启动")
+    ap.add_argument("--latency-ms", type=float, default=0.0)
+    ap.add_argument("--jitter-ms", type=float, default=0.0)
+    ap.add_argument("--p502", type=float, default=0.0)
+    ap.add_argument("--p-redirect", type=float, default=0.0)
+    ap.add_argument("--p-auth-page", type=float, default=0.0)
+    ap.add_argument("--update-seconds", type=float, default=0.0, help="替身页面读数每 N 秒变化一次")
+    ap.add_argument("--etag", action="store_true", help="替身服务器返回 ETag / 304")
+    ap.add_argument("--verbose", action="store_true", help="保留监控 INFO 日志")
+    args = ap.parse_args()
+
+    if not args.verbose:
+        logging.getLogger("System").setLevel(logging.WARNING)
+
+    counts = [int(x) for x in args.sources.split(",") if x.strip()]
+    url = args.url
+    server = None
+    if not url:
+        state = zhyd_standin.StandinState(max(counts), args.rooms, args.latency_ms, args.jitter_ms,
+                                          args.p502, args.p_redirect, args.p_auth_page,
+                                          update_seconds=args.update_seconds, etag=args.etag)
+        server, url = zhyd_standin.start_server(state)
+    print(f"target: {url}")
+    shard_counts = [int(x) for x in args.shards.split(",") if x.strip()]
+    print(f"{'shards':>7}{'sources':>8}{'rooms':>8}{'ok':>7}{'cycle avg':>12}{'cycle max':>12}"
+          f"{'p50':>9}{'p90':>9}{'p99':>9}{'rss':>10}{'page hit':>10}")
+    try:
+        for shards in shard_counts:
+            for n in counts:
+                if shards >= 2:
+                    r = run_scale_sharded(n, args.cycles, url, shards)
+                else:
+                    r = run_scale(n, args.cycles, url)
+                print(f"{shards:>7}{r['sources']:>8}{r['rooms']:>8}{r['ok_sources']:>7}"
+                      f"{r['cycle_avg']:>11.2f}s{r['cycle_max']:>11.2f}s"
+                      f"{r['p50'] * 1e3:>7.1f}ms{r['p90'] * 1e3:>7.1f}ms{r['p99'] * 1e3:>7.1f}ms"
+                      f"{r['rss_mb']:>8.1f}MB{r['page_hits']:>10.0f}")
+    finally:
+        if server:
+            server.shutdown()
+        import shutil
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,447 @@
+"""
+采集热路径微基准套件（离线运行，不访问学校服务器、不发邮件）。
+
+用法：
+    python bench/run_benchmarks.py                 运行并与 baseline.json 对比，超出容差则退出码为 1
+    python bench/run_benchmarks.py --record        运行并把结果写入 baseline.json
+    python bench/run_benchmarks.py -k parse        只运行名称包含 parse 的基准
+    python bench/run_benchmarks.py --tolerance 0.5 允许比基线慢 50%
+
+每个基准记录"单次操作耗时"（多轮取最快一轮），基线与机器相关，换机器后请重新 --record。
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+from _common import write_config, reset_db, TMP_DIR
+import power_db
+from reading import Reading
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+BENCHMARKS = []
+
+
+def bench(name, number=1, repeat=5):
+    """注册基准。被装饰函数做准备工作并返回要计时的无参函数。"""
+    def deco(setup):
+        BENCHMARKS.append((name, setup, number, repeat))
+        return setup
+    return deco
+
+
+# ---------- 合成数据 ----------
+
+CONFIG_TEXT = """[system]
+interval = 900
+low_power_threshold = 15
+auth_sources = {sources}
+
+[meters]
+lighting_keywords = 照明
+ac_a_keywords = 3-721A空调
+ac_b_keywords = 3-721B空调
+
+[notify]
+to = admin@example.com
+
+[notify.rooms]
+{rooms}
+
+[notify.sources]
+{source_recipients}
+"""
+
+
+def make_config(n_sources=50, n_room_mappings=200):
+    sources = [f"x{i}-{100 + i}a" for i in range(n_sources)]
+    rooms = "\n".join(f"{i // 10}-{700 + i}A空调 = r{i}@example.com" for i in range(n_room_mappings))
+    src_rec = "\n".join(f"{s} = {s}@example.com" for s in sources)
+    write_config(CONFIG_TEXT.format(sources=",".join(sources), rooms=rooms, source_recipients=src_rec))
+    return sources
+
+
+def make_page(n_cards):
+    """生成与学校 sydl/index 页面结构一致的 mui-card 页面"""
+    cards = []
+    kinds = ["照明", "3-721A空调", "3-721B空调", "空调"]
+    for i in range(n_cards):
+        room = f"{i // 4}-{700 + i}{kinds[i % 4]}"
+        cards.append(
+            '<div class="mui-card"><div class="mui-card-content"><ul class="mui-table-view">'
+            f'<li class="mui-table-view-cell">绑定房间：<span class="mui-pull-right">{room}</span></li>'
+            f'<li class="mui-table-view-cell">剩余电量：<span class="mui-pull-right">{random.uniform(0, 200):.2f}</span></li>'
+            f'<li class="mui-table-view-cell">剩余金额：<span class="mui-pull-right">{random.uniform(0, 100):.2f}</span></li>'
+            '</ul></div></div>'
+        )
+    return (
+        '<!DOCTYPE html><html><head><meta charset="utf-8"><title>剩余电量</title></head>'
+        '<body><header class="mui-bar"><h1 class="mui-title">剩余电量</h1></header>'
+        f'<div class="mui-content">{"".join(cards)}</div></body></html>'
+    )
+
+
+def make_source_lists(n_sources, rooms_per_source, overlap=0.1):
+    import monitor
+    lists = []
+    for s in range(n_sources):
+        items = []
+        for r in range(rooms_per_source):
+            # 少量房间在多个 source 间重复，覆盖去重分支
+            rid = r if random.random() < overlap else s * rooms_per_source + r
+            room = f"{rid // 4}-{700 + rid}{'照明' if rid % 2 else '3-721A空调'}"
+            r = Reading(room, round(random.uniform(0, 200), 2), 10.0)
+            r.tag(f"src{s}", monitor.classify_meter(room))
+            items.append(r)
+        lists.append(items)
+    return lists
+
+
+# ---------- 基准 ----------
+
+for _n in (1, 10, 100):
+    def _setup_parse(n=_n):
+        import monitor
+        html = make_page(n)
+        return lambda: monitor.parse_data(html)
+    bench(f"parse_data[{_n}_cards]", number=max(1, 200 // _n))(_setup_parse)
+
+
+@bench("merge_room_data[50x100_rooms]", number=5)
+def _merge():
+    import monitor
+    lists = make_source_lists(50, 100)
+    return lambda: monitor.merge_room_data(lists)
+
+
+@bench("classify_meter[1000_rooms]", number=2)
+def _classify():
+    import monitor
+    import config
+    make_config()
+    cfg = config.Config()
+    rooms = [r.room for r in make_source_lists(10, 100)[0]] * 10
+    return lambda: [monitor.classify_meter(r, cfg=cfg) for r in rooms]
+
+
+@bench("classify_meter[1000_rooms,40_rules,cold]", number=2)
+def _classify_many_rules():
+    import meter_rules
+    items = [(f"kind{i}_keywords", f"{i}号表计, 表{i}-") for i in range(36)]
+    rules = meter_rules.parse_rules(items)
+    rooms = [f"{i // 4}-{700 + i}{'照明' if i % 3 else f'{i % 36}号表计'}" for i in range(1000)]
+
+    def run():
+        # 每次新建分类器，不命中按房间缓存，测的是单次匹配成本
+        clf = meter_rules.MeterClassifier(rules)
+        return [clf.classify(r) for r in rooms]
+    return run
+
+
+@bench("alert_rules_evaluate[10000_rooms]", number=3)
+def _alert_rules():
+    import alert_rules
+    import config
+    make_config()
+    cfg = config.Config()
+    engine = alert_rules.AlertRuleEngine()
+    items = [Reading(f"{i // 4}-{700 + i}A空调", round(random.uniform(0, 200), 2), None, "src0", "ac_a")
+             for i in range(10000)]
+    state = {"t": 0.0}
+
+    def run():
+        state["t"] += 900
+        return engine.evaluate(items, cfg, now=state["t"])
+    return run
+
+
+@bench("parse_number[1000]", number=5)
+def _parse_number():
+    from reading import parse_number
+    values = [f"{random.uniform(0, 200):.2f}度" for _ in range(1000)]
+    return lambda: [parse_number(v) for v in values]
+
+
+@bench("Config()", number=20)
+def _config_ctor():
+    import config
+    make_config()
+    return lambda: config.Config()
+
+
+@bench("get_room_recipients[200_rooms]", number=5)
+def _room_recipients():
+    import config
+    make_config(n_room_mappings=200)
+    cfg = config.Config()
+    rooms = [f"{i // 10}-{700 + i}A空调" for i in range(0, 400, 2)]
+    return lambda: [cfg.get_room_recipients(r) for r in rooms]
+
+
+@bench("get_source_recipients[50_sources]", number=10)
+def _source_recipients():
+    import config
+    sources = make_config(n_sources=50)
+    cfg = config.Config()
+    return lambda: [cfg.get_source_recipients(s) for s in sources]
+
+
+def _ingest_setup(mode, changed):
+    import power_ingest
+    reset_db()
+    power_db.init_db()
+    power_ingest.reset_cache()
+    data = [Reading(f"room{i}", round(100 + i * 0.1, 2), None) for i in range(500)]
+    state = {"tick": 0}
+
+    def run():
+        state["tick"] += 1
+        if changed:
+            for d in data:
+                d.kwh = round(d.kwh - 0.01, 2)
+        power_ingest.write_readings("bench", data, mode=mode)
+    run()  # 预热：建立当前区间
+    return run
+
+
+@bench("power_log_write[every,500_rooms]", number=3)
+def _ingest_every():
+    return _ingest_setup("every", changed=True)
+
+
+@bench("power_log_write[change,500_rooms,unchanged]", number=3)
+def _ingest_unchanged():
+    return _ingest_setup("change", changed=False)
+
+
+@bench("power_log_write[change,500_rooms,changed]", number=3)
+def _ingest_changed():
+    return _ingest_setup("change", changed=True)
+
+
+def _export_setup(fmt, compress):
+    import power_export
+    reset_db()
+    power_db.init_db()
+    conn = power_db.get_db()
+    conn.executemany('''
+        INSERT INTO power_log_interval (source, room, start_date, start_time, end_date, end_time, remain_power, samples)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [("bench", f"room{i % 500}", "2026-01-01", "00:00:00", "2026-01-01", "00:15:00", 100 - i * 0.001, 1 + i % 2)
+          for i in range(100000)])
+    conn.commit()
+    conn.close()
+
+    def run():
+        for _ in power_export.stream_export("readings", fmt, compress=compress, include_archive=False):
+            pass
+    return run
+
+
+@bench("room_ring_record[10000_rooms]", number=10)
+def _room_ring_record():
+    import room_history
+    ring = room_history.RoomRing(96)
+    items = [Reading(f"{i // 100}-{i}空调", float(i % 200), None) for i in range(10000)]
+    return lambda: ring.record(items)
+
+
+@bench("sparklines_last[10000_rooms,48_points]", number=3)
+def _sparklines_last():
+    import room_history
+    ring = room_history.RoomRing(96)
+    items = [Reading(f"{i // 100}-{i}空调", float(i % 200), None) for i in range(10000)]
+    for t in range(96):
+        ring.record(items, now=1767225600 + t * 900)
+    return lambda: ring.last(48)
+
+
+@bench("export_stream[csv,150k_rows]", repeat=3)
+def _export_csv():
+    return _export_setup("csv", compress=False)
+
+
+@bench("export_stream[ndjson+gzip,150k_rows]", repeat=3)
+def _export_ndjson_gzip():
+    return _export_setup("ndjson", compress=True)
+
+
+@bench("import_readings[csv,50k_rows]", repeat=3)
+def _import_csv():
+    import io
+    import power_import
+    reset_db()
+    power_db.init_db()
+    lines = [f"room{i % 500},2026-01-{1 + i // 5000 % 28:02d},{i // 500 % 10:02d}:{i % 60:02d}:00,{100 - i * 0.001:.3f}"
+             for i in range(50000)]
+    body = "\n".join(lines) + "\n"
+    state = {"run": 0}
+
+    def run():
+        # 每次使用新的 source，保证都是新数据（不被去重）
+        state["run"] += 1
+        data = b"source,room,date,time,remain_power\n" + body.replace("room", f"s{state['run']},room").encode()
+        power_import.import_readings(io.BytesIO(data))
+    return run
+
+
+def _status_client():
+    from flask import Flask
+    import monitor
+    from api import api_bp
+    sources = make_config(n_sources=50)
+    monitor.system_status["last_check_data"] = monitor.merge_room_data(make_source_lists(20, 100))
+    monitor.system_status["last_check_time"] = "2026-01-01 00:00:00"
+    monitor.system_status["sources"] = {
+        s: {"last_error": None, "consecutive_failures": 0, "has_cookie": True,
+            "last_ok_time": "2026-01-01 00:00:00", "last_rooms": [f"room{i}" for i in range(40)],
+            "next_run_time": None}
+        for s in sources
+    }
+    app = Flask(__name__)
+    app.register_blueprint(api_bp)
+    return app.test_client()
+
+
+@bench("api_status[2000_rooms]", number=5)
+def _api_status():
+    client = _status_client()
+    return lambda: client.get("/api/status").get_data()
+
+
+@bench("api_status[2000_rooms,delta_idle]", number=20)
+def _api_status_delta():
+    """仪表盘的增量轮询：字段投影 + since=当前版本（本轮无变化）"""
+    import monitor
+    import power_forecast
+    import status_delta
+    client = _status_client()
+    status_delta.publish(monitor.system_status, power_forecast.snapshot())
+    fields = ("is_monitoring,has_cookie,last_check_time,next_check_in,last_error,interval,"
+              "auth_sources,auth_labels,auth_configured,rooms.kwh,rooms.money,"
+              "source_status.has_cookie,source_status.last_error,source_status.last_ok_time")
+    url = f"/api/status?fields={fields}&since={status_delta.versions.version}"
+    client.get(url)  # 首次请求登记配置字段的版本
+    url = f"/api/status?fields={fields}&since={status_delta.versions.version}"
+    return lambda: client.get(url).get_data()
+
+
+def _many_sources_config(n):
+    sources = [f"d{i}" for i in range(n)]
+    auth = "\n".join(f"[auth.{s}]\ncookie = JSESSIONID={s}\nuser_agent = bench\n" for s in sources)
+    rec = "\n".join(f"{s} = {s}@example.com" for s in sources)
+    write_config(f"[system]\ninterval = 900\nauth_sources = {','.join(sources)}\n{auth}\n[notify.sources]\n{rec}\n")
+    return sources
+
+
+@bench("update_auth[ini,2000_sources]", number=3)
+def _update_auth_ini():
+    import config
+    _many_sources_config(2000)
+    cfg = config.Config()
+    return lambda: cfg.update_auth("JSESSIONID=new", "bench", source="d1000")
+
+
+@bench("get_auth+recipients[ini,2000_sources]", number=3)
+def _lookup_ini():
+    import config
+    sources = _many_sources_config(2000)[:200]
+    cfg = config.Config()
+    return lambda: [(cfg.get_auth(s), cfg.get_source_recipients(s)) for s in sources]
+
+
+# 以下基准会把临时库迁移到 source 注册表，需放在最后
+@bench("update_auth[registry,2000_sources]", number=20)
+def _update_auth_registry():
+    import config
+    import source_registry
+    reset_db()
+    _many_sources_config(2000)
+    source_registry.migrate_from_config()
+    cfg = config.Config()
+    return lambda: cfg.update_auth("JSESSIONID=new", "bench", source="d1000")
+
+
+@bench("get_auth+recipients[registry,2000_sources]", number=3)
+def _lookup_registry():
+    import config
+    cfg = config.Config()
+    sources = [f"d{i}" for i in range(200)]
+    return lambda: [(cfg.get_auth(s), cfg.get_source_recipients(s)) for s in sources]
+
+
+# ---------- 运行 ----------
+
+def run_one(setup, number, repeat):
+    fn = setup()
+    fn()  # 预热
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(number):
+            fn()
+        dt = (time.perf_counter() - t0) / number
+        best = dt if best is None else min(best, dt)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--record", action="store_true", help="把本次结果写入基线文件")
+    ap.add_argument("--baseline", default=BASELINE_FILE)
+    ap.add_argument("--tolerance", type=float, default=float(os.environ.get("BENCH_TOLERANCE", 0.25)),
+                    help="允许比基线慢的比例（默认 0.25，可用 BENCH_TOLERANCE 环境变量设置）")
+    ap.add_argument("-k", dest="pattern", default="", help="只运行名称包含该子串的基准")
+    args = ap.parse_args()
+
+    random.seed(20240101)
+    import logging
+    logging.getLogger("System").setLevel(logging.WARNING)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f).get("results", {})
+
+    results = {}
+    regressions = []
+    print(f"{'benchmark':<48}{'per-op':>12}{'baseline':>12}{'ratio':>8}")
+    for name, setup, number, repeat in BENCHMARKS:
+        if args.pattern and args.pattern not in name:
+            continue
+        sec = run_one(setup, number, repeat)
+        results[name] = sec
+        base = baseline.get(name)
+        ratio = sec / base if base else None
+        flag = ""
+        if ratio is not None and ratio > 1 + args.tolerance:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:<48}{sec * 1e3:>10.3f}ms"
+              f"{(base * 1e3 if base else float('nan')):>10.3f}ms"
+              f"{(ratio if ratio else float('nan')):>8.2f}{flag}")
+
+    if args.record:
+        merged = dict(baseline)
+        merged.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "results": merged}, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        print(f"基线已写入 {args.baseline}")
+        return 0
+
+    if regressions:
+        print(f"\n{len(regressions)} 项超出容差 {args.tolerance:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    finally:
+        import shutil
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
@@ -0,0 +1,202 @@
+"""
+zhyd.sec.lit.edu.cn 本地替身服务器（仅用于压测，不访问学校真实系统）
+
+提供 /zhyd/sydl/index 的 mui-card 页面：
+- Cookie JSESSIONID=src<N>（N < --sources）视为有效会话，返回该 source 的 --rooms 个房间
+- 其他/缺失的 JSESSIONID 返回 302 跳转到 authserver（与学校 Cookie 失效时一致）
+- 可注入：平均延迟与抖动、502 比例、30x 跳转比例、"统一身份认证"登录页比例
+- 剩余电量随时间缓慢下降，偶尔充值，便于触发入库/预测/告警路径
+- --update-seconds N：读数每 N 秒才变化一次（学校系统实际的刷新节奏），期间页面逐字节相同
+- --etag：返回 ETag，并对 If-None-Match 命中的请求返回 304
+
+用法：
+    python bench/zhyd_standin.py --port 18080 --sources 2000 --rooms 4 --latency-ms 50 --p502 0.02
+然后在 config.ini [system] 设置 target_url = http://127.0.0.1:18080/zhyd/sydl/index
+（或设置环境变量 DORM_TARGET_URL）。
+"""
+import argparse
+import hashlib
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+AUTH_REDIRECT = "https://ids.lit.edu.cn/authserver/login?service=http%3A%2F%2Fzhyd.sec.lit.edu.cn%2Fzhyd%2Fsydl%2Findex"
+
+LOGIN_PAGE = (
+    '<!DOCTYPE html><html><head><meta charset="utf-8"><title>统一身份认证</title></head>'
+    '<body><form action="/authserver/login" method="post">统一身份认证平台</form></body></html>'
+)
+
+ROOM_KINDS = ["照明", "3-721A空调", "3-721B空调", "空调"]
+
+
+class StandinState:
+    """替身服务器的可调参数与统计"""
+
+    def __init__(self, sources=100, rooms=4, latency_ms=0.0, jitter_ms=0.0,
+                 p502=0.0, p_redirect=0.0, p_auth_page=0.0, drain_per_hour=0.5, seed=1,
+                 update_seconds=0.0, etag=False):
+        self.sources = sources
+        self.rooms = rooms
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.p502 = p502
+        self.p_redirect = p_redirect
+        self.p_auth_page = p_auth_page
+        self.drain_per_hour = drain_per_hour
+        self.update_seconds = update_seconds
+        self.etag = etag
+        self.started = time.time()
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {"ok": 0, "not_modified": 0, "502": 0, "redirect": 0, "auth_page": 0, "bad_cookie": 0}
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    def roll(self):
+        with self.lock:
+            return self.rng.random()
+
+    def source_index(self, cookie_header):
+        for part in (cookie_header or "").split(";"):
+            name, _, value = part.strip().partition("=")
+            if name == "JSESSIONID" and value.startswith("src"):
+                try:
+                    idx = int(value[3:])
+                except ValueError:
+                    return None
+                return idx if 0 <= idx < self.sources else None
+        return None
+
+    def render(self, idx):
+        elapsed = time.time() - self.started
+        if self.update_seconds > 0:
+            elapsed -= elapsed % self.update_seconds
+        hours = elapsed / 3600.0
+        cards = []
+        for r in range(self.rooms):
+            rid = idx * self.rooms + r
+            base = 50.0 + (rid * 37) % 150
+            # 按确定性周期"充值"，让读数有升有降
+            kwh = base - (hours * self.drain_per_hour * (1 + rid % 3)) % base
+            room = f"{idx}-{700 + r}{ROOM_KINDS[rid % len(ROOM_KINDS)]}"
+            cards.append(
+                '<div class="mui-card"><div class="mui-card-content"><ul class="mui-table-view">'
+                f'<li class="mui-table-view-cell">绑定房间：<span class="mui-pull-right">{room}</span></li>'
+                f'<li class="mui-table-view-cell">剩余电量：<span class="mui-pull-right">{kwh:.2f}</span></li>'
+                f'<li class="mui-table-view-cell">剩余金额：<span class="mui-pull-right">{kwh * 0.55:.2f}</span></li>'
+                '</ul></div></div>'
+            )
+        return (
+            '<!DOCTYPE html><html><head><meta charset="utf-8"><title>剩余电量</title></head>'
+            f'<body><div class="mui-content">{"".join(cards)}</div></body></html>'
+        )
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def _send(self, code, body="", headers=None):
+            data = body.encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "text/html;charset=UTF-8")
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if state.latency_ms or state.jitter_ms:
+                delay = max(0.0, state.latency_ms + random.uniform(-state.jitter_ms, state.jitter_ms))
+                time.sleep(delay / 1000.0)
+
+            if not self.path.startswith("/zhyd/sydl/index"):
+                self._send(404, "not found")
+                return
+
+            x = state.roll()
+            if x < state.p502:
+                state.count("502")
+                self._send(502, "<html><body>502 Bad Gateway</body></html>")
+                return
+            x -= state.p502
+            if x < state.p_redirect:
+                state.count("redirect")
+                self._send(302, "", {"Location": AUTH_REDIRECT})
+                return
+            x -= state.p_redirect
+            if x < state.p_auth_page:
+                state.count("auth_page")
+                self._send(200, LOGIN_PAGE)
+                return
+
+            idx = state.source_index(self.headers.get("Cookie"))
+            if idx is None:
+                state.count("bad_cookie")
+                self._send(302, "", {"Location": AUTH_REDIRECT})
+                return
+            body = state.render(idx)
+            if state.etag:
+                tag = '"%s"' % hashlib.md5(body.encode("utf-8")).hexdigest()
+                if self.headers.get("If-None-Match") == tag:
+                    state.count("not_modified")
+                    self.send_response(304)
+                    self.send_header("ETag", tag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                state.count("ok")
+                self._send(200, body, {"ETag": tag})
+                return
+            state.count("ok")
+            self._send(200, body)
+
+    return Handler
+
+
+def start_server(state, host="127.0.0.1", port=0):
+    """在后台线程启动替身服务器，返回 (server, base_url)"""
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/zhyd/sydl/index"
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=18080)
+    ap.add_argument("--sources", type=int, default=100)
+    ap.add_argument("--rooms", type=int, default=4)
+    ap.add_argument("--latency-ms", type=float, default=0.0)
+    ap.add_argument("--jitter-ms", type=float, default=0.0)
+    ap.add_argument("--p502", type=float, default=0.0)
+    ap.add_argument("--p-redirect", type=float, default=0.0)
+    ap.add_argument("--p-auth-page", type=float, default=0.0)
+    ap.add_argument("--update-seconds", type=float, default=0.0, help="读数每 N 秒变化一次（0 为连续变化）")
+    ap.add_argument("--etag", action="store_true", help="返回 ETag 并支持 If-None-Match -> 304")
+    args = ap.parse_args()
+
+    state = StandinState(args.sources, args.rooms, args.latency_ms, args.jitter_ms,
+                         args.p502, args.p_redirect, args.p_auth_page,
+                         update_seconds=args.update_seconds, etag=args.etag)
+    server, url = start_server(state, args.host, args.port)
+    print(f"替身服务器已启动: {url}  (有效 Cookie: JSESSIONID=src0 .. src{args.sources - 1})")
+    try:
+        while True:
+            time.sleep(10)
+            print(f"请求统计: {state.counts}")
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()